@@ -1,3 +1,37 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ContentPiece, GenerationJob, Optimization, ReelIdeas, SemanticCacheEntry, Strategy
+
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress_tokens', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+
+
+@admin.register(SemanticCacheEntry)
+class SemanticCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'endpoint', 'model', 'text', 'hits', 'seconds', 'created_at')
+    list_filter = ('endpoint', 'model')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(Strategy, ReelIdeas)
+class NicheHistoryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'endpoint', 'niche', 'target_audience', 'model', 'created_at')
+    list_filter = ('endpoint', 'model')
+    search_fields = ('niche', 'target_audience')
+
+
+@admin.register(ContentPiece)
+class ContentPieceAdmin(admin.ModelAdmin):
+    list_display = ('id', 'topic', 'post_type', 'tone', 'target_audience', 'created_at')
+    list_filter = ('post_type', 'model')
+    search_fields = ('topic',)
+
+
+@admin.register(Optimization)
+class OptimizationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'optimization_goal', 'model', 'created_at')
+    list_filter = ('optimization_goal', 'model')
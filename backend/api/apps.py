@@ -1,6 +1,21 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import warmup
+        # I job lasciati a meta' dal processo precedente non finiranno mai
+        if warmup.is_server_process():
+            from . import jobs
+            jobs.start_background()
+        # Carica i modelli prima della prima richiesta e li tiene caldi
+        if settings.OLLAMA_WARMUP['ON_STARTUP'] and warmup.is_server_process():
+            warmup.start_background()
+        # Rigenera in background i risultati delle nicchie popolari
+        if settings.PRECOMPUTE['ENABLED'] and warmup.is_server_process():
+            from . import precompute
+            precompute.start_background()
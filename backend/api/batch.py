@@ -0,0 +1,179 @@
+"""
+Generazione di contenuti in blocco (/api/generate-content/batch/).
+
+Invece di una richiesta HTTP per ogni giorno del calendario, il frontend
+manda tutti i brief insieme. Le generazioni partono in parallelo con al
+massimo BATCH_CONTENT['CONCURRENCY'] in volo (lo scheduler decide quante
+arrivano davvero a Ollama insieme); con "pack": true piu' brief brevi
+finiscono in un unico prompt e la risposta viene divisa per elemento. Ogni
+elemento ha il suo esito: un errore non ferma gli altri. I risultati escono
+nell'ordine in cui si completano. Gli elementi riusciti finiscono nello
+storico (api/history.py) come i contenuti di /api/generate-content/.
+"""
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+
+from .generation import agenerate
+from .history import arecord
+from .json_stream import extract_json
+from .ollama_client import OllamaError
+from .prompts import get_content_batch_prompt, get_content_prompt
+from .responses import build_result
+from .scheduler import Overloaded
+from .schemas import CONTENT_SCHEMA, ollama_format
+from .validation import avalidate_result
+
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT = 'generate_content_batch'
+CONTENT_TOKENS = 1500
+# Budget per elemento nei prompt con piu' brief (caption piu' corte)
+PACKED_ITEM_TOKENS = 600
+
+
+def parse_brief(item):
+    """Restituisce (brief, errore) per un elemento di "items" """
+    if not isinstance(item, dict):
+        return None, 'Item must be an object'
+    topic = item.get('topic', '')
+    if not topic or not isinstance(topic, str):
+        return None, 'Topic is required'
+    return {
+        'topic': topic,
+        'post_type': item.get('post_type', 'post'),
+        'tone': item.get('tone', 'professional'),
+        'target_audience': item.get('target_audience', 'General audience'),
+    }, None
+
+
+def pack_briefs(briefs, pack_size, max_topic_chars):
+    """
+    Raggruppa le coppie (indice, brief): i brief brevi a gruppi di pack_size,
+    gli altri da soli. I gruppi restano ordinati per primo indice.
+    """
+    groups = []
+    short = []
+    for index, brief in briefs:
+        if pack_size > 1 and len(brief['topic']) <= max_topic_chars:
+            short.append((index, brief))
+        else:
+            groups.append([(index, brief)])
+    groups.extend(short[i:i + pack_size] for i in range(0, len(short), pack_size))
+    return sorted(groups, key=lambda group: group[0][0])
+
+
+def content_batch_schema(count):
+    return {'type': 'array', 'items': CONTENT_SCHEMA, 'minItems': count, 'maxItems': count}
+
+
+def item_error(index, error, retry_after=None):
+    result = {'index': index, 'success': False, 'error': error}
+    if retry_after is not None:
+        result['retry_after'] = retry_after
+    return result
+
+
+async def _afinish(index, brief, text, cache_mode, model):
+    """Parsing e validazione (con retry mirato) di un singolo contenuto"""
+    result = build_result('content', {'metadata': dict(brief)})(text)
+    result = await avalidate_result(result, 'content', 'generate_content', cache_mode, model)
+    return {'index': index, **await arecord(ENDPOINT, result, model)}
+
+
+async def _asingle(index, brief, cache_mode, model):
+    # Stesso prompt e stesse opzioni di generate_content: la cache e' condivisa
+    prompt = get_content_prompt(
+        brief['topic'], brief['post_type'], brief['tone'], brief['target_audience']
+    )
+    generation = await agenerate(
+        prompt, 0.7, CONTENT_TOKENS, cache_mode, ENDPOINT, ollama_format(CONTENT_SCHEMA), model
+    )
+    return await _afinish(index, brief, generation.text, cache_mode, model)
+
+
+async def _apacked(group, cache_mode, model):
+    """Un prompt per tutto il gruppo; gli elementi mancanti vengono rigenerati da soli"""
+    prompt = get_content_batch_prompt([brief for _, brief in group])
+    generation = await agenerate(
+        prompt, 0.7, PACKED_ITEM_TOKENS * len(group), cache_mode, ENDPOINT,
+        ollama_format(content_batch_schema(len(group))), model
+    )
+    try:
+        values, _ = extract_json(generation.text, list)
+    except ValueError:
+        values = []
+    if not isinstance(values, list):
+        values = []
+
+    results = []
+    for position, (index, brief) in enumerate(group):
+        value = values[position] if position < len(values) else None
+        if isinstance(value, dict):
+            result = {'success': True, 'content': value, 'metadata': dict(brief)}
+            result = await avalidate_result(result, 'content', 'generate_content', cache_mode, model)
+            results.append({'index': index, **await arecord(ENDPOINT, result, model)})
+        else:
+            # Elemento mancante nella risposta del gruppo: generazione singola
+            results.extend(await _agroup([(index, brief)], cache_mode, model))
+    return results
+
+
+async def _agroup(group, cache_mode, model):
+    """Esegue un gruppo isolando gli errori per elemento"""
+    try:
+        if len(group) == 1:
+            index, brief = group[0]
+            return [await _asingle(index, brief, cache_mode, model)]
+        return await _apacked(group, cache_mode, model)
+    except Overloaded as e:
+        return [item_error(index, str(e), e.retry_after) for index, _ in group]
+    except (OllamaError, ValueError) as e:
+        return [item_error(index, str(e)) for index, _ in group]
+    except Exception as e:
+        logger.exception('Batch content group failed')
+        return [item_error(index, str(e)) for index, _ in group]
+
+
+async def abatch_content(items, pack, cache_mode=None, model=None):
+    """Async generator dei risultati per elemento, nell'ordine di completamento"""
+    config = settings.BATCH_CONTENT
+    briefs = []
+    for index, item in enumerate(items):
+        brief, error = parse_brief(item)
+        if error:
+            yield item_error(index, error)
+        else:
+            briefs.append((index, brief))
+
+    groups = pack_briefs(briefs, config['PACK_SIZE'] if pack else 1, config['PACK_MAX_TOPIC_CHARS'])
+    semaphore = asyncio.Semaphore(config['CONCURRENCY'])
+
+    async def run(group):
+        async with semaphore:
+            return await _agroup(group, cache_mode, model)
+
+    tasks = [asyncio.create_task(run(group)) for group in groups]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                yield result
+    finally:
+        # Client disconnesso: i gruppi non ancora finiti non servono, e si aspetta
+        # che la cancellazione liberi le chiamate a Ollama e gli slot dello scheduler
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def batch_summary(results, started):
+    succeeded = sum(1 for result in results if result['success'])
+    return {
+        'total': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'elapsed_seconds': round(time.monotonic() - started, 3),
+    }
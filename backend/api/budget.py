@@ -0,0 +1,170 @@
+"""
+Budget di token di ogni generazione: num_ctx e num_predict di Ollama.
+
+Prima num_ctx era 2048 per tutte le chiamate, anche con num_predict 4000:
+una strategia sforava la finestra di contesto. Ora:
+
+- num_ctx e' fisso per modello (NUM_CTX, num_ctx_for()): Ollama ricarica il
+  modello quando num_ctx cambia, perdendo il warm-up (api/warmup.py) e il
+  prefisso gia' valutato delle sessioni (api/sessions.py). Lo usano tutte le
+  chiamate, warm-up compreso;
+- num_predict per richiesta (plan()): il max_tokens della view e' il minimo,
+  alzato se l'output previsto dallo schema JSON (schemas.py) per
+  OUTPUT_MARGIN e' piu' grande, e abbassato solo se prompt + num_predict non
+  stanno in num_ctx. I token del prompt sono stimati dal testo (SYSTEM_PROMPT
+  + prompt renderizzato da prompts.py) con CHARS_PER_TOKEN, piu' il context
+  della sessione.
+
+Gli input liberi piu' grandi (previous_strategy, idea_content) passano da
+limit_strategy() / limit_text() prima di finire nel prompt. record() logga
+budget e token reali di ogni generazione per tarare i default.
+"""
+import json
+import logging
+import math
+
+from django.conf import settings
+
+from . import metrics
+from .prompts import SYSTEM_PROMPT
+from .schemas import get_schema
+
+
+logger = logging.getLogger(__name__)
+
+TRUNCATED = '\n[... truncated]'
+# Campi del calendario tenuti quando previous_strategy va riassunta
+CALENDAR_SUMMARY_FIELDS = ('day', 'pillar', 'topic')
+
+
+class Plan:
+    """Budget di una generazione"""
+
+    def __init__(self, prompt_tokens, output_tokens, num_predict, num_ctx):
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.num_predict = num_predict
+        self.num_ctx = num_ctx
+
+    def __repr__(self):
+        return (f'Plan(prompt={self.prompt_tokens}, output={self.output_tokens}, '
+                f'num_predict={self.num_predict}, num_ctx={self.num_ctx})')
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / settings.OLLAMA_TOKEN_BUDGET['CHARS_PER_TOKEN'])
+
+
+def schema_tokens(schema):
+    """Token di un JSON che rispetta lo schema, con stringhe di STRING_TOKENS token"""
+    config = settings.OLLAMA_TOKEN_BUDGET
+    kind = schema.get('type')
+    if kind == 'object':
+        # Graffe, e per ogni chiave nome, virgolette e due punti
+        return 2 + sum(
+            estimate_tokens(name) + 2 + schema_tokens(sub) for name, sub in schema.get('properties', {}).items()
+        )
+    if kind == 'array':
+        count = schema.get('maxItems', max(schema.get('minItems', 0), config['ARRAY_ITEMS']))
+        return 2 + count * (1 + schema_tokens(schema.get('items', {})))
+    if kind == 'string':
+        return config['STRING_TOKENS']
+    return 2
+
+
+def num_ctx_for(model):
+    """num_ctx del modello, uguale per tutte le sue chiamate"""
+    sizes = settings.OLLAMA_TOKEN_BUDGET['NUM_CTX']
+    return int(sizes.get(model or settings.OLLAMA_MODEL, sizes['default']))
+
+
+def plan(prompt, max_tokens, endpoint=None, format=None, context=None, model=None):
+    """
+    Il Plan per la chiamata; format e' il "format" di Ollama (lo schema, se
+    e' un dict, altrimenti quello dell'endpoint) e context quello della sessione
+    """
+    config = settings.OLLAMA_TOKEN_BUDGET
+    prompt_tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt) + len(context or ())
+    num_ctx = num_ctx_for(model)
+    if not config['ENABLED']:
+        return Plan(prompt_tokens, None, max_tokens, num_ctx)
+
+    schema = format if isinstance(format, dict) else get_schema(endpoint)
+    output_tokens = schema_tokens(schema) if schema else None
+    num_predict = max_tokens
+    if output_tokens is not None:
+        # La stima dallo schema non sa quanto lunghe sono le stringhe chieste
+        # dal prompt (es. caption di 150-200 parole): puo' solo alzare max_tokens
+        num_predict = max(max_tokens, math.ceil(output_tokens * config['OUTPUT_MARGIN']))
+
+    needed = prompt_tokens + num_predict
+    if needed > num_ctx:
+        # Meglio un output piu' corto che un prompt tagliato da Ollama
+        num_predict = max(num_ctx - prompt_tokens, config['MIN_PREDICT'])
+        logger.warning('%s needs %d tokens, more than num_ctx %d: num_predict lowered to %d',
+                       endpoint, needed, num_ctx, num_predict)
+    return Plan(prompt_tokens, output_tokens, num_predict, num_ctx)
+
+
+def record(endpoint, model, plan, result):
+    """Logga budget e token reali del JSON finale di /api/generate"""
+    generated = result.get('eval_count') or 0
+    exhausted = result.get('done_reason') == 'length' or generated >= plan.num_predict
+    metrics.observe_budget(endpoint, model, plan.num_predict, generated, exhausted)
+    log = logger.warning if exhausted else logger.info
+    log(
+        'Token budget %s %s: prompt %d estimated / %d evaluated, output %s expected / %d budget / %d generated, '
+        'num_ctx %d%s',
+        endpoint, model or settings.OLLAMA_MODEL, plan.prompt_tokens, result.get('prompt_eval_count') or 0,
+        plan.output_tokens, plan.num_predict, generated, plan.num_ctx,
+        ' (output hit num_predict)' if exhausted else ''
+    )
+
+
+def max_input_chars(name):
+    config = settings.OLLAMA_TOKEN_BUDGET
+    return int(config['MAX_INPUT_TOKENS'][name] * config['CHARS_PER_TOKEN'])
+
+
+def limit_text(text, name):
+    """text tagliato (a fine parola) al limite MAX_INPUT_TOKENS[name]"""
+    if not settings.OLLAMA_TOKEN_BUDGET['ENABLED']:
+        return text
+    limit = max_input_chars(name)
+    if len(text) <= limit:
+        return text
+    cut = text[:limit - len(TRUNCATED)]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    logger.info('%s truncated from %d to %d characters', name, len(text), len(cut))
+    return cut + TRUNCATED
+
+
+def _summarize_calendar(strategy):
+    calendar = strategy.get('calendar')
+    if not isinstance(calendar, list):
+        return strategy
+    return {**strategy, 'calendar': [
+        {name: entry[name] for name in CALENDAR_SUMMARY_FIELDS if name in entry} if isinstance(entry, dict) else entry
+        for entry in calendar
+    ]}
+
+
+def limit_strategy(previous_strategy):
+    """
+    previous_strategy come testo per il prompt: JSON compatto, poi (se supera
+    MAX_INPUT_TOKENS) calendario ridotto a giorno/pilastro/argomento, poi tagliato
+    """
+    if not settings.OLLAMA_TOKEN_BUDGET['ENABLED']:
+        return previous_strategy if isinstance(previous_strategy, str) else json.dumps(previous_strategy, indent=2)
+    strategy = previous_strategy
+    if isinstance(strategy, str):
+        try:
+            strategy = json.loads(strategy)
+        except ValueError:
+            return limit_text(strategy, 'previous_strategy')
+
+    text = json.dumps(strategy, separators=(',', ':'), ensure_ascii=False)
+    if len(text) > max_input_chars('previous_strategy') and isinstance(strategy, dict):
+        text = json.dumps(_summarize_calendar(strategy), separators=(',', ':'), ensure_ascii=False)
+    return limit_text(text, 'previous_strategy')
@@ -0,0 +1,260 @@
+"""
+Cache delle risposte di Ollama indicizzata per contenuto.
+
+La chiave e' lo SHA-256 di (model, system, prompt, context, temperature,
+num_predict, num_ctx, format):
+due richieste con lo stesso prompt renderizzato e le stesse opzioni
+condividono la risposta. Il backend si sceglie con settings.OLLAMA_CACHE:
+
+- 'memory': LRU in-process con TTL (default)
+- 'file':   un file JSON per chiave in LOCATION, LRU sul mtime; l'I/O
+            async gira in un thread
+- 'django': il cache framework di Django (alias in LOCATION)
+- 'none':   cache disattivata
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+# Modalita' per-richiesta (campo "cache" nel body)
+BYPASS = 'bypass'    # non legge e non scrive
+REFRESH = 'refresh'  # non legge, ma salva il nuovo risultato
+CACHE_MODES = (BYPASS, REFRESH)
+
+
+def make_cache_key(payload):
+    """Hash del payload /api/generate limitato ai campi che influenzano l'output"""
+    options = payload.get('options', {})
+    material = json.dumps([
+        payload.get('model'),
+        payload.get('system'),
+        payload.get('prompt'),
+        payload.get('context'),
+        options.get('temperature'),
+        options.get('num_predict'),
+        options.get('num_ctx'),
+        payload.get('format'),
+    ], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class BaseCache:
+    """Interfaccia comune: get/set sync, aget/aset async"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value):
+        self.set(key, value)
+
+
+class NullCache(BaseCache):
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache(BaseCache):
+    """LRU in-process con scadenza per TTL"""
+
+    def __init__(self, ttl, max_entries):
+        super().__init__(ttl, max_entries)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FileCache(BaseCache):
+    """Un file per chiave: sopravvive ai riavvii ed e' condiviso tra i worker"""
+
+    # Ogni quante scritture si riconta la directory (altri processi scrivono li')
+    rescan_every = 64
+
+    def __init__(self, ttl, max_entries, location):
+        super().__init__(ttl, max_entries)
+        self.location = location
+        os.makedirs(location, exist_ok=True)
+        self._lock = threading.Lock()
+        self._count = None
+        self._writes = 0
+
+    def _path(self, key):
+        return os.path.join(self.location, f'{key}.json')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                item = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if item['expires'] < time.time():
+            self._remove(path)
+            return None
+        # Il mtime fa da timestamp LRU
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return item['value']
+
+    def set(self, key, value):
+        path = self._path(key)
+        new = not os.path.exists(path)
+        fd, tmp_path = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'expires': time.time() + self.ttl, 'value': value}, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._writes += 1
+            if self._count is not None and new:
+                self._count += 1
+            # Scansione completa solo se il contatore supera il limite o ogni rescan_every scritture
+            if self._count is None or self._count > self.max_entries or self._writes % self.rescan_every == 0:
+                self._evict()
+
+    def clear(self):
+        for entry in os.scandir(self.location):
+            if entry.name.endswith('.json'):
+                self._remove(entry.path)
+        with self._lock:
+            self._count = 0
+
+    async def aget(self, key):
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key, value):
+        await asyncio.to_thread(self.set, key, value)
+
+    def _evict(self):
+        entries = [e for e in os.scandir(self.location) if e.name.endswith('.json')]
+        self._count = len(entries)
+        if len(entries) <= self.max_entries:
+            return
+        # Si scende un 10% sotto il limite, cosi' le scritture successive non riscandiscono subito
+        keep = self.max_entries - self.max_entries // 10
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - keep]:
+            self._remove(entry.path)
+        self._count = keep
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class DjangoCache(BaseCache):
+    """Delega al cache framework (eviction gestita dal backend configurato)"""
+
+    key_prefix = 'ollama:'
+
+    def __init__(self, ttl, max_entries, location):
+        super().__init__(ttl, max_entries)
+        self.alias = location or 'default'
+
+    @property
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key):
+        return self._cache.get(self.key_prefix + key)
+
+    def set(self, key, value):
+        self._cache.set(self.key_prefix + key, value, timeout=self.ttl)
+
+    def clear(self):
+        self._cache.clear()
+
+    async def aget(self, key):
+        return await self._cache.aget(self.key_prefix + key)
+
+    async def aset(self, key, value):
+        await self._cache.aset(self.key_prefix + key, value, timeout=self.ttl)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Istanza del backend configurato in settings.OLLAMA_CACHE"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = settings.OLLAMA_CACHE
+                backend = config.get('BACKEND', 'memory')
+                ttl = config.get('TTL', 3600)
+                max_entries = config.get('MAX_ENTRIES', 512)
+                if backend == 'memory':
+                    _cache = MemoryCache(ttl, max_entries)
+                elif backend == 'file':
+                    _cache = FileCache(ttl, max_entries, config['LOCATION'])
+                elif backend == 'django':
+                    _cache = DjangoCache(ttl, max_entries, config.get('LOCATION'))
+                elif backend == 'none':
+                    _cache = NullCache(ttl, max_entries)
+                else:
+                    raise ValueError(f"Unknown OLLAMA_CACHE backend: {backend}")
+    return _cache
+
+
+@receiver(setting_changed)
+def _reset_cache(setting, **kwargs):
+    global _cache
+    if setting == 'OLLAMA_CACHE':
+        _cache = None
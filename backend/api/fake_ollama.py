@@ -0,0 +1,232 @@
+"""
+Server Ollama finto per i test e per provare il pool di nodi in locale.
+
+Risponde a /api/generate (anche in streaming), /api/embeddings (bag of
+words: testi con parole in comune hanno embedding vicini), /api/tags e
+/api/ps (i modelli che hanno gia' generato) con modelli, ritardo, velocita'
+in token/s e codice di errore configurabili. response puo' essere un testo fisso o una
+funzione del payload, es. Replay() che ripete gli output registrati in
+testdata/ollama_outputs. Per i benchmark: python manage.py fake_ollama.
+Parte su una porta libera in un thread:
+
+    with FakeOllama(models=['llama3.2:1b']) as node:
+        ... settings.OLLAMA_BASE_URLS = [node.url] ...
+"""
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from . import prompts
+
+
+DEFAULT_RESPONSE = '{"message": "Hello, I am working!"}'
+RECORDED_DIR = Path(__file__).resolve().parent / 'testdata' / 'ollama_outputs'
+
+# Template del prompt -> prefisso dei file registrati (content_clean.txt, ...)
+PROMPT_KINDS = [
+    (prompts.STRATEGY_INSTRUCTIONS, 'strategy'),
+    (prompts.REGENERATE_STRATEGY_INSTRUCTIONS, 'strategy'),
+    (prompts.CONTENT_INSTRUCTIONS, 'content'),
+    (prompts.REELS_INSTRUCTIONS, 'reels'),
+    (prompts.OPTIMIZE_IDEA_INSTRUCTIONS, 'optimize'),
+]
+
+
+def split_tokens(text, size=4):
+    """Divide il testo in "token" di size caratteri"""
+    return [text[i:i + size] for i in range(0, len(text), size)] or ['']
+
+
+def embed_words(text, size=768):
+    """Embedding finto: conteggio delle parole in size bucket"""
+    vector = [0.0] * size
+    for word in re.findall(r'\w+', text.lower()):
+        vector[zlib.crc32(word.encode()) % size] += 1.0
+    return vector
+
+
+def prompt_kind(prompt):
+    for instructions, kind in PROMPT_KINDS:
+        if prompt.startswith(instructions):
+            return kind
+    return None
+
+
+class Replay:
+    """Risponde con gli output registrati per il tipo di prompt, a rotazione"""
+
+    def __init__(self, directory=RECORDED_DIR, default=DEFAULT_RESPONSE):
+        self.default = default
+        self.outputs = defaultdict(list)
+        for path in sorted(Path(directory).glob('*.txt')):
+            self.outputs[path.stem.split('_')[0]].append(path.read_text())
+        self._counter = itertools.count()
+
+    def __call__(self, payload):
+        outputs = self.outputs.get(prompt_kind(payload.get('prompt', '')))
+        if not outputs:
+            return self.default
+        return outputs[next(self._counter) % len(outputs)]
+
+
+class FakeOllama:
+    def __init__(self, models=('llama3.2',), response=DEFAULT_RESPONSE, delay=0.0,
+                 tokens_per_second=None, status=200, host='127.0.0.1', port=0):
+        self.models = list(models)
+        self.response = response
+        self.delay = delay
+        self.tokens_per_second = tokens_per_second
+        self.status = status
+        self.requests = []
+        # Stream interrotti perche' il client ha chiuso la connessione
+        self.aborted = 0
+        # Modelli "in memoria" (/api/ps): quelli che hanno gia' generato
+        self.loaded = set()
+        # Come la KV cache di Ollama: il prefisso in comune con la richiesta
+        # precedente non conta in prompt_eval_count
+        self._last_prompt = ''
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='fake-ollama', daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def prompt_eval_count(self, payload):
+        text = payload.get('system', '') + payload.get('prompt', '')
+        with self._lock:
+            shared = len(os.path.commonprefix([text, self._last_prompt]))
+            self._last_prompt = text
+        return (len(text) - shared) // 4
+
+    def generate(self, payload):
+        """Restituisce (status, corpo o lista di chunk) per /api/generate"""
+        with self._lock:
+            self.requests.append(payload)
+        if self.status != 200:
+            return self.status, {'error': f'fake error {self.status}'}
+        model = payload.get('model')
+        if model not in self.models:
+            return 404, {'error': f"model '{model}' not found"}
+        with self._lock:
+            self.loaded.add(model)
+        text = self.response(payload) if callable(self.response) else self.response
+        return 200, split_tokens(text)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/api/tags':
+                    self._json(200, {'models': [{'name': name} for name in fake.models]})
+                elif self.path == '/api/ps':
+                    self._json(200, {'models': [{'name': name} for name in sorted(fake.loaded)]})
+                else:
+                    self._json(404, {'error': 'not found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if self.path == '/api/embeddings':
+                    if payload.get('model') not in fake.models:
+                        self._json(404, {'error': f"model '{payload.get('model')}' not found"})
+                    else:
+                        self._json(200, {'embedding': embed_words(payload.get('prompt', ''))})
+                    return
+                if self.path != '/api/generate':
+                    self._json(404, {'error': 'not found'})
+                    return
+
+                started = time.monotonic()
+                status, body = fake.generate(payload)
+                if fake.delay:
+                    time.sleep(fake.delay)
+                if status != 200:
+                    self._json(status, body)
+                    return
+
+                tokens = body
+                if payload.get('stream', True):
+                    try:
+                        self._stream(payload, tokens, started)
+                    except (BrokenPipeError, ConnectionResetError):
+                        # Come Ollama: il client se n'e' andato, si smette di generare
+                        with fake._lock:
+                            fake.aborted += 1
+                    return
+                if fake.tokens_per_second:
+                    time.sleep(len(tokens) / fake.tokens_per_second)
+                self._json(200, self._final(payload, ''.join(tokens), len(tokens), started))
+
+            def _final(self, payload, text, count, started):
+                elapsed = max(time.monotonic() - started, 1e-6)
+                return {
+                    'model': payload.get('model'),
+                    'response': text,
+                    'done': True,
+                    'eval_count': count,
+                    'eval_duration': int(elapsed * 1e9),
+                    'prompt_eval_count': fake.prompt_eval_count(payload),
+                    'total_duration': int(elapsed * 1e9),
+                }
+
+            def _stream(self, payload, tokens, started):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for token in tokens:
+                    if fake.tokens_per_second:
+                        time.sleep(1 / fake.tokens_per_second)
+                    self._chunk({'model': payload.get('model'), 'response': token, 'done': False})
+                final = self._final(payload, '', len(tokens), started)
+                self._chunk(final)
+                self.wfile.write(b'0\r\n\r\n')
+
+            def _chunk(self, data):
+                line = (json.dumps(data) + '\n').encode()
+                self.wfile.write(f'{len(line):x}\r\n'.encode() + line + b'\r\n')
+                self.wfile.flush()
+
+            def _json(self, status, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
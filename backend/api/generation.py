@@ -0,0 +1,178 @@
+"""
+Punto d'ingresso unico delle view verso Ollama.
+
+Ordine dei livelli: cache delle risposte -> coalescing delle richieste
+identiche in corso (single-flight) -> scheduler (concorrenza, coda a
+priorita') -> client. num_predict lo decide api/budget.py. Gli altri
+livelli si innestano qui senza toccare le view.
+
+Se chi ha chiesto la generazione se ne va (client disconnesso: sotto ASGI
+Django cancella la view) la CancelledError arriva fin qui: la richiesta a
+Ollama viene chiusa, lo slot dello scheduler liberato e la generazione
+contata in dotty_generations_cancelled_total.
+"""
+import asyncio
+import time
+from contextlib import aclosing
+
+from . import budget, hedging, metrics
+from .cache import BYPASS, REFRESH, get_cache, make_cache_key
+from .ollama_client import acall_ollama_raw, astream_ollama, build_payload, clean_json_response
+from .scheduler import get_priority, get_scheduler
+from .singleflight import LeaderGone, flight, process_lock
+from .tiering import record_latency
+
+
+class Generation:
+    """
+    Risultato di una generazione con le informazioni sulla cache.
+    eval_count sono i token prodotti da questa chiamata (0 se da cache o
+    condivisa con un'altra richiesta); context e' il context di Ollama, solo
+    se la generazione e' stata fatta da questa chiamata.
+    """
+
+    def __init__(self, text, cache_status, eval_count=0, context=None):
+        self.text = text
+        self.cache_status = cache_status
+        self.eval_count = eval_count
+        self.context = context
+
+
+def record_stats(scheduler, result):
+    """Passa allo scheduler i token/s misurati da Ollama"""
+    eval_count = result.get('eval_count') or 0
+    eval_duration = result.get('eval_duration') or 0
+    scheduler.record_throughput(eval_count, eval_duration / 1e9)
+
+
+async def agenerate(prompt, temperature=0.7, max_tokens=2000, cache_mode=None, endpoint=None,
+                    format=None, model=None, context=None, priority=None):
+    """
+    Come acall_ollama_raw ma passando da cache, single-flight e scheduler;
+    priority sostituisce la classe di priorita' dell'endpoint
+    """
+    cache = get_cache()
+    plan = budget.plan(prompt, max_tokens, endpoint, format, context, model)
+    key = make_cache_key(build_payload(
+        prompt, temperature, plan.num_predict, format=format, model=model, context=context
+    ))
+    read_cache = cache_mode not in (BYPASS, REFRESH)
+
+    if read_cache:
+        cached = await cache.aget(key)
+        if cached is not None:
+            metrics.observe_cached(endpoint, model, 'hit')
+            return Generation(cached, 'hit')
+
+    slot_priority = get_priority(endpoint) if priority is None else priority
+    eval_count = 0
+    result_context = None
+
+    async def produce():
+        nonlocal eval_count, result_context
+        async with process_lock(key):
+            # Un altro processo potrebbe aver appena finito la stessa generazione
+            if read_cache:
+                cached = await cache.aget(key)
+                if cached is not None:
+                    return cached
+            scheduler = get_scheduler()
+            queued = time.monotonic()
+            stage = metrics.QUEUED
+            try:
+                async with scheduler.aslot(slot_priority, plan.num_predict):
+                    stage = metrics.GENERATING
+                    started = time.monotonic()
+                    if hedging.enabled_for(endpoint):
+                        result = await hedging.acall_hedged(
+                            prompt, temperature, plan.num_predict, format, model, context, endpoint
+                        )
+                    else:
+                        result = await acall_ollama_raw(
+                            prompt, temperature, plan.num_predict, format, model, context
+                        )
+                    record_latency(model, time.monotonic() - started)
+            except asyncio.CancelledError:
+                # Nessuno aspetta piu' la risposta: la richiesta a Ollama e' gia' chiusa
+                metrics.observe_cancelled(endpoint, model, stage)
+                raise
+            record_stats(scheduler, result)
+            budget.record(endpoint, model, plan, result)
+            metrics.observe_generation(endpoint, model, result, started - queued, cache_mode or 'miss')
+            eval_count = result.get('eval_count') or 0
+            result_context = result.get('context')
+            text = result['response']
+            if cache_mode != BYPASS and text:
+                await cache.aset(key, text)
+            return text
+
+    text, shared = await flight.ado(key, produce)
+    if shared:
+        metrics.observe_cached(endpoint, model, 'coalesced')
+        return Generation(text, 'coalesced')
+    return Generation(text, cache_mode or 'miss', eval_count, result_context)
+
+
+async def astream_generate(prompt, temperature=0.7, max_tokens=2000, cache_mode=None, endpoint=None,
+                          format=None, model=None, context=None):
+    """
+    Come astream_ollama; su cache hit o generazione identica gia' in corso
+    emette un unico chunk finale con 'cached': True.
+    """
+    cache = get_cache()
+    plan = budget.plan(prompt, max_tokens, endpoint, format, context, model)
+    key = make_cache_key(build_payload(
+        prompt, temperature, plan.num_predict, format=format, model=model, context=context
+    ))
+
+    if cache_mode not in (BYPASS, REFRESH):
+        cached = await cache.aget(key)
+        if cached is not None:
+            metrics.observe_cached(endpoint, model, 'hit')
+            yield {'response': cached, 'done': True, 'cached': True}
+            return
+
+    while True:
+        future, leader = flight.claim(key)
+        if leader:
+            break
+        try:
+            text = await flight.follow(future)
+        except LeaderGone:
+            continue
+        metrics.observe_cached(endpoint, model, 'coalesced')
+        yield {'response': text, 'done': True, 'cached': True}
+        return
+
+    parts = []
+    scheduler = get_scheduler()
+    stage = metrics.QUEUED
+    try:
+        queued = time.monotonic()
+        async with scheduler.aslot(get_priority(endpoint), plan.num_predict):
+            stage = metrics.GENERATING
+            started = time.monotonic()
+            # aclosing: se il client se ne va la connessione a Ollama si chiude subito
+            async with aclosing(astream_ollama(
+                prompt, temperature, plan.num_predict, format, model, context
+            )) as chunks:
+                async for chunk in chunks:
+                    parts.append(chunk.get('response', ''))
+                    if chunk.get('done'):
+                        record_stats(scheduler, chunk)
+                        budget.record(endpoint, model, plan, chunk)
+                        record_latency(model, time.monotonic() - started)
+                        metrics.observe_generation(endpoint, model, chunk, started - queued, cache_mode or 'miss')
+                    yield chunk
+    except Exception as e:
+        flight.resolve(key, future, exception=e)
+        raise
+    except (asyncio.CancelledError, GeneratorExit):
+        metrics.observe_cancelled(endpoint, model, stage, len(parts))
+        flight.resolve(key, future, exception=LeaderGone())
+        raise
+
+    text = clean_json_response(''.join(parts))
+    flight.resolve(key, future, result=text)
+    if cache_mode != BYPASS and text:
+        await cache.aset(key, text)
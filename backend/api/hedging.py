@@ -0,0 +1,219 @@
+"""
+Richieste "hedged" per gli endpoint brevi (settings.OLLAMA_HEDGING['ENDPOINTS']).
+
+Con piu' nodi nel pool un nodo lento (es. mentre carica o swappa un modello)
+decide il p99: la generazione lo aspetterebbe fino a OLLAMA_TIMEOUT. Qui la
+richiesta parte in streaming sul nodo scelto dal router; se il primo token
+non arriva entro il PERCENTILE dei tempi al primo token osservati (per
+endpoint e modello, negli ultimi WINDOW_SECONDS; INITIAL_DELAY finche' i
+campioni sono meno di MIN_SAMPLES) parte un duplicato su un altro nodo.
+Vince la prima richiesta che produce un token: l'altra viene cancellata, la
+sua connessione si chiude e Ollama smette di generare.
+
+I duplicati hanno un budget: ogni richiesta aggiunge MAX_RATE crediti (fino
+a BURST) e ogni duplicato ne spende uno, cosi' il carico in piu' resta
+attorno a MAX_RATE delle richieste anche quando tutti i nodi sono lenti.
+"""
+import asyncio
+import threading
+import time
+from contextlib import aclosing
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import metrics
+from .ollama_client import BackendError, astream_backend, build_payload, clean_json_response
+from .routing import get_router
+from .tiering import LatencyTracker
+
+
+# Esiti di dotty_hedges_total
+WON = 'won'
+LOST = 'lost'
+DENIED = 'denied'
+UNAVAILABLE = 'unavailable'
+
+
+class HedgeBudget:
+    """Crediti per i duplicati: MAX_RATE per richiesta, al massimo BURST"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.credits = burst
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.credits = min(self.burst, self.credits + self.rate)
+
+    def try_spend(self):
+        with self._lock:
+            if self.credits < 1:
+                return False
+            self.credits -= 1
+            return True
+
+
+_tracker = None
+_budget = None
+_lock = threading.Lock()
+
+
+def get_tracker():
+    """Tempi al primo token per (endpoint, modello)"""
+    global _tracker
+    if _tracker is None:
+        with _lock:
+            if _tracker is None:
+                _tracker = LatencyTracker(settings.OLLAMA_HEDGING['WINDOW_SECONDS'])
+    return _tracker
+
+
+def get_budget():
+    global _budget
+    if _budget is None:
+        with _lock:
+            if _budget is None:
+                config = settings.OLLAMA_HEDGING
+                _budget = HedgeBudget(config['MAX_RATE'], config['BURST'])
+    return _budget
+
+
+@receiver(setting_changed)
+def _reset_hedging(setting, **kwargs):
+    global _tracker, _budget
+    if setting == 'OLLAMA_HEDGING':
+        _tracker = _budget = None
+
+
+def enabled_for(endpoint):
+    config = settings.OLLAMA_HEDGING
+    return config['ENABLED'] and endpoint in config['ENDPOINTS'] and len(get_router().backends) > 1
+
+
+def hedge_delay(endpoint, model):
+    """Secondi di attesa del primo token prima di mandare il duplicato"""
+    config = settings.OLLAMA_HEDGING
+    delay = get_tracker().percentile((endpoint, model), config['PERCENTILE'], config['MIN_SAMPLES'])
+    return config['INITIAL_DELAY'] if delay is None else delay
+
+
+class Attempt:
+    """Una copia della richiesta su un nodo, in un task"""
+
+    def __init__(self, router, payload, exclude):
+        self.backend = None
+        self.first_token = None
+        self.cancelled = False
+        self.started = time.monotonic()
+        # Risolto al primo token o quando il task finisce (anche con errore)
+        self.ready = asyncio.get_running_loop().create_future()
+        self.task = asyncio.ensure_future(self._run(router, payload, exclude))
+        self.task.add_done_callback(self._mark_ready)
+
+    def _mark_ready(self, _):
+        if not self.ready.done():
+            self.ready.set_result(None)
+
+    async def _run(self, router, payload, exclude):
+        parts = []
+        final = {}
+        with router.route(payload['model'], exclude=exclude) as backend:
+            self.backend = backend
+            async with aclosing(astream_backend(backend, payload)) as chunks:
+                async for chunk in chunks:
+                    if self.first_token is None:
+                        self.first_token = time.monotonic() - self.started
+                        self._mark_ready(None)
+                    parts.append(chunk.get('response', ''))
+                    if chunk.get('done'):
+                        final = chunk
+        # Stesso formato della risposta senza stream di acall_ollama_raw
+        return {**final, 'response': clean_json_response(''.join(parts))}
+
+    def cancel(self):
+        # Una volta sola: un secondo cancel() interromperebbe la chiusura della connessione
+        if not self.cancelled:
+            self.cancelled = True
+            self.task.cancel()
+
+    def failed(self):
+        return self.task.done() and not self.task.cancelled() and self.task.exception() is not None
+
+
+async def acall_hedged(prompt, temperature=0.7, max_tokens=2000, format=None, model=None, context=None,
+                       endpoint=None):
+    """
+    Come acall_ollama_raw ma con un duplicato su un altro nodo se il primo
+    token tarda; se un nodo rifiuta la connessione si riprova sul successivo
+    """
+    payload = build_payload(
+        prompt, temperature, max_tokens, stream=True, format=format, model=model, context=context
+    )
+    router = get_router()
+    get_budget().deposit()
+    delay = hedge_delay(endpoint, payload['model'])
+
+    attempts = [Attempt(router, payload, ())]
+    live = list(attempts)
+    hedge = None
+    hedge_at = time.monotonic() + delay
+    try:
+        while True:
+            timeout = None if hedge is not None else max(0, hedge_at - time.monotonic())
+            await asyncio.wait([attempt.ready for attempt in live], timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+            winner = next((a for a in live if a.ready.done() and not a.failed()), None)
+            if winner is not None:
+                break
+
+            for attempt in [a for a in live if a.failed()]:
+                live.remove(attempt)
+                error = attempt.task.exception()
+                tried = [a.backend for a in attempts if a.backend is not None]
+                retryable = isinstance(error, BackendError) and error.retryable
+                if not live and (not retryable or len(tried) >= len(router.backends)):
+                    raise error
+                if not live:
+                    replacement = Attempt(router, payload, tried)
+                    attempts.append(replacement)
+                    live.append(replacement)
+
+            if hedge is None and time.monotonic() >= hedge_at:
+                hedge = _send_hedge(router, payload, attempts, endpoint)
+                if hedge:
+                    live.append(hedge)
+
+        if hedge:
+            metrics.observe_hedge(endpoint, WON if winner is hedge else LOST)
+        if winner.first_token is not None:
+            get_tracker().record((endpoint, payload['model']), winner.first_token)
+            metrics.observe_first_token(endpoint, payload['model'], winner.first_token)
+        # Gli altri si cancellano subito, non a generazione finita
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancel()
+        return await winner.task
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+        pending = [attempt.task for attempt in attempts if not attempt.task.done()]
+        if pending:
+            await asyncio.wait(pending)
+
+
+def _send_hedge(router, payload, attempts, endpoint):
+    """Il duplicato su un altro nodo, False se il pool o il budget non lo permettono"""
+    exclude = [a.backend for a in attempts if a.backend is not None]
+    if not router.has_candidates(payload['model'], exclude):
+        metrics.observe_hedge(endpoint, UNAVAILABLE)
+        return False
+    if not get_budget().try_spend():
+        metrics.observe_hedge(endpoint, DENIED)
+        return False
+    hedge = Attempt(router, payload, exclude)
+    attempts.append(hedge)
+    return hedge
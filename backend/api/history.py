@@ -0,0 +1,184 @@
+"""
+Storico delle generazioni: ogni risposta riuscita di strategia, contenuto,
+reels e ottimizzazione viene salvata (api/models.py) e il suo id finisce in
+metadata.history, cosi' il frontend la rilegge invece di rigenerarla.
+
+La lista (GET /api/history/<kind>/) usa la paginazione keyset su
+(created_at, id): il cursore "next" e' l'ultima riga della pagina e ogni
+pagina costa una query sugli indici, a qualunque profondita'. Con ?fields=
+si scelgono i campi restituiti (di default senza il JSON generato).
+
+Il salvataggio e' best-effort: se il database non risponde (tabella non
+migrata, SQLite bloccato) la generazione viene restituita lo stesso, senza
+metadata.history.
+"""
+import base64
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+
+from .models import ContentPiece, Optimization, ReelIdeas, Strategy
+
+
+logger = logging.getLogger(__name__)
+
+KINDS = {
+    'strategies': Strategy,
+    'content': ContentPiece,
+    'reels': ReelIdeas,
+    'optimizations': Optimization,
+}
+ENDPOINT_KINDS = {
+    'generate_strategy': 'strategies',
+    'regenerate_strategy': 'strategies',
+    'generate_content': 'content',
+    # Ogni elemento riuscito del batch e' una riga a se'
+    'generate_content_batch': 'content',
+    'generate_trending_reels': 'reels',
+    'optimize_idea': 'optimizations',
+}
+# Campo del modello -> nome nel body della risposta, se diverso
+RESPONSE_NAMES = {
+    'idea_content': 'original_idea',
+    'feedback': 'feedback_applied',
+}
+# Filtri della lista, tutti su campi indicizzati
+FILTERS = ('niche', 'target_audience')
+
+
+class InvalidQuery(ValueError):
+    """Parametri della lista non validi (400)"""
+
+
+def _request_fields(model_class, result):
+    values = {**result, **result.get('metadata', {})}
+    fields = {}
+    for name in model_class.REQUEST_FIELDS:
+        value = values.get(RESPONSE_NAMES.get(name, name))
+        if value is None:
+            continue
+        field = model_class._meta.get_field(name)
+        value = str(value)
+        fields[name] = value[:field.max_length] if field.max_length else value
+    return fields
+
+
+def _record(endpoint, result, model):
+    model_class = KINDS[ENDPOINT_KINDS[endpoint]]
+    return model_class.objects.create(
+        endpoint=endpoint,
+        model=model or result.get('metadata', {}).get('model') or settings.OLLAMA_MODEL,
+        result=result[model_class.RESULT_KEY],
+        timings=result.get('timings'),
+        **_request_fields(model_class, result)
+    )
+
+
+async def arecord(endpoint, result, model=None):
+    """
+    Salva result (il body della risposta, gia' con i timings) se l'endpoint
+    ha uno storico; aggiunge metadata.history con id e URL. model serve solo
+    se non e' gia' in metadata.model (es. gli elementi del batch)
+    """
+    if not settings.GENERATION_HISTORY['ENABLED'] or endpoint not in ENDPOINT_KINDS:
+        return result
+    if not result.get('success'):
+        return result
+    try:
+        entry = await sync_to_async(_record)(endpoint, result, model)
+    except Exception:
+        logger.exception('Saving %s to the generation history failed', endpoint)
+        return result
+    kind = ENDPOINT_KINDS[endpoint]
+    result['metadata'] = {**result.get('metadata', {}), 'history': {
+        'kind': kind,
+        'id': entry.pk,
+        'url': reverse('history_detail', args=[kind, entry.pk]),
+    }}
+    return result
+
+
+def encode_cursor(entry):
+    raw = json.dumps([entry['created_at'].isoformat(), entry['id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, pk = json.loads(raw)
+        created_at = parse_datetime(created_at)
+        if created_at is None or not isinstance(pk, int):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise InvalidQuery('Invalid cursor')
+    return created_at, pk
+
+
+def parse_fields(model_class, value):
+    """Campi richiesti con ?fields=a,b (default SUMMARY_FIELDS)"""
+    if not value:
+        return list(model_class.SUMMARY_FIELDS)
+    allowed = ['id', 'endpoint', *model_class.REQUEST_FIELDS, 'model', 'result', 'timings', 'created_at']
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise InvalidQuery(f"Unknown fields: {', '.join(unknown)} (choices: {', '.join(allowed)})")
+    return fields
+
+
+def get_model(kind):
+    try:
+        return KINDS[kind]
+    except KeyError:
+        raise InvalidQuery(f"kind must be one of: {', '.join(KINDS)}")
+
+
+def list_page(kind, params):
+    """
+    Una pagina della lista: (righe, cursore della pagina seguente o None).
+    params sono i query parameter (cursor, limit, fields, niche, target_audience).
+    """
+    model_class = get_model(kind)
+    fields = parse_fields(model_class, params.get('fields'))
+    config = settings.GENERATION_HISTORY
+    try:
+        limit = int(params.get('limit', config['PAGE_SIZE']))
+    except ValueError:
+        raise InvalidQuery('limit must be an integer')
+    limit = max(1, min(limit, config['MAX_PAGE_SIZE']))
+
+    queryset = model_class.objects.order_by('-created_at', '-id')
+    for name in FILTERS:
+        if name in params:
+            if name not in model_class.REQUEST_FIELDS:
+                raise InvalidQuery(f'{kind} cannot be filtered by {name}')
+            queryset = queryset.filter(**{name: params[name]})
+    if params.get('cursor'):
+        created_at, pk = decode_cursor(params['cursor'])
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    # Il cursore ha bisogno di created_at e id anche se non sono tra i campi richiesti
+    columns = list(dict.fromkeys([*fields, 'created_at', 'id']))
+    rows = list(queryset.values(*columns)[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    items = []
+    for row in rows[:limit]:
+        item = {name: row[name] for name in fields}
+        if 'created_at' in item:
+            item['created_at'] = item['created_at'].isoformat()
+        items.append(item)
+    return items, next_cursor
+
+
+def get_entry(kind, pk, fields=None):
+    """Il dettaglio come dict, None se non esiste"""
+    model_class = get_model(kind)
+    fields = parse_fields(model_class, fields) if fields else None
+    entry = model_class.objects.filter(pk=pk).first()
+    return entry.to_dict(fields) if entry is not None else None
@@ -0,0 +1,205 @@
+"""
+Esecuzione in background delle generazioni lunghe.
+
+La view crea un GenerationJob e risponde subito con 202; un thread con un
+event loop di lunga durata esegue il prompt in streaming, al massimo
+settings.JOB_WORKERS job alla volta, aggiornando progress_tokens man mano, e
+salva il risultato nel database. Un solo loop vuol dire un solo client httpx
+(ollama_client.get_async_client) con le sue connessioni, riusate tra i job.
+
+I job vivono nel processo: ognuno porta il servizio che lo esegue
+(settings.JOB_OWNER) e l'avvio del server (BOOT_ID, lo stesso per tutti i
+worker di un master gunicorn). All'avvio un servizio segna FAILED solo i
+propri job QUEUED o RUNNING di un avvio precedente, che non finiranno mai;
+per JOB_MAX_QUEUED contano solo quelli dell'avvio corrente.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import history, metrics
+from .generation import astream_generate
+from .models import GenerationJob
+from .ollama_client import clean_json_response
+from .responses import build_result
+from .scheduler import Overloaded
+from .sessions import attach_session
+from .validation import avalidate_result
+
+
+logger = logging.getLogger(__name__)
+
+# Ogni quanti token aggiornare progress_tokens nel database
+PROGRESS_EVERY = 20
+
+_loop = None
+_loop_lock = threading.Lock()
+# Creato sul loop dei job al primo job
+_slots = None
+
+# Il master gunicorn lo passa ai worker (gunicorn.conf.py), runserver ne
+# genera uno a ogni reload
+BOOT_ID = os.environ.get('JOB_BOOT_ID') or uuid.uuid4().hex
+INTERRUPTED = 'Interrupted by a server restart'
+
+
+class QueueFull(Exception):
+    """Troppi job in attesa"""
+
+
+def get_loop():
+    """L'event loop dei job, avviato in un thread daemon al primo uso"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='generation-jobs', daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+async def acreate_job(kind, prompt, temperature, max_tokens, result_key, extra, cache_mode=None,
+                      output_format=None, model=None, context=None):
+    """Salva il job e lo accoda al pool"""
+    queued = await GenerationJob.objects.filter(
+        status=GenerationJob.QUEUED, owner=settings.JOB_OWNER, boot_id=BOOT_ID
+    ).acount()
+    if queued >= settings.JOB_MAX_QUEUED:
+        raise QueueFull(f'{queued} jobs already queued')
+
+    job = await GenerationJob.objects.acreate(
+        kind=kind,
+        prompt=prompt,
+        options={
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'cache': cache_mode,
+            'format': output_format,
+            'model': model,
+            'context': context,
+        },
+        result_key=result_key,
+        extra=extra,
+        owner=settings.JOB_OWNER,
+        boot_id=BOOT_ID,
+    )
+    submit(job.pk)
+    return job
+
+
+def fail_stale_jobs():
+    """Segna FAILED i job QUEUED/RUNNING di questo servizio lasciati da un avvio precedente"""
+    stale = GenerationJob.objects.filter(
+        status__in=[GenerationJob.QUEUED, GenerationJob.RUNNING], owner=settings.JOB_OWNER
+    ).exclude(boot_id=BOOT_ID)
+    count = stale.update(status=GenerationJob.FAILED, error=INTERRUPTED, finished_at=timezone.now())
+    if count:
+        logger.warning('%d generation jobs interrupted by a restart marked as failed', count)
+    return count
+
+
+def start_background():
+    """fail_stale_jobs fuori da AppConfig.ready, che non deve toccare il database"""
+    def run():
+        try:
+            fail_stale_jobs()
+        except Exception:
+            logger.exception('Could not fail stale generation jobs')
+        finally:
+            close_old_connections()
+
+    thread = threading.Thread(target=run, name='stale-generation-jobs', daemon=True)
+    thread.start()
+    return thread
+
+
+def submit(job_id):
+    # Contesto vuoto: il job non eredita i contextvars della richiesta (asgiref, metriche)
+    return contextvars.Context().run(asyncio.run_coroutine_threadsafe, _arun_submitted(job_id), get_loop())
+
+
+async def _arun_submitted(job_id):
+    """Eseguito sul loop dei job"""
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(settings.JOB_WORKERS)
+    async with _slots:
+        await sync_to_async(close_old_connections)()
+        try:
+            await _arun_job(job_id)
+        except Exception:
+            logger.exception('Generation job %s crashed', job_id)
+        finally:
+            await sync_to_async(close_old_connections)()
+
+
+async def _arun_job(job_id):
+    job = await GenerationJob.objects.aget(pk=job_id)
+    timings = metrics.start_timings(job.kind)
+    jobs = GenerationJob.objects.filter(pk=job_id)
+    await jobs.aupdate(status=GenerationJob.RUNNING, started_at=timezone.now())
+    # Un job segnato FAILED nel frattempo (fail_stale_jobs) resta com'e'
+    running = jobs.filter(status=GenerationJob.RUNNING)
+
+    try:
+        while True:
+            try:
+                tokens, text, context = await _astream_job(job, jobs)
+                break
+            except Overloaded as e:
+                # I job non hanno un client in attesa: si aspetta invece di fallire
+                await asyncio.sleep(e.retry_after)
+
+        build = build_result(job.result_key, job.extra)
+        model = job.options.get('model')
+        result = await avalidate_result(
+            build(text), job.result_key, job.kind, job.options.get('cache'), model
+        )
+        result = metrics.finish(attach_session(result, job.kind, model, context), timings)
+        result = await history.arecord(job.kind, result)
+        await running.aupdate(
+            status=GenerationJob.SUCCEEDED,
+            progress_tokens=tokens,
+            result=result,
+            finished_at=timezone.now(),
+        )
+    except Exception as e:
+        await running.aupdate(
+            status=GenerationJob.FAILED,
+            error=str(e),
+            finished_at=timezone.now(),
+        )
+
+
+async def _astream_job(job, jobs):
+    """
+    Esegue il prompt del job aggiornando progress_tokens: restituisce (token,
+    testo, context di Ollama)
+    """
+    options = job.options
+    parts = []
+    tokens = 0
+    context = None
+    async for chunk in astream_generate(
+        job.prompt, options['temperature'], options['max_tokens'], options.get('cache'), job.kind,
+        options.get('format'), options.get('model'), options.get('context')
+    ):
+        token = chunk.get('response', '')
+        parts.append(token)
+        if chunk.get('done'):
+            tokens = chunk.get('eval_count', tokens)
+            context = chunk.get('context')
+        elif token:
+            tokens += 1
+            if tokens % PROGRESS_EVERY == 0:
+                await jobs.aupdate(progress_tokens=tokens)
+    return tokens, clean_json_response(''.join(parts)), context
@@ -0,0 +1,272 @@
+"""
+Estrattore JSON incrementale e tollerante per l'output dei modelli.
+
+Sostituisce clean_json_response + json.loads: consuma il testo a pezzi man
+mano che arrivano i token, trova l'oggetto o array di primo livello anche se
+circondato da prosa o da ```json, e ripara i difetti tipici:
+
+- commenti // e /* */ (come quello nel template della strategia)
+- virgole finali prima di } o ]
+- output troncato: le stringhe e le parentesi rimaste aperte vengono chiuse,
+  scartando l'ultimo membro incompleto
+
+Se nel testo ci sono piu' valori JSON completi (es. "Here are [10] ideas:"
+prima dell'array vero) vince il piu' lungo; quelli non validi o col tipo
+sbagliato (shape, se indicato) si saltano e si riparte dalla parentesi
+successiva. Una '/' fuori dalle stringhe che non apre un commento resta nel
+testo: {"a": 1/2} non e' JSON valido e non diventa {"a": 12}.
+
+Gli oggetti che sono elementi di un array di primo o secondo livello (le
+idee dei reels, i giorni del calendario, ...) vengono restituiti da feed()
+appena si chiudono.
+"""
+import json
+import re
+
+
+# Dentro una stringa interessano solo le virgolette e i backslash
+_STRING_SPECIAL = re.compile(r'["\\]')
+_START = re.compile(r'[{\[]')
+# Fuori dalle stringhe: tutto cio' che non cambia lo stato del parser
+_PLAIN = re.compile(r'[^"{}\[\],/]+')
+_DECODER = json.JSONDecoder(strict=False)
+
+
+class JSONStreamExtractor:
+    def __init__(self, shape=None):
+        self.shape = shape
+        # Il miglior valore completo visto finora: (lunghezza, valore, riparazioni)
+        self._best = None
+        self._reset()
+
+    def _reset(self):
+        self._buf = []  # pezzi di testo (singoli caratteri fuori dalle stringhe)
+        self._stack = []  # frame: [tipo, inizio nel buffer, chiave dell'array, elementi emessi]
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        # Commenti: None, 'maybe' (visto '/'), 'line' o 'block'
+        self._comment = None
+        self._block_star = False
+        # Ultimo punto in cui il buffer era un prefisso completo
+        self._safe_len = 0
+        self._safe_stack = ()
+        self.repairs = []
+
+    @property
+    def done(self):
+        """True se c'e' un valore completo e nessun altro iniziato dopo"""
+        return self._best is not None and not self._started
+
+    def feed(self, text):
+        """Consuma un pezzo di testo: restituisce gli item completati"""
+        items = []
+        i, n = 0, len(text)
+        while i < n:
+            if not self._started:
+                # Salta la prosa e i ```json prima del JSON
+                match = _START.search(text, i)
+                if match is None:
+                    break
+                i = match.start()
+            elif self._in_string and not self._escape:
+                # Il contenuto delle stringhe si copia a blocchi
+                match = _STRING_SPECIAL.search(text, i)
+                end = match.start() if match else n
+                if end > i:
+                    self._buf.append(text[i:end])
+                    i = end
+                    continue
+            elif not self._in_string and self._comment is None:
+                # Spazi, numeri, ':' e letterali si copiano a blocchi
+                match = _PLAIN.match(text, i)
+                if match:
+                    self._buf.append(match.group())
+                    i = match.end()
+                    continue
+            self._consume(text[i], items)
+            i += 1
+        return items
+
+    def _consume(self, char, items):
+        if not self._started:
+            if char in '{[':
+                self._started = True
+                self._open(char)
+            return
+
+        if self._in_string:
+            self._buf.append(char)
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+            return
+
+        if self._comment == 'maybe':
+            if char == '/':
+                self._comment = 'line'
+                self._note('comment')
+                return
+            if char == '*':
+                self._comment = 'block'
+                self._note('comment')
+                return
+            # Era una barra isolata: resta, cosi' il valore non e' JSON valido
+            self._comment = None
+            self._buf.append('/')
+        if self._comment == 'line':
+            if char == '\n':
+                self._comment = None
+            return
+        if self._comment == 'block':
+            if self._block_star and char == '/':
+                self._comment = None
+            self._block_star = char == '*'
+            return
+
+        if char == '/':
+            self._comment = 'maybe'
+        elif char == '"':
+            self._in_string = True
+            self._buf.append(char)
+        elif char in '{[':
+            self._open(char)
+        elif char in '}]':
+            self._close(char, items)
+        elif char == ',':
+            self._mark_safe()
+            self._buf.append(char)
+        else:
+            self._buf.append(char)
+
+    def _open(self, char):
+        key = None
+        if char == '[' and self._stack and self._stack[-1][0] == '{':
+            key = self._preceding_key()
+        self._buf.append(char)
+        self._stack.append([char, len(self._buf) - 1, key, 0])
+        self._mark_safe()
+
+    def _close(self, char, items):
+        if not self._stack:
+            return
+        # Virgola finale prima della chiusura
+        end = len(self._buf)
+        while end and self._buf[end - 1].isspace():
+            end -= 1
+        if end and self._buf[end - 1] == ',':
+            del self._buf[end - 1:]
+            self._note('trailing_comma')
+
+        kind, start, _, _ = self._stack.pop()
+        self._buf.append('}' if kind == '{' else ']')
+        self._mark_safe()
+
+        if not self._stack:
+            self._complete()
+            return
+
+        parent = self._stack[-1]
+        if kind == '{' and parent[0] == '[' and len(self._stack) <= 2:
+            try:
+                value = json.loads(''.join(self._buf[start:]), strict=False)
+            except ValueError:
+                return
+            items.append({'container': parent[2], 'index': parent[3], 'value': value})
+            parent[3] += 1
+
+    def _complete(self):
+        """Valore di primo livello chiuso: lo si tiene se e' il migliore e si cerca oltre"""
+        text = ''.join(self._buf)
+        try:
+            value = json.loads(text, strict=False)
+        except ValueError:
+            pass
+        else:
+            if self._fits(value) and (self._best is None or len(text) > self._best[0]):
+                self._best = (len(text), value, list(self.repairs))
+        self._reset()
+
+    def _fits(self, value):
+        return self.shape is None or isinstance(value, self.shape)
+
+    def _preceding_key(self):
+        """Chiave dell'oggetto corrente immediatamente prima di ':'"""
+        tail = ''.join(self._buf[-200:]).rstrip()
+        if not tail.endswith(':'):
+            return None
+        tail = tail[:-1].rstrip()
+        if not tail.endswith('"'):
+            return None
+        start = tail.rfind('"', 0, len(tail) - 1)
+        return tail[start + 1:-1] if start != -1 else None
+
+    def _mark_safe(self):
+        self._safe_len = len(self._buf)
+        self._safe_stack = tuple(frame[0] for frame in self._stack)
+
+    def _note(self, repair):
+        if repair not in self.repairs:
+            self.repairs.append(repair)
+
+    def result(self):
+        """Il valore JSON estratto (riparato se troncato); ValueError se impossibile"""
+        # Un valore lasciato a meta' vince solo se e' piu' lungo di quelli completi
+        if self._started and (self._best is None or len(self._buf) > self._best[0]):
+            try:
+                value = self._repaired()
+            except ValueError:
+                if self._best is None:
+                    raise
+            else:
+                if self._fits(value):
+                    self._note('truncated')
+                    return value
+        if self._best is None:
+            raise ValueError('No JSON object or array found')
+        _, value, self.repairs = self._best
+        return value
+
+    def _repaired(self):
+        text = ''.join(self._buf)
+        # Prima si prova a chiudere tutto cosi' com'e'...
+        closing = ('"' if self._in_string else '') + _closers(frame[0] for frame in self._stack)
+        try:
+            return json.loads(text + closing, strict=False)
+        except ValueError:
+            pass
+        # ...altrimenti si torna all'ultimo punto completo
+        safe = ''.join(self._buf[:self._safe_len]).rstrip()
+        if safe.endswith(','):
+            safe = safe[:-1]
+        return json.loads(safe + _closers(self._safe_stack), strict=False)
+
+
+def _closers(kinds):
+    return ''.join('}' if kind == '{' else ']' for kind in reversed(list(kinds)))
+
+
+def extract_json(text, shape=None):
+    """
+    Estrae e ripara il JSON da un testo completo: restituisce (valore,
+    riparazioni). shape (dict o list) e' il tipo atteso del valore.
+    """
+    text = text or ''
+    # Caso comune: JSON gia' valido, al massimo circondato da prosa o fence
+    match = _START.search(text)
+    if match:
+        try:
+            value, end = _DECODER.raw_decode(text, match.start())
+        except ValueError:
+            pass
+        else:
+            if (shape is None or isinstance(value, shape)) and not _START.search(text, end):
+                return value, []
+
+    extractor = JSONStreamExtractor(shape)
+    extractor.feed(text)
+    value = extractor.result()
+    return value, extractor.repairs
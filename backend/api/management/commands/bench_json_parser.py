@@ -0,0 +1,75 @@
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from api.json_stream import JSONStreamExtractor, extract_json
+from api.ollama_client import clean_json_response
+
+
+RECORDED_DIR = Path(__file__).resolve().parents[2] / 'testdata' / 'ollama_outputs'
+
+
+def legacy_parse(text):
+    """Il percorso originale delle view: clean_json_response + json.loads"""
+    return json.loads(clean_json_response(text))
+
+
+def streaming_parse(text, chunk_size):
+    """Il nuovo estrattore alimentato a pezzi, come con i token di Ollama"""
+    extractor = JSONStreamExtractor()
+    items = 0
+    for start in range(0, len(text), chunk_size):
+        items += len(extractor.feed(text[start:start + chunk_size]))
+    return extractor.result(), items
+
+
+class Command(BaseCommand):
+    help = 'Confronta clean_json_response + json.loads con l\'estrattore JSON incrementale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=str(RECORDED_DIR), help='Cartella con gli output registrati (*.txt)')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--chunk-size', type=int, default=4, help='Caratteri per "token" in modalita\' streaming')
+
+    def handle(self, *args, **options):
+        files = sorted(Path(options['dir']).glob('*.txt'))
+        if not files:
+            self.stderr.write(f"No recorded outputs in {options['dir']}")
+            return
+
+        iterations = options['iterations']
+        header = f"{'output':<28}{'legacy':>10}{'extract':>10}{'stream':>10}{'items':>7}  legacy/new"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+
+        legacy_ok = new_ok = 0
+        for path in files:
+            text = path.read_text()
+            legacy_us, legacy_valid = self._time(lambda: legacy_parse(text), iterations)
+            extract_us, extract_valid = self._time(lambda: extract_json(text), iterations)
+            stream_us, _ = self._time(lambda: streaming_parse(text, options['chunk_size']), iterations)
+            items = streaming_parse(text, options['chunk_size'])[1] if extract_valid else 0
+
+            legacy_ok += legacy_valid
+            new_ok += extract_valid
+            self.stdout.write(
+                f"{path.stem:<28}{legacy_us:>8.0f}us{extract_us:>8.0f}us{stream_us:>8.0f}us{items:>7}"
+                f"  {'ok' if legacy_valid else 'FAIL'}/{'ok' if extract_valid else 'FAIL'}"
+            )
+
+        self.stdout.write('')
+        self.stdout.write(f'Parsed as JSON: legacy {legacy_ok}/{len(files)}, extractor {new_ok}/{len(files)}')
+
+    @staticmethod
+    def _time(fn, iterations):
+        """Tempo medio in microsecondi e se la chiamata e' riuscita"""
+        try:
+            fn()
+        except ValueError:
+            return 0, False
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        return (time.perf_counter() - start) / iterations * 1e6, True
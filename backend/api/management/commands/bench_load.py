@@ -0,0 +1,227 @@
+import asyncio
+import itertools
+import json
+import math
+import time
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+from django.urls import reverse
+
+from api.fake_ollama import RECORDED_DIR, FakeOllama, Replay
+from api.warmup import warm_all
+
+
+PREVIOUS_STRATEGY = json.dumps({
+    'content_pillars': [{'name': 'Home Workouts', 'description': 'Quick wins'}],
+    'hashtags': {'niche': ['#homeworkout']},
+})
+
+NICHES = ['Fitness', 'Vegan food', 'Travel', 'Personal finance', 'Photography']
+
+# Nome dell'URL in api/urls.py -> (metodo, body per la richiesta i-esima)
+SCENARIOS = {
+    'health_check': ('GET', None),
+    'test_ollama': ('GET', None),
+    'generate_strategy': ('POST', lambda i: {
+        'niche': NICHES[i % len(NICHES)], 'goals': f'Grow to {1000 + i} followers', 'mode': 'single'
+    }),
+    'regenerate_strategy': ('POST', lambda i: {
+        'previous_strategy': PREVIOUS_STRATEGY, 'feedback': f'More reels, variant {i}', 'mode': 'full'
+    }),
+    'generate_content': ('POST', lambda i: {
+        'topic': f'{NICHES[i % len(NICHES)]} tip #{i}', 'post_type': 'carousel'
+    }),
+    'generate_trending_reels': ('POST', lambda i: {
+        'niche': NICHES[i % len(NICHES)], 'target_audience': f'Audience {i}'
+    }),
+    'optimize_idea': ('POST', lambda i: {
+        'idea_content': f'Morning routine post #{i}', 'optimization_goal': 'engagement'
+    }),
+}
+
+
+def percentile(values, percentile):
+    """Percentile nearest-rank, None senza valori"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(percentile / 100 * len(values)) - 1)]
+
+
+def summarize(samples, elapsed):
+    """Report per endpoint e totale da una lista di (endpoint, status, secondi)"""
+    def stats(rows):
+        latencies = [seconds * 1000 for _, _, seconds in rows]
+        errors = sum(1 for _, status, _ in rows if not 200 <= status < 400)
+        statuses = {}
+        for _, status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'requests': len(rows),
+            'errors': errors,
+            'error_rate': round(errors / len(rows), 4) if rows else 0,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'statuses': statuses,
+        }
+
+    endpoints = {}
+    for name in SCENARIOS:
+        rows = [row for row in samples if row[0] == name]
+        if rows:
+            endpoints[name] = stats(rows)
+    total = stats(samples)
+    total['elapsed_s'] = round(elapsed, 3)
+    total['throughput_rps'] = round(len(samples) / elapsed, 2) if elapsed else None
+    return {'endpoints': endpoints, 'total': total}
+
+
+async def drive(client, names, requests, concurrency=None, rps=None, duration=None, cache=False):
+    """
+    Manda le richieste a rotazione sugli endpoint: con rps a ritmo fisso
+    (open loop), altrimenti con concurrency richieste sempre in volo.
+    Restituisce ([(endpoint, status, secondi)], secondi totali).
+    """
+    samples = []
+    started = time.monotonic()
+    deadline = started + duration if duration else math.inf
+
+    async def one(i):
+        name = names[i % len(names)]
+        method, body = SCENARIOS[name]
+        path = reverse(name)
+        request_started = time.monotonic()
+        try:
+            if method == 'GET':
+                response = await client.get(path)
+            else:
+                data = body(i)
+                if not cache:
+                    data['cache'] = 'bypass'
+                response = await client.post(path, json.dumps(data), content_type='application/json')
+            status = response.status_code
+        except Exception:
+            status = 0
+        samples.append((name, status, time.monotonic() - request_started))
+
+    if rps:
+        tasks = []
+        for i in range(requests):
+            start_at = started + i / rps
+            if start_at >= deadline:
+                break
+            await asyncio.sleep(max(0, start_at - time.monotonic()))
+            tasks.append(asyncio.create_task(one(i)))
+        await asyncio.gather(*tasks)
+    else:
+        counter = itertools.count()
+
+        async def worker():
+            for i in counter:
+                if i >= requests or time.monotonic() >= deadline:
+                    return
+                await one(i)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return samples, time.monotonic() - started
+
+
+class HttpClient:
+    """Stessa interfaccia di django.test.AsyncClient verso un server avviato"""
+
+    def __init__(self, url):
+        self.client = httpx.AsyncClient(base_url=url, timeout=settings.OLLAMA_TIMEOUT)
+
+    async def get(self, path):
+        return await self.client.get(path)
+
+    async def post(self, path, data, content_type):
+        return await self.client.post(path, content=data, headers={'Content-Type': content_type})
+
+
+class Command(BaseCommand):
+    help = ('Benchmark di carico sugli endpoint con un Ollama finto che ripete gli output registrati: '
+            'p50/p95/p99, throughput e tasso di errore')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', default=','.join(SCENARIOS),
+                            help='Nomi degli URL da chiamare, separati da virgole')
+        parser.add_argument('--requests', type=int, default=70, help='Richieste totali')
+        parser.add_argument('--duration', type=float, default=None, help='Secondi massimi')
+        parser.add_argument('--concurrency', type=int, default=4, help='Richieste in volo (closed loop)')
+        parser.add_argument('--rps', type=float, default=None, help='Richieste al secondo (open loop)')
+        parser.add_argument('--cache', action='store_true', help='Usa la cache delle risposte (default bypass)')
+        parser.add_argument('--url', default=None,
+                            help='Server gia\' avviato (es. http://localhost:8000) invece dell\'app in-process')
+        parser.add_argument('--dir', default=str(RECORDED_DIR), help='Output registrati da ripetere')
+        parser.add_argument('--delay', type=float, default=0.0, help='Latenza del primo token dell\'Ollama finto')
+        parser.add_argument('--tokens-per-second', type=float, default=None,
+                            help='Velocita\' dell\'Ollama finto (default istantaneo)')
+        parser.add_argument('--json', default=None, help='Scrive il report anche in questo file')
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(unknown)} (choices: {', '.join(SCENARIOS)})")
+        load = dict(
+            requests=options['requests'], concurrency=options['concurrency'], rps=options['rps'],
+            duration=options['duration'], cache=options['cache'],
+        )
+
+        if options['url']:
+            samples, elapsed = asyncio.run(self._remote(options['url'], names, load))
+        else:
+            samples, elapsed = self._in_process(names, load, options)
+
+        report = summarize(samples, elapsed)
+        self._print(report)
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    async def _remote(self, url, names, load):
+        client = HttpClient(url)
+        try:
+            return await drive(client, names, **load)
+        finally:
+            await client.client.aclose()
+
+    def _in_process(self, names, load, options):
+        """L'app Django gira nel processo, Ollama e' un FakeOllama su localhost"""
+        models = sorted(set(settings.OLLAMA_MODELS.values()))
+        fake = FakeOllama(
+            models=models, response=Replay(options['dir']), delay=options['delay'],
+            tokens_per_second=options['tokens_per_second']
+        )
+        with fake, override_settings(
+            OLLAMA_BASE_URLS=[fake.url],
+            OLLAMA_BACKEND_MODELS={},
+            OLLAMA_ROUTING={**settings.OLLAMA_ROUTING, 'HEALTH_CHECK_INTERVAL': 0},
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        ):
+            warm_all(models)
+            return asyncio.run(drive(AsyncClient(), names, **load))
+
+    def _print(self, report):
+        header = f"{'endpoint':<26}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        rows = list(report['endpoints'].items()) + [('total', report['total'])]
+        for name, stats in rows:
+            latencies = ''.join(
+                f"{stats[key]:>10.1f}" if stats[key] is not None else f"{'-':>10}"
+                for key in ('p50_ms', 'p95_ms', 'p99_ms')
+            )
+            self.stdout.write(f"{name:<26}{stats['requests']:>9}{stats['errors']:>8}{latencies}")
+        total = report['total']
+        self.stdout.write('')
+        self.stdout.write(
+            f"Throughput: {total['throughput_rps']} req/s in {total['elapsed_s']}s, "
+            f"error rate {total['error_rate']:.1%}"
+        )
@@ -0,0 +1,78 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.ollama_client import build_payload, get_sync_session
+from api.prompts import CONTENT_INSTRUCTIONS, SYSTEM_PROMPT, get_content_prompt
+from api.routing import get_router
+
+
+TOPICS = [
+    ('Morning workout routine', 'reel', 'energetic', 'Busy professionals'),
+    ('Post-workout meal ideas', 'carousel', 'friendly', 'Gym beginners'),
+    ('Rest day myths', 'post', 'educational', 'Runners'),
+    ('Home yoga setup', 'reel', 'calm', 'Remote workers'),
+    ('Protein on a budget', 'carousel', 'practical', 'Students'),
+]
+
+
+def legacy_payload(prompt, model):
+    """Layout originale: dati del cliente in testa e istruzioni dopo, tutto nel prompt"""
+    suffix = prompt[len(CONTENT_INSTRUCTIONS):]
+    prompt = suffix + '\n' + SYSTEM_PROMPT + '\n' + CONTENT_INSTRUCTIONS
+    payload = build_payload(prompt, max_tokens=1, model=model)
+    del payload['system']
+    return payload
+
+
+def prefix_payload(prompt, model):
+    """Layout attuale: SYSTEM_PROMPT e istruzioni come prefisso comune"""
+    return build_payload(prompt, max_tokens=1, model=model)
+
+
+class Command(BaseCommand):
+    help = 'Misura prompt_eval di Ollama con il layout dei prompt originale e con il prefisso statico'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=len(TOPICS), help='Richieste per layout')
+        parser.add_argument('--model', default=None, help='Default settings.OLLAMA_MODEL')
+
+    def handle(self, *args, **options):
+        model = options['model'] or settings.OLLAMA_MODEL
+        header = f"{'layout':<10}{'calls':>6}{'prompt words':>14}{'evaluated':>11}{'eval ms':>10}{'first ms':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+
+        for name, make_payload in (('legacy', legacy_payload), ('prefix', prefix_payload)):
+            samples = []
+            for i in range(options['runs']):
+                prompt = get_content_prompt(*TOPICS[i % len(TOPICS)])
+                samples.append(self._call(make_payload(prompt, model)))
+
+            # La prima chiamata trova la cache vuota (o col layout precedente)
+            warm = samples[1:] or samples
+            words = sum(count for count, _, _ in samples) / len(samples)
+            evaluated = sum(count for _, count, _ in warm) / len(warm)
+            eval_ms = sum(ms for _, _, ms in warm) / len(warm)
+            self.stdout.write(
+                f'{name:<10}{len(samples):>6}{words:>14.0f}{evaluated:>11.0f}{eval_ms:>10.1f}{samples[0][2]:>10.1f}'
+            )
+
+        self.stdout.write('')
+        self.stdout.write('evaluated/eval ms: media delle chiamate dopo la prima (prompt_eval_count/_duration)')
+
+    def _call(self, payload):
+        """(parole del prompt, prompt_eval_count, prompt_eval_duration in ms)"""
+        with get_router().route(payload['model']) as backend:
+            started = time.monotonic()
+            response = get_sync_session().post(
+                f'{backend.url}/api/generate', json=payload,
+                timeout=(settings.OLLAMA_CONNECT_TIMEOUT, settings.OLLAMA_TIMEOUT)
+            )
+            response.raise_for_status()
+            result = response.json()
+        duration = result.get('prompt_eval_duration')
+        eval_ms = duration / 1e6 if duration else (time.monotonic() - started) * 1000
+        text = payload.get('system', '') + payload['prompt']
+        return len(text.split()), result.get('prompt_eval_count', 0), eval_ms
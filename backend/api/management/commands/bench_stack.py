@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+PROFILES = ['dotty_backend.settings', 'dotty_backend.settings_api']
+
+# Gira in un interprete nuovo per profilo: import e setup partono da zero.
+# La richiesta (POST senza feedback -> 400) attraversa middleware, URL e view
+# senza toccare Ollama ne' il database.
+CHILD = r'''
+import asyncio, json, os, sys, time
+
+started = time.perf_counter()
+import django
+django.setup()
+from django.conf import settings
+from django.test import AsyncClient
+setup_seconds = time.perf_counter() - started
+
+requests = int(sys.argv[1])
+client = AsyncClient()
+body = json.dumps({})
+
+async def one():
+    return await client.post('/api/regenerate-strategy/', body, content_type='application/json')
+
+async def run():
+    # La prima richiesta carica i middleware e gli URL
+    first_started = time.perf_counter()
+    response = await one()
+    first = time.perf_counter() - first_started
+    samples = []
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        await one()
+        samples.append(time.perf_counter() - request_started)
+    return response.status_code, first, samples
+
+status, first, samples = asyncio.run(run())
+samples.sort()
+print(json.dumps({
+    'apps': len(settings.INSTALLED_APPS),
+    'middleware': len(settings.MIDDLEWARE),
+    'modules': len(sys.modules),
+    'setup_ms': setup_seconds * 1000,
+    'first_request_ms': first * 1000,
+    'request_mean_us': sum(samples) / len(samples) * 1e6,
+    'request_p50_us': samples[len(samples) // 2] * 1e6,
+    'status': status,
+}))
+'''
+
+
+def measure(profile, requests):
+    """Tempi di setup e di richiesta di un profilo, in un processo separato"""
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': profile, 'OLLAMA_WARMUP_ON_STARTUP': 'false'}
+    process = subprocess.run(
+        [sys.executable, '-c', CHILD, str(requests)], env=env, cwd=settings.BASE_DIR,
+        capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        raise CommandError(f'{profile} failed:\n{process.stderr}')
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+class Command(BaseCommand):
+    help = ('Confronta il profilo completo e quello solo API (dotty_backend.settings_api): '
+            'tempo di import/setup e overhead per richiesta su /api/')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Richieste per profilo')
+        parser.add_argument('--profiles', default=','.join(PROFILES), help='Moduli di settings, separati da virgole')
+
+    def handle(self, *args, **options):
+        header = (f"{'profile':<30}{'apps':>6}{'mw':>4}{'modules':>9}{'setup ms':>10}"
+                  f"{'first ms':>10}{'mean us':>10}{'p50 us':>10}")
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for profile in options['profiles'].split(','):
+            result = measure(profile.strip(), options['requests'])
+            self.stdout.write(
+                f"{profile.strip():<30}{result['apps']:>6}{result['middleware']:>4}{result['modules']:>9}"
+                f"{result['setup_ms']:>10.1f}{result['first_request_ms']:>10.1f}"
+                f"{result['request_mean_us']:>10.0f}{result['request_p50_us']:>10.0f}"
+            )
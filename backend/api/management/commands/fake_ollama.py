@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.fake_ollama import RECORDED_DIR, FakeOllama, Replay
+
+
+class Command(BaseCommand):
+    help = 'Avvia un server Ollama finto che ripete gli output registrati (per benchmark senza rete)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=11435)
+        parser.add_argument('--dir', default=str(RECORDED_DIR), help='Cartella con gli output registrati (*.txt)')
+        parser.add_argument('--delay', type=float, default=0.0, help='Secondi prima del primo token')
+        parser.add_argument('--tokens-per-second', type=float, default=None)
+        parser.add_argument('--model', action='append', dest='models',
+                            help='Modello servito (ripetibile, default i modelli di OLLAMA_MODELS)')
+
+    def handle(self, *args, **options):
+        models = options['models'] or sorted(set(settings.OLLAMA_MODELS.values()))
+        server = FakeOllama(
+            models=models, response=Replay(options['dir']), delay=options['delay'],
+            tokens_per_second=options['tokens_per_second'], host=options['host'], port=options['port']
+        )
+        with server:
+            self.stdout.write(f"Fake Ollama on {server.url} serving {', '.join(models)} (Ctrl-C to stop)")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,54 @@
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.precompute import SPECS, aprecompute, due, entry_age, popular_niches
+
+
+class Command(BaseCommand):
+    help = 'Precalcola trending reels e strategie di base per le nicchie piu\' richieste'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', action='append', dest='endpoints', choices=sorted(SPECS),
+                            help='Endpoint da precalcolare (ripetibile, default PRECOMPUTE["ENDPOINTS"])')
+        parser.add_argument('--niche', action='append', dest='niches',
+                            help='Nicchia da precalcolare (ripetibile, default le nicchie popolari)')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Quante nicchie popolari (default PRECOMPUTE["POPULAR_LIMIT"])')
+        parser.add_argument('--force', action='store_true',
+                            help='Rigenera anche i risultati non ancora scaduti')
+        parser.add_argument('--list', action='store_true',
+                            help='Mostra le nicchie e l\'eta\' dei risultati senza generare')
+
+    def handle(self, *args, **options):
+        if settings.OLLAMA_CACHE['BACKEND'] == 'memory':
+            self.stderr.write("OLLAMA_CACHE backend is 'memory': the results stay in this process")
+
+        endpoints = options['endpoints'] or [e for e in settings.PRECOMPUTE['ENDPOINTS'] if e in SPECS]
+        niches = options['niches'] or popular_niches(options['limit'])
+        if options['list']:
+            for niche in niches:
+                for endpoint in endpoints:
+                    age = entry_age(endpoint, niche)
+                    self.stdout.write(f"{endpoint:<28}{niche:<32}{'-' if age is None else f'{age:.0f}s':>10}")
+            return
+
+        if options['force'] or options['niches']:
+            items = [(endpoint, niche) for niche in niches for endpoint in endpoints]
+        else:
+            items = [item for item in due(options['limit']) if item[0] in endpoints]
+        failed = 0
+        for endpoint, niche in items:
+            try:
+                entry = async_to_sync(aprecompute)(endpoint, niche, options['force'])
+            except Exception as e:
+                entry, error = None, str(e)
+            else:
+                error = 'invalid output'
+            if entry is None:
+                failed += 1
+                self.stderr.write(f'{endpoint:<28}{niche:<32}  FAILED: {error}')
+            else:
+                self.stdout.write(f"{endpoint:<28}{niche:<32}{entry['seconds']:>8.2f}s")
+        if failed:
+            self.stderr.write(f'{failed} precompute(s) failed')
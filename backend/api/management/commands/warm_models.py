@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.warmup import warm_all
+
+
+class Command(BaseCommand):
+    help = 'Carica i modelli Ollama su ogni nodo del pool (warm-up)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='models',
+                            help='Modello da caricare (ripetibile, default OLLAMA_WARMUP["MODELS"])')
+        parser.add_argument('--keep-warm', type=float, default=0, metavar='SECONDS',
+                            help='Ripete il warm-up ogni SECONDS secondi invece di uscire')
+
+    def handle(self, *args, **options):
+        models = options['models'] or settings.OLLAMA_WARMUP['MODELS']
+        while True:
+            failed = 0
+            for result in warm_all(models):
+                if result['ok']:
+                    self.stdout.write(f"{result['backend']:<32}{result['model']:<20}{result['seconds']:>8.2f}s")
+                else:
+                    failed += 1
+                    self.stderr.write(f"{result['backend']:<32}{result['model']:<20}  FAILED: {result['error']}")
+            if not options['keep_warm']:
+                break
+            time.sleep(options['keep_warm'])
+        if failed:
+            self.stderr.write(f'{failed} warm-up(s) failed')
@@ -0,0 +1,389 @@
+"""
+Metriche delle generazioni in formato Prometheus (GET /metrics) e blocco
+"timings" nelle risposte.
+
+Per ogni generazione fatta da Ollama si registrano, per endpoint e modello,
+i tempi restituiti da /api/generate (total, load, prompt_eval, eval), i token
+e i token/s; lato Django l'attesa nella coda dello scheduler, il parsing del
+JSON (con l'esito: ok, repaired, failed) e la durata della richiesta.
+
+I Timings della richiesta in corso stanno in una ContextVar: le chiamate di
+una pipeline o di un batch (anche in task paralleli) si sommano nello stesso
+blocco senza passarlo a ogni funzione.
+
+Il registro e' in memoria, per processo: con piu' processi ogni scrape
+vedrebbe un processo a caso e i contatori tornerebbero indietro. Per questo
+gunicorn.conf.py impone un solo worker.
+"""
+import contextvars
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from .json_stream import extract_json
+
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+# Esiti del parsing del JSON generato
+PARSE_OK = 'ok'
+PARSE_REPAIRED = 'repaired'
+PARSE_FAILED = 'failed'
+
+# Fasi in cui una generazione puo' essere cancellata
+QUEUED = 'queued'
+GENERATING = 'generating'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_labels(self.labels, key)} {_number(value)}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[labels] = (counts, total + value)
+
+    def count(self, *labels):
+        with self._lock:
+            item = self._values.get(labels)
+            return item[0][-1] if item else 0
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = [
+            f'{self.name}_bucket{_labels(self.labels, key, [("le", _number(bound))])} {count}'
+            for bound, count in zip(self.buckets, counts)
+        ]
+        lines.append(f'{self.name}_sum{_labels(self.labels, key)} {_number(total)}')
+        lines.append(f'{self.name}_count{_labels(self.labels, key)} {counts[-1]}')
+        return lines
+
+
+class Gauge(Metric):
+    """Valore letto al momento dello scrape da una funzione"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, read):
+        super().__init__(name, help)
+        self.read = read
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}',
+                f'{self.name} {_number(self.read())}']
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def _scheduler():
+    from .scheduler import get_scheduler
+    return get_scheduler()
+
+
+REGISTRY = Registry()
+
+GENERATIONS = REGISTRY.register(Counter(
+    'dotty_generations_total', 'Generations by cache outcome (miss, hit, coalesced, ...)',
+    ('endpoint', 'model', 'cache')
+))
+OLLAMA_TOTAL = REGISTRY.register(Histogram(
+    'dotty_ollama_total_seconds', 'Ollama total_duration per generation', ('endpoint', 'model')
+))
+OLLAMA_LOAD = REGISTRY.register(Histogram(
+    'dotty_ollama_load_seconds', 'Ollama load_duration (model loading) per generation', ('endpoint', 'model')
+))
+OLLAMA_PROMPT_EVAL = REGISTRY.register(Histogram(
+    'dotty_ollama_prompt_eval_seconds', 'Ollama prompt_eval_duration per generation', ('endpoint', 'model')
+))
+OLLAMA_EVAL = REGISTRY.register(Histogram(
+    'dotty_ollama_eval_seconds', 'Ollama eval_duration per generation', ('endpoint', 'model')
+))
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    'dotty_ollama_prompt_tokens', 'Prompt tokens evaluated (prompt_eval_count)', ('endpoint', 'model'),
+    TOKEN_BUCKETS
+))
+GENERATED_TOKENS = REGISTRY.register(Histogram(
+    'dotty_ollama_generated_tokens', 'Tokens generated (eval_count)', ('endpoint', 'model'), TOKEN_BUCKETS
+))
+TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    'dotty_ollama_tokens_per_second', 'Generation throughput (eval_count / eval_duration)',
+    ('endpoint', 'model'), RATE_BUCKETS
+))
+QUEUE_WAIT = REGISTRY.register(Histogram(
+    'dotty_queue_wait_seconds', 'Time waiting for a scheduler slot', ('endpoint',)
+))
+PARSE_SECONDS = REGISTRY.register(Histogram(
+    'dotty_json_parse_seconds', 'Time spent parsing generated JSON', ('endpoint',),
+    (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+))
+PARSES = REGISTRY.register(Counter(
+    'dotty_json_parse_total', 'Parsed generations by outcome (ok, repaired, failed)', ('endpoint', 'outcome')
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'dotty_request_seconds', 'Duration of generation requests', ('endpoint',)
+))
+EMBED_SECONDS = REGISTRY.register(Histogram(
+    'dotty_embedding_seconds', 'Time to embed a request for the semantic cache', ('endpoint',)
+))
+SEMANTIC_LOOKUPS = REGISTRY.register(Counter(
+    'dotty_semantic_cache_lookups_total', 'Semantic cache lookups by outcome (hit, miss)', ('endpoint', 'outcome')
+))
+SEMANTIC_SAVED_SECONDS = REGISTRY.register(Counter(
+    'dotty_semantic_cache_saved_seconds_total', 'Generation time saved by semantic cache hits', ('endpoint',)
+))
+CANCELLED = REGISTRY.register(Counter(
+    'dotty_generations_cancelled_total', 'Generations aborted because nobody waited for them anymore',
+    ('endpoint', 'model', 'stage')
+))
+CANCELLED_TOKENS = REGISTRY.register(Counter(
+    'dotty_cancelled_tokens_total', 'Tokens streamed by Ollama for generations then cancelled', ('endpoint', 'model')
+))
+HEDGES = REGISTRY.register(Counter(
+    'dotty_hedges_total', 'Hedged requests by outcome (won, lost, denied, unavailable)', ('endpoint', 'outcome')
+))
+FIRST_TOKEN = REGISTRY.register(Histogram(
+    'dotty_first_token_seconds', 'Time to the first token of hedged requests', ('endpoint', 'model')
+))
+BUDGET_USED = REGISTRY.register(Histogram(
+    'dotty_token_budget_used_ratio', 'Generated tokens / num_predict of the token budget', ('endpoint', 'model'),
+    (0.1, 0.25, 0.5, 0.75, 0.9, 1)
+))
+BUDGET_EXHAUSTED = REGISTRY.register(Counter(
+    'dotty_token_budget_exhausted_total', 'Generations stopped by num_predict', ('endpoint', 'model')
+))
+REGISTRY.register(Gauge('dotty_scheduler_active', 'Generations running on Ollama', lambda: _scheduler().active))
+REGISTRY.register(Gauge('dotty_scheduler_queued', 'Generations waiting for a slot', lambda: _scheduler().queued))
+
+
+class Timings:
+    """Tempi e token di una richiesta, sommati su tutte le sue generazioni"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.monotonic()
+        self.generations = 0
+        self.cached = 0
+        self.queue = 0.0
+        self.load = 0.0
+        self.prompt_eval = 0.0
+        self.eval = 0.0
+        self.ollama = 0.0
+        self.parse = 0.0
+        self.prompt_tokens = 0
+        self.generated_tokens = 0
+
+    def to_dict(self):
+        return {
+            'total': round(time.monotonic() - self.started, 3),
+            'queue': round(self.queue, 3),
+            'ollama': round(self.ollama, 3),
+            'load': round(self.load, 3),
+            'prompt_eval': round(self.prompt_eval, 3),
+            'eval': round(self.eval, 3),
+            'parse': round(self.parse, 4),
+            'prompt_tokens': self.prompt_tokens,
+            'generated_tokens': self.generated_tokens,
+            'tokens_per_second': round(self.generated_tokens / self.eval, 1) if self.eval else None,
+            'generations': self.generations,
+            'cached': self.cached,
+        }
+
+
+_current = contextvars.ContextVar('dotty_timings', default=None)
+
+
+def start_timings(endpoint):
+    """Nuovi Timings per la richiesta corrente"""
+    return activate(Timings(endpoint))
+
+
+def activate(timings):
+    """Rende timings quelli correnti (es. all'inizio di uno stream)"""
+    _current.set(timings)
+    return timings
+
+
+def current_timings():
+    return _current.get()
+
+
+def _endpoint(endpoint):
+    timings = current_timings()
+    return endpoint or (timings.endpoint if timings else None) or 'unknown'
+
+
+def observe_cached(endpoint, model, cache_status):
+    """Generazione servita da cache o condivisa con un'altra richiesta"""
+    GENERATIONS.inc(_endpoint(endpoint), model or settings.OLLAMA_MODEL, cache_status)
+    timings = current_timings()
+    if timings is not None:
+        timings.cached += 1
+
+
+def observe_generation(endpoint, model, result, queue_seconds, cache_status='miss'):
+    """Registra i campi di timing del JSON finale di /api/generate"""
+    endpoint = _endpoint(endpoint)
+    model = model or settings.OLLAMA_MODEL
+    seconds = {
+        field: (result.get(f'{field}_duration') or 0) / 1e9
+        for field in ('total', 'load', 'prompt_eval', 'eval')
+    }
+    prompt_tokens = result.get('prompt_eval_count') or 0
+    generated_tokens = result.get('eval_count') or 0
+
+    GENERATIONS.inc(endpoint, model, cache_status)
+    QUEUE_WAIT.observe(queue_seconds, endpoint)
+    OLLAMA_TOTAL.observe(seconds['total'], endpoint, model)
+    OLLAMA_LOAD.observe(seconds['load'], endpoint, model)
+    OLLAMA_PROMPT_EVAL.observe(seconds['prompt_eval'], endpoint, model)
+    OLLAMA_EVAL.observe(seconds['eval'], endpoint, model)
+    PROMPT_TOKENS.observe(prompt_tokens, endpoint, model)
+    GENERATED_TOKENS.observe(generated_tokens, endpoint, model)
+    if seconds['eval'] > 0:
+        TOKENS_PER_SECOND.observe(generated_tokens / seconds['eval'], endpoint, model)
+
+    timings = current_timings()
+    if timings is not None:
+        timings.generations += 1
+        timings.queue += queue_seconds
+        timings.ollama += seconds['total']
+        timings.load += seconds['load']
+        timings.prompt_eval += seconds['prompt_eval']
+        timings.eval += seconds['eval']
+        timings.prompt_tokens += prompt_tokens
+        timings.generated_tokens += generated_tokens
+
+
+def observe_cancelled(endpoint, model, stage, generated_tokens=0):
+    """Generazione abbandonata in coda (QUEUED) o mentre Ollama generava (GENERATING)"""
+    endpoint = _endpoint(endpoint)
+    model = model or settings.OLLAMA_MODEL
+    CANCELLED.inc(endpoint, model, stage)
+    if generated_tokens:
+        CANCELLED_TOKENS.inc(endpoint, model, amount=generated_tokens)
+
+
+def observe_hedge(endpoint, outcome):
+    """Esito di un duplicato di api/hedging.py"""
+    HEDGES.inc(_endpoint(endpoint), outcome)
+
+
+def observe_first_token(endpoint, model, seconds):
+    FIRST_TOKEN.observe(seconds, _endpoint(endpoint), model or settings.OLLAMA_MODEL)
+
+
+def observe_budget(endpoint, model, num_predict, generated_tokens, exhausted):
+    """Quanto del budget di token (api/budget.py) e' stato usato"""
+    endpoint = _endpoint(endpoint)
+    model = model or settings.OLLAMA_MODEL
+    BUDGET_USED.observe(generated_tokens / num_predict, endpoint, model)
+    if exhausted:
+        BUDGET_EXHAUSTED.inc(endpoint, model)
+
+
+def parse_json(text, endpoint=None, shape=None):
+    """extract_json cronometrato: stesso risultato, ValueError compreso"""
+    endpoint = _endpoint(endpoint)
+    started = time.perf_counter()
+    outcome = PARSE_FAILED
+    try:
+        value, repairs = extract_json(text, shape)
+        outcome = PARSE_REPAIRED if repairs else PARSE_OK
+        return value, repairs
+    finally:
+        elapsed = time.perf_counter() - started
+        PARSE_SECONDS.observe(elapsed, endpoint)
+        PARSES.inc(endpoint, outcome)
+        timings = current_timings()
+        if timings is not None:
+            timings.parse += elapsed
+
+
+def finish(result, timings):
+    """Aggiunge result['timings'] e registra la durata della richiesta"""
+    if timings is None:
+        return result
+    result['timings'] = timings.to_dict()
+    REQUEST_SECONDS.observe(result['timings']['total'], timings.endpoint)
+    return result
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:33
+
+from django.db import migrations, models
+
+
+def create_vector_extension(apps, schema_editor):
+    # Su Postgres la ricerca per similarita' la fa pgvector (api/semantic_cache.py)
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SemanticCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=50)),
+                ('model', models.CharField(max_length=100)),
+                ('embedding_model', models.CharField(max_length=100)),
+                ('text', models.TextField()),
+                ('embedding', models.JSONField()),
+                ('output', models.JSONField()),
+                ('seconds', models.FloatField(default=0)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['endpoint', 'model', 'embedding_model', 'created_at'], name='api_semanti_endpoin_53000b_idx')],
+            },
+        ),
+        migrations.RunPython(create_vector_extension, migrations.RunPython.noop),
+    ]
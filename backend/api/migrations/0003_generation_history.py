@@ -0,0 +1,92 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_semanticcacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Optimization',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=50)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('result', models.JSONField()),
+                ('timings', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('idea_content', models.TextField()),
+                ('optimization_goal', models.CharField(blank=True, max_length=100)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ContentPiece',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=50)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('result', models.JSONField()),
+                ('timings', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('topic', models.CharField(max_length=255)),
+                ('post_type', models.CharField(blank=True, max_length=50)),
+                ('tone', models.CharField(blank=True, max_length=50)),
+                ('target_audience', models.CharField(blank=True, max_length=255)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['target_audience', '-created_at'], name='api_content_target__98d04e_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReelIdeas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=50)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('result', models.JSONField()),
+                ('timings', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('niche', models.CharField(blank=True, max_length=255)),
+                ('target_audience', models.CharField(blank=True, max_length=255)),
+            ],
+            options={
+                'verbose_name_plural': 'reel ideas',
+                'ordering': ['-created_at', '-id'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['niche', '-created_at'], name='api_reelide_niche_793fd1_idx'), models.Index(fields=['target_audience', '-created_at'], name='api_reelide_target__d39c10_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Strategy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=50)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('result', models.JSONField()),
+                ('timings', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('niche', models.CharField(blank=True, max_length=255)),
+                ('target_audience', models.CharField(blank=True, max_length=255)),
+                ('goals', models.TextField(blank=True)),
+                ('posting_frequency', models.CharField(blank=True, max_length=255)),
+                ('mode', models.CharField(blank=True, max_length=20)),
+                ('feedback', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name_plural': 'strategies',
+                'ordering': ['-created_at', '-id'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['niche', '-created_at'], name='api_strateg_niche_40dfee_idx'), models.Index(fields=['target_audience', '-created_at'], name='api_strateg_target__7cf876_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:12
+
+import pgvector.django.vector
+from django.db import migrations
+
+
+DIMENSIONS = 768
+INDEX = 'api_semanticcacheentry_embedding_hnsw'
+
+
+def _fields(model):
+    old = model._meta.get_field('embedding')
+    new = pgvector.django.vector.VectorField(dimensions=DIMENSIONS)
+    new.set_attributes_from_name('embedding')
+    new.model = model
+    return old, new
+
+
+def to_vector(apps, schema_editor):
+    model = apps.get_model('api', 'SemanticCacheEntry')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.alter_field(model, *_fields(model))
+        return
+    table = schema_editor.quote_name(model._meta.db_table)
+    # jsonb non ha un cast diretto a vector; le entry di un'altra lunghezza si perdono
+    schema_editor.execute(f'DELETE FROM {table} WHERE jsonb_array_length(embedding) <> {DIMENSIONS}')
+    schema_editor.execute(
+        f'ALTER TABLE {table} ALTER COLUMN embedding TYPE vector({DIMENSIONS}) USING (embedding::text)::vector'
+    )
+    # Senza indice ogni ricerca e' una scansione sequenziale della tabella
+    schema_editor.execute(f'CREATE INDEX {INDEX} ON {table} USING hnsw (embedding vector_cosine_ops)')
+
+
+def to_json(apps, schema_editor):
+    model = apps.get_model('api', 'SemanticCacheEntry')
+    if schema_editor.connection.vendor != 'postgresql':
+        old, new = _fields(model)
+        schema_editor.alter_field(model, new, old)
+        return
+    table = schema_editor.quote_name(model._meta.db_table)
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX}')
+    schema_editor.execute(f'ALTER TABLE {table} ALTER COLUMN embedding TYPE jsonb USING (embedding::text)::jsonb')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_generation_history'),
+    ]
+
+    operations = [
+        # L'indice HNSW esiste solo su Postgres, quindi non e' nello stato dei modelli
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(to_vector, to_json)],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='semanticcacheentry',
+                    name='embedding',
+                    field=pgvector.django.vector.VectorField(dimensions=DIMENSIONS),
+                ),
+            ],
+        ),
+    ]
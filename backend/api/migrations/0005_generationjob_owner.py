@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_semanticcacheentry_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='boot_id',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='owner',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
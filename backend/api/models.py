@@ -1,3 +1,189 @@
+import uuid
+
 from django.db import models
+from pgvector.django import VectorField
+
+
+# Lunghezza degli embeddings di nomic-embed-text (OLLAMA_EMBED_MODEL)
+EMBEDDING_DIMENSIONS = 768
+
+
+class GenerationJob(models.Model):
+    """Generazione lunga eseguita in background (POST con "async": true)"""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+
+    # Input gia' renderizzato: il worker non deve ricostruire il prompt
+    prompt = models.TextField()
+    options = models.JSONField(default=dict)
+    result_key = models.CharField(max_length=50)
+    extra = models.JSONField(default=dict)
+
+    # Chi lo esegue: settings.JOB_OWNER e l'avvio del server (api/jobs.py)
+    owner = models.CharField(max_length=100, blank=True, default='')
+    boot_id = models.CharField(max_length=32, blank=True, default='')
+
+    progress_tokens = models.PositiveIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'{self.kind} {self.id} ({self.status})'
+
+    def to_dict(self):
+        return {
+            'id': str(self.id),
+            'kind': self.kind,
+            'status': self.status,
+            'progress_tokens': self.progress_tokens,
+            'result': self.result,
+            'error': self.error or None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class SemanticCacheEntry(models.Model):
+    """
+    Output generato con l'embedding dei campi della richiesta che l'hanno
+    prodotto (api/semantic_cache.py)
+    """
+
+    endpoint = models.CharField(max_length=50)
+    model = models.CharField(max_length=100)
+    embedding_model = models.CharField(max_length=100)
+
+    # Campi della richiesta normalizzati, cioe' il testo passato agli embeddings
+    text = models.TextField()
+    # Su Postgres ha un indice HNSW (vector_cosine_ops), vedi la migrazione 0004
+    embedding = VectorField(dimensions=EMBEDDING_DIMENSIONS)
+    output = models.JSONField()
+
+    # Durata della generazione originale: il tempo risparmiato a ogni hit
+    seconds = models.FloatField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['endpoint', 'model', 'embedding_model', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.endpoint}: {self.text[:60]}'
+
+
+class StoredGeneration(models.Model):
+    """
+    Risultato di una generazione andata a buon fine (api/history.py): i
+    campi della richiesta, il JSON generato, il modello e i timings
+    """
+
+    # Nome del campo del body della risposta con il JSON generato
+    RESULT_KEY = None
+    # Campi della richiesta, letti da metadata o dal body della risposta
+    REQUEST_FIELDS = ()
+    # Campi restituiti dalla lista se la richiesta non sceglie con ?fields=
+    SUMMARY_FIELDS = ()
+
+    endpoint = models.CharField(max_length=50)
+    model = models.CharField(max_length=100, blank=True)
+    result = models.JSONField()
+    timings = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        abstract = True
+        ordering = ['-created_at', '-id']
+
+    def to_dict(self, fields=None):
+        fields = fields or ['id', 'endpoint', *self.REQUEST_FIELDS, 'model', 'result', 'timings', 'created_at']
+        data = {}
+        for name in fields:
+            value = getattr(self, name)
+            data[name] = value.isoformat() if name == 'created_at' else value
+        return data
+
+
+class Strategy(StoredGeneration):
+    RESULT_KEY = 'strategy'
+    REQUEST_FIELDS = ('niche', 'target_audience', 'goals', 'posting_frequency', 'mode', 'feedback')
+    SUMMARY_FIELDS = ('id', 'endpoint', 'niche', 'target_audience', 'goals', 'mode', 'model', 'created_at')
+
+    niche = models.CharField(max_length=255, blank=True)
+    target_audience = models.CharField(max_length=255, blank=True)
+    goals = models.TextField(blank=True)
+    posting_frequency = models.CharField(max_length=255, blank=True)
+    mode = models.CharField(max_length=20, blank=True)
+    # Solo per le rigenerazioni
+    feedback = models.TextField(blank=True)
+
+    class Meta(StoredGeneration.Meta):
+        verbose_name_plural = 'strategies'
+        indexes = [
+            models.Index(fields=['niche', '-created_at']),
+            models.Index(fields=['target_audience', '-created_at']),
+        ]
+
+
+class ContentPiece(StoredGeneration):
+    RESULT_KEY = 'content'
+    REQUEST_FIELDS = ('topic', 'post_type', 'tone', 'target_audience')
+    SUMMARY_FIELDS = ('id', 'topic', 'post_type', 'tone', 'target_audience', 'model', 'created_at')
+
+    topic = models.CharField(max_length=255)
+    post_type = models.CharField(max_length=50, blank=True)
+    tone = models.CharField(max_length=50, blank=True)
+    target_audience = models.CharField(max_length=255, blank=True)
+
+    class Meta(StoredGeneration.Meta):
+        indexes = [
+            models.Index(fields=['target_audience', '-created_at']),
+        ]
+
+
+class ReelIdeas(StoredGeneration):
+    RESULT_KEY = 'ideas'
+    REQUEST_FIELDS = ('niche', 'target_audience')
+    SUMMARY_FIELDS = ('id', 'niche', 'target_audience', 'model', 'created_at')
+
+    niche = models.CharField(max_length=255, blank=True)
+    target_audience = models.CharField(max_length=255, blank=True)
+
+    class Meta(StoredGeneration.Meta):
+        verbose_name_plural = 'reel ideas'
+        indexes = [
+            models.Index(fields=['niche', '-created_at']),
+            models.Index(fields=['target_audience', '-created_at']),
+        ]
+
+
+class Optimization(StoredGeneration):
+    RESULT_KEY = 'optimized_idea'
+    REQUEST_FIELDS = ('idea_content', 'optimization_goal')
+    SUMMARY_FIELDS = ('id', 'idea_content', 'optimization_goal', 'model', 'created_at')
 
-# Create your models here.
+    idea_content = models.TextField()
+    optimization_goal = models.CharField(max_length=100, blank=True)
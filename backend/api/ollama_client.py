@@ -0,0 +1,284 @@
+"""
+Client HTTP per Ollama con connessioni keep-alive condivise.
+
+Il client async (httpx) viene creato una volta per event loop, cosi' sotto
+ASGI tutte le view condividono lo stesso pool di connessioni. Il client sync
+usa una requests.Session con un HTTPAdapter dimensionato dalle stesse
+impostazioni, per management command e codice non async.
+
+Il nodo a cui mandare ogni richiesta lo sceglie il router di api/routing.py
+tra quelli di settings.OLLAMA_BASE_URLS.
+"""
+import asyncio
+import json
+import re
+import threading
+import weakref
+from contextlib import aclosing
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .budget import num_ctx_for
+from .prompts import SYSTEM_PROMPT
+
+
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+
+_sync_session = None
+_sync_session_lock = threading.Lock()
+
+
+class OllamaError(Exception):
+    """Errore nella comunicazione con Ollama"""
+
+
+class BackendError(OllamaError):
+    """
+    Errore imputabile al nodo (connessione, timeout, 5xx): conta per il
+    circuit breaker del router. retryable se la richiesta non e' mai partita.
+    """
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def clean_json_response(text):
+    """Pulisce la risposta da markdown code blocks e altri artifacts"""
+    if not text:
+        return ""
+
+    # Rimuovi markdown code blocks
+    text = re.sub(r'^```json\s*', '', text.strip())
+    text = re.sub(r'^```\s*', '', text.strip())
+    text = re.sub(r'\s*```$', '', text.strip())
+
+    # Rimuovi eventuali spazi extra
+    text = text.strip()
+
+    return text
+
+
+def keep_alive_for(model):
+    """keep_alive di Ollama per il modello: durata ('30m') o secondi (-1 = sempre)"""
+    keep_alive = settings.OLLAMA_KEEP_ALIVE
+    value = str(keep_alive.get(model, keep_alive['default']))
+    return int(value) if value.lstrip('-').isdigit() else value
+
+
+def build_payload(prompt, temperature=0.7, max_tokens=2000, stream=False, format=None, model=None,
+                  context=None):
+    """
+    Costruisce il body della richiesta /api/generate. format e' il campo
+    "format" di Ollama: 'json' o uno schema JSON (structured output); model
+    di default e' settings.OLLAMA_MODEL. Il prefisso statico va in "system"
+    (prompts.SYSTEM_PROMPT); context e' il "context" restituito da una
+    generazione precedente della stessa sessione. num_ctx e' fisso per
+    modello (budget.num_ctx_for): Ollama ricarica il modello quando cambia.
+    """
+    model = model or settings.OLLAMA_MODEL
+    payload = {
+        'model': model,
+        'system': SYSTEM_PROMPT,
+        'prompt': prompt,
+        'stream': stream,
+        'keep_alive': keep_alive_for(model),
+        'options': {
+            'temperature': temperature,
+            'num_predict': max_tokens,
+            'num_ctx': num_ctx_for(model)
+        }
+    }
+    if format is not None:
+        payload['format'] = format
+    if context:
+        payload['context'] = context
+    return payload
+
+
+def _timeout():
+    return httpx.Timeout(
+        settings.OLLAMA_TIMEOUT,
+        connect=settings.OLLAMA_CONNECT_TIMEOUT
+    )
+
+
+def get_async_client():
+    """Restituisce il client async condiviso per l'event loop corrente"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        with _async_clients_lock:
+            client = _async_clients.get(loop)
+            if client is None:
+                # Nessun base_url: le richieste usano l'URL del nodo scelto dal router
+                client = httpx.AsyncClient(
+                    timeout=_timeout(),
+                    limits=httpx.Limits(
+                        max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+                        max_keepalive_connections=settings.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=settings.OLLAMA_KEEPALIVE_EXPIRY
+                    )
+                )
+                _async_clients[loop] = client
+    return client
+
+
+async def aclose_async_client():
+    """Chiude il client async dell'event loop corrente (shutdown ASGI)"""
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+
+def get_sync_session():
+    """Restituisce la requests.Session condivisa tra i thread"""
+    global _sync_session
+    if _sync_session is None:
+        with _sync_session_lock:
+            if _sync_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=settings.OLLAMA_MAX_CONNECTIONS
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sync_session = session
+    return _sync_session
+
+
+def _parse_result(status_code, body_text, result):
+    if status_code >= 500:
+        raise BackendError(f"Ollama returned status {status_code}: {body_text}")
+    if status_code != 200:
+        raise OllamaError(f"Ollama returned status {status_code}: {body_text}")
+    result['response'] = clean_json_response(result.get('response', ''))
+    return result
+
+
+def _get_router():
+    # Import locale: routing usa a sua volta OllamaError e la sessione sync
+    from .routing import get_router
+    return get_router()
+
+
+def _wrap_transport_error(e, url):
+    """Errori di rete: retryable se la richiesta non e' mai arrivata al nodo"""
+    retryable = isinstance(e, httpx.ConnectError)
+    return BackendError(f"Failed to connect to Ollama at {url}: {str(e)}", retryable=retryable)
+
+
+async def _apost_generate(backend, payload):
+    try:
+        response = await get_async_client().post(f'{backend.url}/api/generate', json=payload)
+    except httpx.HTTPError as e:
+        raise _wrap_transport_error(e, backend.url) from e
+    try:
+        result = response.json() if response.status_code == 200 else {}
+    except ValueError as e:
+        raise OllamaError(f"Ollama returned invalid JSON: {str(e)}") from e
+    return _parse_result(response.status_code, response.text, result)
+
+
+async def acall_ollama_raw(prompt, temperature=0.7, max_tokens=2000, format=None, model=None,
+                           context=None):
+    """
+    Chiamata a /api/generate sul pool condiviso. Restituisce tutto il JSON di
+    Ollama (risposta gia' pulita piu' eval_count, eval_duration,
+    prompt_eval_count, context, ...).
+    Se un nodo rifiuta la connessione si riprova sul successivo del pool.
+    """
+    payload = build_payload(
+        prompt, temperature, max_tokens, format=format, model=model, context=context
+    )
+    router = _get_router()
+    tried = []
+    while True:
+        try:
+            with router.route(payload['model'], exclude=tried) as backend:
+                tried.append(backend)
+                return await _apost_generate(backend, payload)
+        except BackendError as e:
+            if not e.retryable or len(tried) >= len(router.backends):
+                raise
+
+
+async def aembed(text, model):
+    """Embedding di text con /api/embeddings del modello indicato"""
+    router = _get_router()
+    with router.route(model) as backend:
+        try:
+            response = await get_async_client().post(
+                f'{backend.url}/api/embeddings', json={'model': model, 'prompt': text}
+            )
+        except httpx.HTTPError as e:
+            raise _wrap_transport_error(e, backend.url) from e
+        if response.status_code != 200:
+            error = BackendError if response.status_code >= 500 else OllamaError
+            raise error(f"Ollama returned status {response.status_code}: {response.text}")
+        try:
+            return response.json()['embedding']
+        except (ValueError, KeyError) as e:
+            raise OllamaError(f"Ollama returned an invalid embedding: {str(e)}") from e
+
+
+async def astream_ollama(prompt, temperature=0.7, max_tokens=2000, format=None, model=None,
+                         context=None):
+    """
+    Itera sui chunk NDJSON di Ollama con 'stream': True. Il failover su un
+    altro nodo avviene solo se la connessione fallisce prima del primo chunk.
+    Chiudere il generatore (aclose) chiude la connessione e Ollama smette di
+    generare.
+    """
+    payload = build_payload(
+        prompt, temperature, max_tokens, stream=True, format=format, model=model, context=context
+    )
+    router = _get_router()
+    tried = []
+    while True:
+        try:
+            with router.route(payload['model'], exclude=tried) as backend:
+                tried.append(backend)
+                async with aclosing(astream_backend(backend, payload)) as chunks:
+                    async for chunk in chunks:
+                        yield chunk
+                return
+        except BackendError as e:
+            if not e.retryable or len(tried) >= len(router.backends):
+                raise
+
+
+async def astream_backend(backend, payload):
+    """Chunk NDJSON di /api/generate da un nodo preciso, senza failover"""
+    try:
+        async with get_async_client().stream(
+            'POST', f'{backend.url}/api/generate', json=payload
+        ) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode(errors='replace')
+                error = BackendError if response.status_code >= 500 else OllamaError
+                raise error(f"Ollama returned status {response.status_code}: {body}")
+
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise OllamaError(chunk['error'])
+                yield chunk
+                if chunk.get('done'):
+                    break
+
+    except OllamaError:
+        raise
+    except httpx.HTTPError as e:
+        raise _wrap_transport_error(e, backend.url) from e
+    except Exception as e:
+        raise OllamaError(f"Failed to connect to Ollama: {str(e)}") from e
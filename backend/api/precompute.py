@@ -0,0 +1,361 @@
+"""
+Risultati precalcolati per le nicchie piu' richieste.
+
+Trending reels e strategie di base (target_audience, goals e frequenza di
+default) per le nicchie di PRECOMPUTE['NICHES'] piu' le piu' frequenti nello
+storico (api/history.py) vengono generati in anticipo e salvati nella cache
+delle risposte (serve un backend condiviso tra i worker: 'file' o 'django').
+
+Una richiesta con gli stessi campi, normalizzati come per la cache
+semantica, riceve il risultato precalcolato con l'header Age:
+
+- eta' <= MAX_AGE:              fresco
+- MAX_AGE < eta' <= MAX_STALE:  servito lo stesso, e rigenerato in background
+                                (stale-while-revalidate)
+- oltre MAX_STALE:              ignorato, la richiesta genera normalmente
+
+I risultati sono generati col modello del tier dell'endpoint
+(precompute_model): se la richiesta ne sceglie un altro (campo "model", o il
+passaggio adattivo al modello veloce) genera normalmente.
+
+Le rigenerazioni le fa un thread (Refresher) una alla volta, solo quando
+Ollama non ha richieste da questo server (nessuna generazione attiva o in
+coda nello scheduler, nessuna richiesta in corso sui nodi del pool) e con
+la priorita' PRIORITY (dopo tutti gli endpoint): il traffico vero passa
+prima. Il thread gira in un solo processo alla volta: chi ha il lock file
+LOCK_FILE (gli altri processi, es. l'admin, aspettano che si liberi). Con
+ENABLED il thread riscansiona le nicchie ogni REFRESH_INTERVAL secondi.
+
+Da riga di comando: python manage.py precompute_niches
+"""
+import errno
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count
+from django.utils import timezone
+
+from . import metrics
+from .cache import BYPASS, REFRESH, get_cache
+from .generation import agenerate
+from .models import ReelIdeas, Strategy
+from .prompts import get_strategy_prompt, get_trending_reels_prompt
+from .responses import build_result
+from .routing import get_router
+from .scheduler import get_scheduler
+from .schemas import get_schema, ollama_format
+from .semantic_cache import normalize, request_text
+from .singleflight import fcntl, process_lock
+from .tiering import available_model
+from .validation import avalidate_result
+
+
+logger = logging.getLogger(__name__)
+
+
+class Spec:
+    """Come generare la richiesta di base di un endpoint per una nicchia"""
+
+    def __init__(self, prompt, params, defaults, temperature, max_tokens, key):
+        self.prompt = prompt
+        self.params = params
+        self.defaults = defaults
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.key = key
+
+    def fields(self, niche):
+        """I campi che la view passa alla cache per una richiesta con i soli default"""
+        return {'niche': niche, **self.defaults}
+
+    def render(self, fields):
+        return self.prompt(*(fields[name] for name in self.params))
+
+
+# Default uguali a quelli delle view
+SPECS = {
+    'generate_trending_reels': Spec(
+        get_trending_reels_prompt, ('niche', 'target_audience'),
+        {'target_audience': 'General audience'}, 0.9, 3000, 'ideas'
+    ),
+    'generate_strategy': Spec(
+        get_strategy_prompt, ('niche', 'target_audience', 'goals', 'posting_frequency'),
+        {'target_audience': 'General audience', 'goals': 'Increase engagement',
+         'posting_frequency': '3-5 posts per week', 'mode': 'single'}, 0.8, 4000, 'strategy'
+    ),
+}
+
+
+def entry_key(endpoint, model, fields):
+    material = f'precompute\n{endpoint}\n{model}\n{request_text(fields)}'
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def precompute_model(endpoint):
+    """Il modello del tier dell'endpoint, senza il passaggio adattivo al modello veloce"""
+    policy = settings.OLLAMA_MODEL_POLICY
+    tier = policy['ENDPOINT_TIERS'].get(endpoint, policy['DEFAULT_TIER'])
+    return available_model(settings.OLLAMA_MODELS[tier])
+
+
+class Precomputed:
+    """Risultato precalcolato trovato per una richiesta"""
+
+    def __init__(self, entry, age):
+        self.entry = entry
+        self.age = age
+
+    @property
+    def output(self):
+        return self.entry['output']
+
+    @property
+    def stale(self):
+        return self.age > settings.PRECOMPUTE['MAX_AGE']
+
+    def metadata(self):
+        generated_at = datetime.fromtimestamp(self.entry['generated_at'], dt_timezone.utc)
+        return {
+            'generated_at': generated_at.isoformat(),
+            'age': int(self.age),
+            'stale': self.stale,
+        }
+
+
+def enabled_for(endpoint):
+    return endpoint in settings.PRECOMPUTE['ENDPOINTS'] and endpoint in SPECS
+
+
+async def alookup(endpoint, model, fields, cache_mode=None):
+    """
+    Il Precomputed per i campi della richiesta, None se non c'e', e' troppo
+    vecchio o e' stato generato con un modello diverso da quello scelto
+    """
+    if not enabled_for(endpoint) or cache_mode in (BYPASS, REFRESH) or model != precompute_model(endpoint):
+        return None
+    entry = await get_cache().aget(entry_key(endpoint, model, fields))
+    if entry is None:
+        return None
+    found = Precomputed(entry, time.time() - entry['generated_at'])
+    if found.age > settings.PRECOMPUTE['MAX_STALE']:
+        return None
+    if found.stale:
+        get_refresher().request(endpoint, entry['niche'])
+    metrics.observe_cached(endpoint, entry['model'], 'precomputed')
+    return found
+
+
+def entry_age(endpoint, niche):
+    """Eta' in secondi del risultato precalcolato, None se non c'e'"""
+    entry = get_cache().get(entry_key(endpoint, precompute_model(endpoint), SPECS[endpoint].fields(niche)))
+    return time.time() - entry['generated_at'] if entry else None
+
+
+async def aprecompute(endpoint, niche, force=False):
+    """
+    Genera (o rigenera se scaduto o con force) il risultato di base per la
+    nicchia; restituisce l'entry salvata, None se l'output non e' valido
+    """
+    spec = SPECS[endpoint]
+    fields = spec.fields(normalize(niche))
+    model = precompute_model(endpoint)
+    key = entry_key(endpoint, model, fields)
+    cache = get_cache()
+    async with process_lock(key):
+        existing = await cache.aget(key)
+        # Un altro worker potrebbe averlo appena rigenerato
+        fresh = existing and time.time() - existing['generated_at'] <= settings.PRECOMPUTE['MAX_AGE']
+        if fresh and not force:
+            return existing
+
+        started = time.monotonic()
+        generation = await agenerate(
+            spec.render(fields), spec.temperature, spec.max_tokens, REFRESH, endpoint,
+            ollama_format(get_schema(endpoint)), model, priority=settings.PRECOMPUTE['PRIORITY']
+        )
+        build = build_result(spec.key, {'metadata': dict(fields)})
+        result = await avalidate_result(build(generation.text), spec.key, endpoint, REFRESH, model)
+        if 'warning' in result:
+            logger.warning('Precomputed %s for %r discarded: %s', endpoint, niche, result['warning'])
+            return None
+
+        entry = {
+            'endpoint': endpoint,
+            'niche': fields['niche'],
+            'model': model,
+            'output': result[spec.key],
+            'generated_at': time.time(),
+            'seconds': time.monotonic() - started,
+        }
+        await cache.aset(key, entry)
+        return entry
+
+
+def popular_niches(limit=None):
+    """
+    Le nicchie di PRECOMPUTE['NICHES'] e poi le piu' richieste (strategie e
+    reels dello storico) negli ultimi POPULARITY_WINDOW_DAYS giorni
+    """
+    config = settings.PRECOMPUTE
+    limit = config['POPULAR_LIMIT'] if limit is None else limit
+    configured = list(dict.fromkeys(normalize(niche) for niche in config['NICHES']))
+    counts = Counter()
+    if settings.GENERATION_HISTORY['ENABLED']:
+        since = timezone.now() - timedelta(days=config['POPULARITY_WINDOW_DAYS'])
+        for model_class in (Strategy, ReelIdeas):
+            rows = (
+                model_class.objects.filter(created_at__gte=since).exclude(niche='')
+                .order_by().values('niche').annotate(requests=Count('id')).values_list('niche', 'requests')
+            )
+            for niche, requests in rows:
+                counts[normalize(niche)] += requests
+    learned = [niche for niche, _ in counts.most_common() if niche not in configured]
+    return (configured + learned)[:limit]
+
+
+def due(limit=None):
+    """(endpoint, nicchia) senza risultato precalcolato o scaduti"""
+    return [
+        (endpoint, niche)
+        for niche in popular_niches(limit)
+        for endpoint in settings.PRECOMPUTE['ENDPOINTS'] if endpoint in SPECS
+        if (age := entry_age(endpoint, niche)) is None or age > settings.PRECOMPUTE['MAX_AGE']
+    ]
+
+
+def ollama_busy():
+    """True se questo server ha generazioni in coda o richieste in corso su Ollama"""
+    scheduler = get_scheduler()
+    return bool(
+        scheduler.active or scheduler.queued or any(backend.outstanding for backend in get_router().backends)
+    )
+
+
+def try_lock(path):
+    """Il file descriptor del lock esclusivo su path, None se lo tiene un altro processo"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is None:
+        return fd
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError as e:
+        os.close(fd)
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return None
+    return fd
+
+
+class Refresher:
+    """Thread che rigenera i risultati precalcolati quando Ollama e' libero"""
+
+    def __init__(self):
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.interval = 0
+
+    def request(self, endpoint, niche):
+        """Mette in coda una rigenerazione (una sola per endpoint e nicchia)"""
+        with self._lock:
+            self._pending[(endpoint, niche)] = None
+        self.start()
+        self._wake.set()
+
+    def start(self, interval=None):
+        with self._lock:
+            if interval is not None:
+                self.interval = interval
+            if self._thread is not None and self._thread.is_alive():
+                return self._thread
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='precompute-refresher', daemon=True)
+            self._thread.start()
+            return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _next(self):
+        with self._lock:
+            if self._pending:
+                return self._pending.popitem(last=False)[0]
+        return None
+
+    def _wait_idle(self):
+        while not self._stop.is_set() and ollama_busy():
+            self._stop.wait(settings.PRECOMPUTE['IDLE_POLL'])
+
+    def _wait_lock(self):
+        """Aspetta di essere l'unico Refresher tra i processi; None se fermato prima"""
+        while not self._stop.is_set():
+            fd = try_lock(settings.PRECOMPUTE['LOCK_FILE'])
+            if fd is not None:
+                return fd
+            self._stop.wait(self.interval or settings.PRECOMPUTE['IDLE_POLL'])
+        return None
+
+    def _loop(self):
+        lock = self._wait_lock()
+        if lock is None:
+            return
+        next_scan = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                if self.interval and time.monotonic() >= next_scan:
+                    next_scan = time.monotonic() + self.interval
+                    try:
+                        for item in due():
+                            with self._lock:
+                                self._pending[item] = None
+                    except Exception:
+                        logger.exception('Popular niches scan failed')
+                    close_old_connections()
+
+                item = self._next()
+                if item is None:
+                    timeout = max(0, next_scan - time.monotonic()) if self.interval else None
+                    self._wake.wait(timeout)
+                    self._wake.clear()
+                    continue
+
+                self._wait_idle()
+                if self._stop.is_set():
+                    break
+                try:
+                    async_to_sync(aprecompute)(*item)
+                except Exception:
+                    logger.exception('Precompute of %s for %r failed', *item)
+        finally:
+            os.close(lock)
+            close_old_connections()
+
+
+_refresher = Refresher()
+
+
+def get_refresher():
+    return _refresher
+
+
+def start_background(interval=None):
+    """Scansione delle nicchie popolari ogni interval secondi"""
+    if interval is None:
+        interval = settings.PRECOMPUTE['REFRESH_INTERVAL']
+    return _refresher.start(interval)
+
+
+def stop_background():
+    _refresher.stop()
@@ -1,40 +1,46 @@
 """
 Prompt templates per la generazione di contenuti
+
+Ogni prompt e' diviso in una parte statica e una variabile, nell'ordine in
+cui Ollama li valuta: SYSTEM_PROMPT (campo "system", uguale per tutte le
+chiamate), poi le istruzioni del template (uguali per tutte le chiamate dello
+stesso tipo), e solo alla fine i dati del cliente. Cosi' il prefisso resta
+identico tra una richiesta e l'altra e Ollama puo' riusarne la KV cache
+invece di rivalutare tutto il prompt.
 """
 
-def get_strategy_prompt(niche, target_audience, goals, posting_frequency):
-    """Genera il prompt per la strategia di contenuto"""
-    return f"""
-You are an expert social media strategist. Create a comprehensive Instagram content strategy.
+SYSTEM_PROMPT = """You are an expert Instagram strategist and content creator. You plan content strategies, write posts and Reels and optimize content ideas for the Instagram algorithm.
+
+Rules for every answer:
+- Respond ONLY with valid JSON. Do not wrap it in markdown code blocks.
+- Follow the requested JSON structure and item counts EXACTLY.
+- Make ideas specific and actionable for the client's niche and audience.
+- Return ONLY the JSON, nothing else."""
 
-**Client Information:**
-- Niche: {niche}
-- Target Audience: {target_audience}
-- Goals: {goals}
-- Posting Frequency: {posting_frequency}
 
-**IMPORTANT: Respond ONLY with valid JSON. Do not wrap it in markdown code blocks.**
+STRATEGY_INSTRUCTIONS = """
+Create a comprehensive Instagram content strategy for the client described at the end.
 
 Generate a strategy with this EXACT structure:
 
-{{
+{
   "content_pillars": [
-    {{"name": "Pillar 1", "description": "Why it resonates"}},
-    {{"name": "Pillar 2", "description": "Why it resonates"}},
-    {{"name": "Pillar 3", "description": "Why it resonates"}}
+    {"name": "Pillar 1", "description": "Why it resonates"},
+    {"name": "Pillar 2", "description": "Why it resonates"},
+    {"name": "Pillar 3", "description": "Why it resonates"}
   ],
   "calendar": [
     // Generate exactly 30 daily entries with this structure:
-    {{"day": 1, "post_type": "Reel/Post/Carousel", "pillar": "Which pillar", "topic": "Post topic", "hook": "First line caption", "best_time": "HH:MM AM/PM"}}
+    {"day": 1, "post_type": "Reel/Post/Carousel", "pillar": "Which pillar", "topic": "Post topic", "hook": "First line caption", "best_time": "HH:MM AM/PM"}
   ],
-  "hashtags": {{
+  "hashtags": {
     "niche": ["hashtag1", "hashtag2", "hashtag3", "hashtag4", "hashtag5"],
     "trending": ["hashtag1", "hashtag2", "hashtag3", "hashtag4", "hashtag5"],
     "engagement": ["hashtag1", "hashtag2", "hashtag3", "hashtag4", "hashtag5"]
-  }},
+  },
   "posting_times": [
-    {{"day": "Monday", "times": ["9:00 AM", "3:00 PM"]}},
-    {{"day": "Tuesday", "times": ["9:00 AM", "3:00 PM"]}}
+    {"day": "Monday", "times": ["9:00 AM", "3:00 PM"]},
+    {"day": "Tuesday", "times": ["9:00 AM", "3:00 PM"]}
   ],
   "engagement_tips": [
     "Tip 1",
@@ -43,7 +49,7 @@ Generate a strategy with this EXACT structure:
     "Tip 4",
     "Tip 5"
   ]
-}}
+}
 
 **Requirements:**
 - Calendar MUST have EXACTLY 30 entries (one for each day of the month)
@@ -52,21 +58,24 @@ Generate a strategy with this EXACT structure:
 - Make topics specific and actionable
 - Hooks should be attention-grabbing first lines
 - Best times should vary throughout the day
-
-Return ONLY the JSON object, nothing else.
 """
 
 
-def get_regenerate_strategy_prompt(previous_strategy, feedback):
-    """Genera il prompt per rigenerare una strategia"""
-    return f"""
-You are an expert social media strategist. A client is not satisfied with their current strategy and provided feedback.
+def get_strategy_prompt(niche, target_audience, goals, posting_frequency):
+    """Genera il prompt per la strategia di contenuto"""
+    return STRATEGY_INSTRUCTIONS + f"""
+**Client Information:**
+- Niche: {niche}
+- Target Audience: {target_audience}
+- Goals: {goals}
+- Posting Frequency: {posting_frequency}
 
-**Current Strategy:**
-{previous_strategy}
+Return ONLY the JSON object, nothing else.
+"""
 
-**Client Feedback:**
-{feedback}
+
+REGENERATE_STRATEGY_INSTRUCTIONS = """
+A client is not satisfied with their current strategy and provided feedback.
 
 **Task:**
 Regenerate and improve the strategy addressing the client's concerns. Maintain the same structure but:
@@ -86,16 +95,25 @@ Make sure the new strategy directly addresses the feedback while maintaining pro
 """
 
 
-def get_content_prompt(topic, post_type, tone, target_audience):
-    """Genera il prompt per creare contenuto specifico"""
-    return f"""
-You are an expert Instagram content creator. Generate a complete post for Instagram.
+def get_regenerate_strategy_prompt(previous_strategy, feedback):
+    """
+    Genera il prompt per rigenerare una strategia. Senza previous_strategy la
+    strategia e' gia' nel context di Ollama della sessione precedente.
+    """
+    current = (
+        f"**Current Strategy:**\n{previous_strategy}\n"
+        if previous_strategy else
+        "**Current Strategy:** the strategy you generated above.\n"
+    )
+    return REGENERATE_STRATEGY_INSTRUCTIONS + f"""
+{current}
+**Client Feedback:**
+{feedback}
+"""
 
-**Content Brief:**
-- Topic: {topic}
-- Post Type: {post_type}
-- Tone: {tone}
-- Target Audience: {target_audience}
+
+CONTENT_INSTRUCTIONS = """
+Generate a complete Instagram post for the content brief at the end.
 
 **Generate:**
 
@@ -121,32 +139,35 @@ You are an expert Instagram content creator. Generate a complete post for Instag
    - Tips to boost performance
 
 Format as JSON:
-{{
+{
   "caption": "...",
   "hashtags": ["...", "..."],
-  "visual_suggestions": {{
+  "visual_suggestions": {
     "description": "...",
     "colors": ["...", "..."],
     "composition": "..."
-  }},
-  "posting_recommendations": {{
+  },
+  "posting_recommendations": {
     "best_time": "...",
     "engagement_tips": ["...", "..."]
-  }}
-}}
+  }
+}
 """
 
 
-def get_trending_reels_prompt(niche, target_audience):
-    """Genera il prompt per idee di reels trending"""
-    return f"""
-You are a viral content strategist specializing in Instagram Reels.
-
-**Client Info:**
-- Niche: {niche}
+def get_content_prompt(topic, post_type, tone, target_audience):
+    """Genera il prompt per creare contenuto specifico"""
+    return CONTENT_INSTRUCTIONS + f"""
+**Content Brief:**
+- Topic: {topic}
+- Post Type: {post_type}
+- Tone: {tone}
 - Target Audience: {target_audience}
+"""
+
 
-**Task:** Generate 10 trending Reel ideas that have high viral potential for this niche.
+REELS_INSTRUCTIONS = """
+Generate 10 trending Reel ideas that have high viral potential for the client's niche (described at the end).
 
 For each idea, provide:
 
@@ -168,7 +189,7 @@ For each idea, provide:
 
 Format as JSON array:
 [
-  {{
+  {
     "title": "...",
     "hook": "...",
     "structure": ["step1", "step2", "..."],
@@ -178,7 +199,7 @@ Format as JSON array:
     "viral_score": 8,
     "viral_explanation": "...",
     "estimated_engagement": "..."
-  }},
+  },
   ...
 ]
 
@@ -186,18 +207,17 @@ Make ideas specific, actionable, and optimized for current Instagram algorithm.
 """
 
 
-def get_optimize_idea_prompt(idea_content, optimization_goal):
-    """Genera il prompt per ottimizzare un'idea"""
-    return f"""
-You are an expert content optimizer for Instagram.
-
-**Original Idea:**
-{idea_content}
+def get_trending_reels_prompt(niche, target_audience):
+    """Genera il prompt per idee di reels trending"""
+    return REELS_INSTRUCTIONS + f"""
+**Client Info:**
+- Niche: {niche}
+- Target Audience: {target_audience}
+"""
 
-**Optimization Goal:**
-{optimization_goal}
 
-**Task:** Improve and optimize this content idea to maximize {optimization_goal}.
+OPTIMIZE_IDEA_INSTRUCTIONS = """
+Improve and optimize the content idea at the end to maximize the optimization goal given with it.
 
 Provide:
 
@@ -208,20 +228,241 @@ Provide:
 5. **Success Metrics** - What to measure
 
 Format as JSON:
-{{
-  "optimized_content": {{
+{
+  "optimized_content": {
     "title": "...",
     "description": "...",
     "implementation": ["step1", "step2", "..."]
-  }},
+  },
   "key_changes": ["change1", "change2", "..."],
   "enhancements": ["tip1", "tip2", "..."],
   "ab_test_variations": [
-    {{"variation": "A", "description": "..."}},
-    {{"variation": "B", "description": "..."}}
+    {"variation": "A", "description": "..."},
+    {"variation": "B", "description": "..."}
   ],
   "success_metrics": ["metric1", "metric2", "..."]
-}}
+}
 
 Focus on practical, implementable improvements that align with Instagram's best practices.
-"""
\ No newline at end of file
+"""
+
+
+def get_optimize_idea_prompt(idea_content, optimization_goal):
+    """Genera il prompt per ottimizzare un'idea"""
+    return OPTIMIZE_IDEA_INSTRUCTIONS + f"""
+**Optimization Goal:**
+{optimization_goal}
+
+**Original Idea:**
+{idea_content}
+"""
+
+
+OUTLINE_INSTRUCTIONS = """
+Create the foundations of an Instagram content strategy for the client described at the end.
+
+Generate a JSON object with this EXACT structure:
+
+{
+  "content_pillars": [
+    {"name": "Pillar 1", "description": "Why it resonates"},
+    {"name": "Pillar 2", "description": "Why it resonates"},
+    {"name": "Pillar 3", "description": "Why it resonates"}
+  ],
+  "hashtags": {
+    "niche": ["hashtag1", "hashtag2", "hashtag3", "hashtag4", "hashtag5"],
+    "trending": ["hashtag1", "hashtag2", "hashtag3", "hashtag4", "hashtag5"],
+    "engagement": ["hashtag1", "hashtag2", "hashtag3", "hashtag4", "hashtag5"]
+  },
+  "posting_times": [
+    {"day": "Monday", "times": ["9:00 AM", "3:00 PM"]},
+    {"day": "Tuesday", "times": ["9:00 AM", "3:00 PM"]}
+  ],
+  "engagement_tips": [
+    "Tip 1",
+    "Tip 2",
+    "Tip 3",
+    "Tip 4",
+    "Tip 5"
+  ]
+}
+
+**Requirements:**
+- EXACTLY 3 content pillars
+- Each hashtag category MUST have EXACTLY 5 hashtags
+- Do NOT include a content calendar
+"""
+
+
+def get_strategy_outline_prompt(niche, target_audience, goals, posting_frequency):
+    """Genera il prompt per pilastri, hashtag e consigli (strategia senza calendario)"""
+    return OUTLINE_INSTRUCTIONS + f"""
+**Client Information:**
+- Niche: {niche}
+- Target Audience: {target_audience}
+- Goals: {goals}
+- Posting Frequency: {posting_frequency}
+
+Return ONLY the JSON object, nothing else.
+"""
+
+
+CALENDAR_CHUNK_INSTRUCTIONS = """
+Plan part of a 30-day Instagram content calendar for the client described at the end.
+
+Each entry of the JSON array has this structure:
+
+{"day": 1, "post_type": "Reel/Post/Carousel", "pillar": "Which pillar", "topic": "Post topic", "hook": "First line caption", "best_time": "HH:MM AM/PM"}
+
+**Requirements:**
+- One entry per day, numbered consecutively over the requested days
+- Rotate evenly across the client's content pillars
+- Make topics specific and actionable
+- Hooks should be attention-grabbing first lines
+- Best times should vary throughout the day
+"""
+
+
+def get_calendar_chunk_prompt(niche, target_audience, goals, pillars, start_day, end_day):
+    """Genera il prompt per una parte del calendario (giorni start_day..end_day)"""
+    pillar_names = ', '.join(pillar.get('name', '') for pillar in pillars) or 'Education, Inspiration, Community'
+    count = end_day - start_day + 1
+    return CALENDAR_CHUNK_INSTRUCTIONS + f"""
+**Client Information:**
+- Niche: {niche}
+- Target Audience: {target_audience}
+- Goals: {goals}
+- Content Pillars: {pillar_names}
+
+Generate a JSON array with EXACTLY {count} entries, for days {start_day} to {end_day}:
+the first entry is day {start_day}. Return ONLY the JSON array, nothing else.
+"""
+
+
+SECTION_FORMATS = {
+    'content_pillars': '[{"name": "Pillar name", "description": "Why it resonates"}] (exactly 3 pillars)',
+    'calendar': '[{"day": 1, "post_type": "Reel/Post/Carousel", "pillar": "Which pillar", "topic": "Post topic", "hook": "First line caption", "best_time": "HH:MM AM/PM"}] (exactly 30 entries, days 1 to 30)',
+    'hashtags': '{"niche": [5 hashtags], "trending": [5 hashtags], "engagement": [5 hashtags]}',
+    'posting_times': '[{"day": "Monday", "times": ["9:00 AM", "3:00 PM"]}]',
+    'engagement_tips': '["Tip 1", "Tip 2", "Tip 3", "Tip 4", "Tip 5"]',
+}
+
+SECTION_INSTRUCTIONS = """
+A client gave feedback on one section of their Instagram strategy.
+Rewrite ONLY that section, addressing the feedback and keeping what worked well.
+Return ONLY the JSON value for the section, in the format given at the end.
+"""
+
+
+def get_regenerate_section_prompt(section, current_value, feedback, pillars=None):
+    """Genera il prompt per rigenerare una sola sezione della strategia"""
+    pillar_line = ''
+    if pillars:
+        names = ', '.join(pillar.get('name', '') for pillar in pillars)
+        pillar_line = f"\n**Content Pillars (use these names):** {names}\n"
+    return SECTION_INSTRUCTIONS + f"""
+**Section:** {section}
+
+**Format:**
+{SECTION_FORMATS[section]}
+
+**Current Value:**
+{current_value}
+{pillar_line}
+**Client Feedback:**
+{feedback}
+"""
+
+
+MORE_REELS_INSTRUCTIONS = """
+A list of trending Reel ideas for the client described at the end is too short.
+Generate new ideas that do NOT repeat the ones already chosen, as a JSON array of objects with this structure:
+[
+  {
+    "title": "...",
+    "hook": "...",
+    "structure": ["step1", "step2", "..."],
+    "audio_suggestion": "...",
+    "visual_style": "...",
+    "call_to_action": "...",
+    "viral_score": 8,
+    "viral_explanation": "...",
+    "estimated_engagement": "..."
+  }
+]
+"""
+
+
+def get_more_reels_prompt(niche, target_audience, count, existing_titles):
+    """Genera il prompt per completare una lista di idee di reels troppo corta"""
+    existing = '\n'.join(f'- {title}' for title in existing_titles) or '- (none)'
+    return MORE_REELS_INSTRUCTIONS + f"""
+**Client Info:**
+- Niche: {niche}
+- Target Audience: {target_audience}
+
+**Ideas already chosen (do NOT repeat them):**
+{existing}
+
+Generate EXACTLY {count} NEW trending Reel ideas. Return ONLY the JSON array, nothing else.
+"""
+
+
+MISSING_FIELDS_INSTRUCTIONS = """
+A previous answer is missing some fields. Generate ONLY the missing fields as a JSON object
+matching the JSON Schema given at the end, consistent with the answer so far.
+"""
+
+
+def get_missing_fields_prompt(brief, partial_response, fields_schema):
+    """Genera il prompt per completare solo i campi mancanti o non validi di una risposta"""
+    return MISSING_FIELDS_INSTRUCTIONS + f"""
+**Request:**
+{brief}
+
+**Answer so far:**
+{partial_response}
+
+**Missing fields (JSON Schema):**
+{fields_schema}
+"""
+
+
+CONTENT_BATCH_INSTRUCTIONS = """
+Generate a complete Instagram post for EACH content brief listed at the end.
+
+For each post write a caption (hook in the first line, clear call-to-action, 80-120 words),
+10-15 relevant hashtags, visual suggestions and posting recommendations.
+
+Return a JSON array with one object per brief, in the same order as the briefs:
+[
+  {
+    "caption": "...",
+    "hashtags": ["...", "..."],
+    "visual_suggestions": {
+      "description": "...",
+      "colors": ["...", "..."],
+      "composition": "..."
+    },
+    "posting_recommendations": {
+      "best_time": "...",
+      "engagement_tips": ["...", "..."]
+    }
+  }
+]
+"""
+
+
+def get_content_batch_prompt(briefs):
+    """Genera il prompt per piu' post brevi in un'unica chiamata (batch con "pack")"""
+    listed = '\n'.join(
+        f"{number}. Topic: {brief['topic']} | Post Type: {brief['post_type']} | "
+        f"Tone: {brief['tone']} | Target Audience: {brief['target_audience']}"
+        for number, brief in enumerate(briefs, start=1)
+    )
+    return CONTENT_BATCH_INSTRUCTIONS + f"""
+**Content Briefs:**
+{listed}
+
+Return EXACTLY {len(briefs)} objects.
+"""
@@ -0,0 +1,35 @@
+"""
+Costruzione del body JSON delle risposte di generazione.
+"""
+from .metrics import parse_json
+
+
+def parse_json_response(response_text):
+    """Prova a parsare la risposta: restituisce (valore, warning)"""
+    try:
+        value, repairs = parse_json(response_text)
+    except ValueError as e:
+        # Se il parsing fallisce, restituisci comunque il testo pulito
+        return response_text, f'Response was not valid JSON: {str(e)}'
+    if 'truncated' in repairs:
+        return value, 'Response was truncated; incomplete trailing items were dropped'
+    return value, None
+
+
+def build_result(key, extra):
+    """Crea la funzione che trasforma il testo generato nel body della risposta"""
+    def build(response_text):
+        value, warning = parse_json_response(response_text)
+        result = {'success': True, key: value, **extra}
+        if warning:
+            result['warning'] = warning
+        return result
+    return build
+
+
+def build_pipeline_result(key, value, warnings, extra):
+    """Body della risposta per le generazioni composte da piu' chiamate"""
+    result = {'success': True, key: value, **extra}
+    if warnings:
+        result['warning'] = '; '.join(warnings)
+    return result
@@ -0,0 +1,258 @@
+"""
+Pool di backend Ollama (settings.OLLAMA_BASE_URLS) con bilanciamento e
+routing consapevole dello stato dei nodi.
+
+- Selezione: 'least_outstanding' (meno richieste in corso) o 'latency'
+  (richieste in corso pesate per la latenza media osservata).
+- Health check passivi: ogni chiamata riuscita o fallita aggiorna il nodo;
+  errori di connessione, timeout e 5xx contano come fallimenti.
+- Health check attivi: un thread interroga /api/tags di ogni nodo ogni
+  HEALTH_CHECK_INTERVAL secondi e impara quali modelli ha.
+- Circuit breaker: dopo FAILURE_THRESHOLD fallimenti consecutivi il nodo
+  viene escluso per RECOVERY_TIME secondi, poi riceve una sola richiesta di
+  prova (half-open) prima di tornare nel pool.
+- Pinning per modello: una richiesta va solo ai nodi che hanno il modello
+  (da OLLAMA_BACKEND_MODELS o imparato da /api/tags); i nodi con modelli
+  ancora sconosciuti restano candidati.
+"""
+import contextlib
+import itertools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .ollama_client import BackendError, OllamaError, get_sync_session
+
+
+logger = logging.getLogger(__name__)
+
+LEAST_OUTSTANDING = 'least_outstanding'
+LATENCY = 'latency'
+STRATEGIES = (LEAST_OUTSTANDING, LATENCY)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class NoBackendAvailable(OllamaError):
+    """Nessun nodo del pool puo' servire la richiesta"""
+
+
+def model_matches(model, available):
+    """'llama3.2' corrisponde anche a 'llama3.2:latest'"""
+    if model in available:
+        return True
+    return ':' not in model and f'{model}:latest' in available
+
+
+class Backend:
+    def __init__(self, url, models=None):
+        self.url = url.rstrip('/')
+        # None = modelli non ancora noti
+        self.models = set(models) if models else None
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+
+    def has_model(self, model):
+        return self.models is None or model_matches(model, self.models)
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'state': self.state,
+            'outstanding': self.outstanding,
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'failures': self.failures,
+            'models': sorted(self.models) if self.models is not None else None,
+        }
+
+
+class Router:
+    def __init__(self, urls, strategy=LEAST_OUTSTANDING, failure_threshold=3, recovery_time=30,
+                 smoothing=0.2, models=None):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy must be one of: {', '.join(STRATEGIES)}")
+        models = models or {}
+        self.backends = [Backend(url, models.get(url.rstrip('/'))) for url in urls]
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._rotation = itertools.count()
+        self._stop = threading.Event()
+
+    def _available_locked(self, backend, now):
+        if backend.state == CLOSED:
+            return True
+        if backend.state == OPEN and now - backend.opened_at >= self.recovery_time:
+            backend.state = HALF_OPEN
+        # Half-open: una sola richiesta di prova alla volta
+        return backend.state == HALF_OPEN and not backend.probing
+
+    def _score(self, backend):
+        if self.strategy == LATENCY:
+            # Nodi mai misurati: latenza ottimistica, cosi' vengono provati
+            return (backend.outstanding + 1) * (backend.latency or 0.0)
+        return backend.outstanding
+
+    def _candidates_locked(self, model, exclude):
+        now = time.monotonic()
+        return [
+            backend for backend in self.backends
+            if backend not in exclude and backend.has_model(model)
+            and self._available_locked(backend, now)
+        ]
+
+    def has_candidates(self, model, exclude=()):
+        """True se pick() troverebbe un nodo, senza assegnarlo"""
+        with self._lock:
+            return bool(self._candidates_locked(model, exclude))
+
+    def pick(self, model, exclude=()):
+        """Sceglie un nodo per il modello e ne incrementa le richieste in corso"""
+        with self._lock:
+            candidates = self._candidates_locked(model, exclude)
+            if not candidates:
+                if not any(backend.has_model(model) for backend in self.backends):
+                    raise NoBackendAvailable(f'No Ollama backend has model {model}')
+                raise NoBackendAvailable('No healthy Ollama backend available')
+
+            # A parita' di punteggio si ruota tra i nodi
+            offset = next(self._rotation)
+            count = len(candidates)
+            backend = min(
+                (candidates[(offset + i) % count] for i in range(count)),
+                key=self._score
+            )
+            backend.outstanding += 1
+            if backend.state == HALF_OPEN:
+                backend.probing = True
+            return backend
+
+    def record_success(self, backend, seconds=None):
+        with self._lock:
+            if backend.state != CLOSED:
+                logger.info('Ollama backend %s is back in the pool', backend.url)
+            backend.failures = 0
+            backend.state = CLOSED
+            backend.probing = False
+            if seconds is not None:
+                if backend.latency is None:
+                    backend.latency = seconds
+                else:
+                    backend.latency += self.smoothing * (seconds - backend.latency)
+
+    def record_failure(self, backend):
+        with self._lock:
+            backend.failures += 1
+            backend.probing = False
+            if backend.state == HALF_OPEN or backend.failures >= self.failure_threshold:
+                if backend.state != OPEN:
+                    logger.warning('Ollama backend %s ejected after %d failures',
+                                   backend.url, backend.failures)
+                backend.state = OPEN
+                backend.opened_at = time.monotonic()
+
+    def release(self, backend):
+        with self._lock:
+            backend.outstanding -= 1
+            # Prova half-open finita senza esito (es. richiesta cancellata)
+            backend.probing = False
+
+    @contextlib.contextmanager
+    def route(self, model, exclude=()):
+        """
+        Assegna un nodo per la durata della richiesta: gli errori BackendError
+        lo penalizzano, il successo ne aggiorna la latenza.
+        """
+        backend = self.pick(model, exclude)
+        started = time.monotonic()
+        try:
+            yield backend
+        except BackendError:
+            self.record_failure(backend)
+            raise
+        else:
+            self.record_success(backend, time.monotonic() - started)
+        finally:
+            self.release(backend)
+
+    def check(self, backend):
+        """Health check attivo: /api/tags risponde e dice quali modelli ci sono"""
+        try:
+            response = get_sync_session().get(
+                f'{backend.url}/api/tags', timeout=settings.OLLAMA_CONNECT_TIMEOUT
+            )
+            response.raise_for_status()
+            models = {model['name'] for model in response.json().get('models', [])}
+        except Exception:
+            self.record_failure(backend)
+            return False
+        with self._lock:
+            backend.models = models
+        self.record_success(backend)
+        return True
+
+    def check_all(self):
+        return {backend.url: self.check(backend) for backend in self.backends}
+
+    def start_health_checks(self, interval):
+        def loop():
+            while not self._stop.wait(interval):
+                self.check_all()
+
+        thread = threading.Thread(target=loop, name='ollama-health-check', daemon=True)
+        thread.start()
+        return thread
+
+    def stop_health_checks(self):
+        self._stop.set()
+
+    def to_dict(self):
+        with self._lock:
+            return [backend.to_dict() for backend in self.backends]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Router condiviso da thread ed event loop, configurato dai settings"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                config = settings.OLLAMA_ROUTING
+                router = Router(
+                    settings.OLLAMA_BASE_URLS,
+                    strategy=config['STRATEGY'],
+                    failure_threshold=config['FAILURE_THRESHOLD'],
+                    recovery_time=config['RECOVERY_TIME'],
+                    smoothing=config['LATENCY_SMOOTHING'],
+                    models=settings.OLLAMA_BACKEND_MODELS,
+                )
+                if config['HEALTH_CHECK_INTERVAL'] > 0:
+                    router.start_health_checks(config['HEALTH_CHECK_INTERVAL'])
+                _router = router
+    return _router
+
+
+@receiver(setting_changed)
+def _reset_router(setting, **kwargs):
+    global _router
+    if setting in ('OLLAMA_BASE_URLS', 'OLLAMA_ROUTING', 'OLLAMA_BACKEND_MODELS'):
+        with _router_lock:
+            if _router is not None:
+                _router.stop_health_checks()
+            _router = None
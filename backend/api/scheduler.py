@@ -0,0 +1,159 @@
+"""
+Controllo di ammissione e coda a priorita' davanti a Ollama.
+
+Al massimo MAX_CONCURRENCY generazioni raggiungono Ollama insieme; le altre
+aspettano in una coda limitata a MAX_QUEUE, ordinata per classe di priorita'
+(numero piu' basso = servito prima) e poi per ordine di arrivo. A coda piena
+la richiesta viene rifiutata subito con Overloaded, che porta una stima di
+Retry-After calcolata dai token/s osservati.
+
+Come il single-flight, l'attesa usa concurrent.futures.Future, quindi la
+stessa istanza serve thread ed event loop diversi.
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import math
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .singleflight import wait_future
+
+
+class Overloaded(Exception):
+    """Coda piena: il client deve riprovare dopo retry_after secondi"""
+
+    def __init__(self, retry_after, queued):
+        super().__init__(f'Server busy: {queued} generations queued, retry in {retry_after}s')
+        self.retry_after = retry_after
+        self.queued = queued
+
+
+class Scheduler:
+    def __init__(self, max_concurrency, max_queue, tokens_per_second, smoothing=0.2):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.tokens_per_second = tokens_per_second
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._queue = []
+        self._active = 0
+        self._active_tokens = 0
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def queued(self):
+        with self._lock:
+            return sum(1 for item in self._queue if not item[3].cancelled())
+
+    def retry_after(self):
+        """Secondi stimati per smaltire il lavoro gia' accettato"""
+        with self._lock:
+            return self._retry_after_locked()
+
+    def _retry_after_locked(self):
+        pending = self._active_tokens + sum(
+            item[2] for item in self._queue if not item[3].cancelled()
+        )
+        rate = max(self.tokens_per_second, 0.1) * self.max_concurrency
+        return max(1, math.ceil(pending / rate))
+
+    def check_admission(self):
+        """Solleva Overloaded se una nuova richiesta finirebbe oltre la coda"""
+        with self._lock:
+            self._check_admission_locked()
+
+    def _check_admission_locked(self):
+        if self._active < self.max_concurrency:
+            return
+        queued = sum(1 for item in self._queue if not item[3].cancelled())
+        if queued >= self.max_queue:
+            raise Overloaded(self._retry_after_locked(), queued)
+
+    def acquire(self, priority, expected_tokens):
+        """Restituisce un future risolto quando lo slot e' assegnato"""
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._check_admission_locked()
+            heapq.heappush(self._queue, (priority, next(self._seq), expected_tokens, future))
+            self._grant_locked()
+        return future
+
+    def release(self, expected_tokens):
+        with self._lock:
+            self._active -= 1
+            self._active_tokens -= expected_tokens
+            self._grant_locked()
+
+    def _grant_locked(self):
+        while self._queue and self._active < self.max_concurrency:
+            _, _, tokens, future = heapq.heappop(self._queue)
+            # False se chi aspettava nel frattempo ha rinunciato
+            if future.set_running_or_notify_cancel():
+                self._active += 1
+                self._active_tokens += tokens
+                future.set_result(True)
+
+    def record_throughput(self, tokens, seconds):
+        """Aggiorna la media mobile dei token/s di una generazione"""
+        if tokens <= 0 or seconds <= 0:
+            return
+        rate = tokens / seconds
+        with self._lock:
+            self.tokens_per_second += self.smoothing * (rate - self.tokens_per_second)
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, priority, expected_tokens):
+        """Attende uno slot libero (o solleva Overloaded) e lo rilascia all'uscita"""
+        future = self.acquire(priority, expected_tokens)
+        try:
+            await wait_future(future)
+        except asyncio.CancelledError:
+            # Se lo slot era gia' stato assegnato va restituito
+            if not future.cancel():
+                self.release(expected_tokens)
+            raise
+        try:
+            yield
+        finally:
+            self.release(expected_tokens)
+
+
+def get_priority(endpoint):
+    """Classe di priorita' configurata per l'endpoint"""
+    config = settings.OLLAMA_SCHEDULER
+    return config['PRIORITIES'].get(endpoint, config['DEFAULT_PRIORITY'])
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                config = settings.OLLAMA_SCHEDULER
+                _scheduler = Scheduler(
+                    max_concurrency=config['MAX_CONCURRENCY'],
+                    max_queue=config['MAX_QUEUE'],
+                    tokens_per_second=config['INITIAL_TOKENS_PER_SECOND'],
+                )
+    return _scheduler
+
+
+@receiver(setting_changed)
+def _reset_scheduler(setting, **kwargs):
+    global _scheduler
+    if setting == 'OLLAMA_SCHEDULER':
+        _scheduler = None
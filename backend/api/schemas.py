@@ -0,0 +1,220 @@
+"""
+Schemi JSON delle risposte, uguali alle strutture chieste in prompts.py.
+
+Servono a due cose: vengono passati a Ollama come "format" (structured
+output, Ollama >= 0.5) e validano lato server quello che torna, cosi' una
+strategia con 12 giorni o 4 idee di reels non passa piu' come successo.
+validate() implementa solo il sottoinsieme di JSON Schema usato qui.
+"""
+from django.conf import settings
+
+
+CALENDAR_DAYS = 30
+REEL_IDEAS = 10
+
+
+def string_list(count=None):
+    schema = {'type': 'array', 'items': {'type': 'string'}}
+    if count is not None:
+        schema['minItems'] = schema['maxItems'] = count
+    return schema
+
+
+CALENDAR_ENTRY_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'day': {'type': 'integer'},
+        'post_type': {'type': 'string'},
+        'pillar': {'type': 'string'},
+        'topic': {'type': 'string'},
+        'hook': {'type': 'string'},
+        'best_time': {'type': 'string'},
+    },
+    'required': ['day', 'post_type', 'pillar', 'topic', 'hook', 'best_time'],
+}
+
+
+def calendar_schema(count):
+    return {'type': 'array', 'items': CALENDAR_ENTRY_SCHEMA, 'minItems': count, 'maxItems': count}
+
+
+STRATEGY_SECTION_SCHEMAS = {
+    'content_pillars': {
+        'type': 'array',
+        'items': {
+            'type': 'object',
+            'properties': {'name': {'type': 'string'}, 'description': {'type': 'string'}},
+            'required': ['name', 'description'],
+        },
+        'minItems': 3,
+        'maxItems': 3,
+    },
+    'calendar': calendar_schema(CALENDAR_DAYS),
+    'hashtags': {
+        'type': 'object',
+        'properties': {
+            'niche': string_list(5),
+            'trending': string_list(5),
+            'engagement': string_list(5),
+        },
+        'required': ['niche', 'trending', 'engagement'],
+    },
+    'posting_times': {
+        'type': 'array',
+        'items': {
+            'type': 'object',
+            'properties': {'day': {'type': 'string'}, 'times': string_list()},
+            'required': ['day', 'times'],
+        },
+        'minItems': 1,
+    },
+    'engagement_tips': {**string_list(), 'minItems': 3},
+}
+
+STRATEGY_SCHEMA = {
+    'type': 'object',
+    'properties': STRATEGY_SECTION_SCHEMAS,
+    'required': list(STRATEGY_SECTION_SCHEMAS),
+}
+
+CONTENT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'caption': {'type': 'string'},
+        'hashtags': {**string_list(), 'minItems': 5},
+        'visual_suggestions': {
+            'type': 'object',
+            'properties': {
+                'description': {'type': 'string'},
+                'colors': string_list(),
+                'composition': {'type': 'string'},
+            },
+            'required': ['description', 'colors', 'composition'],
+        },
+        'posting_recommendations': {
+            'type': 'object',
+            'properties': {
+                'best_time': {'type': 'string'},
+                'engagement_tips': string_list(),
+            },
+            'required': ['best_time', 'engagement_tips'],
+        },
+    },
+    'required': ['caption', 'hashtags', 'visual_suggestions', 'posting_recommendations'],
+}
+
+REEL_IDEA_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'title': {'type': 'string'},
+        'hook': {'type': 'string'},
+        'structure': string_list(),
+        'audio_suggestion': {'type': 'string'},
+        'visual_style': {'type': 'string'},
+        'call_to_action': {'type': 'string'},
+        'viral_score': {'type': 'integer'},
+        'viral_explanation': {'type': 'string'},
+        'estimated_engagement': {'type': 'string'},
+    },
+    'required': ['title', 'hook', 'structure', 'call_to_action', 'viral_score'],
+}
+
+
+def reels_schema(count):
+    return {'type': 'array', 'items': REEL_IDEA_SCHEMA, 'minItems': count, 'maxItems': count}
+
+
+REELS_SCHEMA = reels_schema(REEL_IDEAS)
+
+OPTIMIZE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'optimized_content': {
+            'type': 'object',
+            'properties': {
+                'title': {'type': 'string'},
+                'description': {'type': 'string'},
+                'implementation': string_list(),
+            },
+            'required': ['title', 'description', 'implementation'],
+        },
+        'key_changes': string_list(),
+        'enhancements': string_list(),
+        'ab_test_variations': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {'variation': {'type': 'string'}, 'description': {'type': 'string'}},
+                'required': ['variation', 'description'],
+            },
+        },
+        'success_metrics': string_list(),
+    },
+    'required': ['optimized_content', 'key_changes', 'enhancements', 'ab_test_variations', 'success_metrics'],
+}
+
+ENDPOINT_SCHEMAS = {
+    'generate_strategy': STRATEGY_SCHEMA,
+    'regenerate_strategy': STRATEGY_SCHEMA,
+    'generate_content': CONTENT_SCHEMA,
+    'generate_trending_reels': REELS_SCHEMA,
+    'optimize_idea': OPTIMIZE_SCHEMA,
+}
+
+_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'boolean': bool,
+}
+
+
+def get_schema(endpoint):
+    return ENDPOINT_SCHEMAS.get(endpoint)
+
+
+def ollama_format(schema):
+    """Valore del campo "format" di Ollama secondo settings.OLLAMA_STRUCTURED_OUTPUT"""
+    mode = settings.OLLAMA_STRUCTURED_OUTPUT
+    if schema is None or mode == 'off':
+        return None
+    if mode == 'json':
+        return 'json'
+    return schema
+
+
+def _type_ok(value, expected):
+    if expected == 'integer':
+        return isinstance(value, int) and not isinstance(value, bool)
+    if expected == 'number':
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, _TYPES[expected])
+
+
+def validate(value, schema, path=''):
+    """Lista di errori {'path', 'message'}; vuota se il valore rispetta lo schema"""
+    expected = schema.get('type')
+    if expected and not _type_ok(value, expected):
+        return [{'path': path, 'message': f'expected {expected}'}]
+
+    errors = []
+    if expected == 'object':
+        for name in schema.get('required', []):
+            if name not in value:
+                errors.append({'path': _join(path, name), 'message': 'missing'})
+        for name, sub_schema in schema.get('properties', {}).items():
+            if name in value:
+                errors.extend(validate(value[name], sub_schema, _join(path, name)))
+    elif expected == 'array':
+        if 'minItems' in schema and len(value) < schema['minItems']:
+            errors.append({'path': path, 'message': f"expected at least {schema['minItems']} items, got {len(value)}"})
+        if 'maxItems' in schema and len(value) > schema['maxItems']:
+            errors.append({'path': path, 'message': f"expected at most {schema['maxItems']} items, got {len(value)}"})
+        if 'items' in schema:
+            for index, item in enumerate(value):
+                errors.extend(validate(item, schema['items'], f'{path}[{index}]'))
+    return errors
+
+
+def _join(path, name):
+    return f'{path}.{name}' if path else name
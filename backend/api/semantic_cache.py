@@ -0,0 +1,292 @@
+"""
+Cache semantica: richieste quasi uguali ("Fitness and Wellness" e "fitness &
+wellness for women") riusano l'output gia' generato invece di rifare la
+generazione.
+
+I campi della richiesta, normalizzati, passano per /api/embeddings di Ollama
+(settings.OLLAMA_SEMANTIC_CACHE['MODEL']); l'embedding e l'output validato si
+salvano in SemanticCacheEntry. A una nuova richiesta dello stesso endpoint e
+modello si cerca l'entry piu' vicina per similarita' coseno: sopra THRESHOLD
+e' un hit. La ricerca la fa:
+
+- 'numpy':    un indice in-process, caricato dal database (SQLite) e
+              ricaricato ogni RELOAD_INTERVAL secondi per vedere le entry
+              scritte da altri processi
+- 'pgvector': una query ORDER BY <=> su Postgres, servita dall'indice HNSW
+              della colonna vector (migrazione 0004)
+- 'auto':     pgvector su Postgres, numpy altrimenti
+
+Hit rate e secondi risparmiati sono in /metrics e in metadata.semantic_cache.
+"""
+import logging
+import re
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
+from pgvector.django import CosineDistance
+
+from . import metrics
+from .cache import BYPASS, REFRESH
+from .models import EMBEDDING_DIMENSIONS, SemanticCacheEntry
+from .ollama_client import OllamaError, aembed
+
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('auto', 'numpy', 'pgvector')
+
+
+def normalize(value):
+    """Minuscole, '&' come 'and', senza punteggiatura e spazi doppi"""
+    text = str(value).lower().replace('&', ' and ')
+    text = re.sub(r'[^\w\s#]', ' ', text)
+    return ' '.join(text.split())
+
+
+def request_text(fields):
+    """Testo da passare agli embeddings: i campi normalizzati in ordine di nome"""
+    return '\n'.join(f'{name}: {normalize(value)}' for name, value in sorted(fields.items()))
+
+
+def unit_vector(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class Query:
+    """Richiesta gia' trasformata in embedding, da salvare dopo la generazione"""
+
+    def __init__(self, endpoint, model, text, vector):
+        self.endpoint = endpoint
+        self.model = model
+        self.text = text
+        self.vector = vector
+
+
+class Match:
+    """Entry trovata sopra la soglia di similarita'"""
+
+    def __init__(self, entry_id, text, output, similarity, seconds):
+        self.entry_id = entry_id
+        self.text = text
+        self.output = output
+        self.similarity = similarity
+        self.seconds = seconds
+
+    def metadata(self):
+        return {
+            'similarity': round(self.similarity, 4),
+            'matched': self.text,
+            'saved_seconds': round(self.seconds, 3),
+        }
+
+
+def _cutoff():
+    return timezone.now() - timedelta(seconds=settings.OLLAMA_SEMANTIC_CACHE['TTL'])
+
+
+class NumpyIndex:
+    """
+    Matrice dei vettori unitari per (endpoint, modello), caricata alla prima
+    ricerca e ricaricata se piu' vecchia di reload_interval secondi
+    """
+
+    def __init__(self, max_entries, reload_interval=60):
+        self.max_entries = max_entries
+        self.reload_interval = reload_interval
+        self._indexes = {}
+        self._loaded_at = {}
+        self._lock = threading.Lock()
+
+    def _load(self, key):
+        endpoint, model, embedding_model = key
+        rows = list(
+            SemanticCacheEntry.objects
+            .filter(endpoint=endpoint, model=model, embedding_model=embedding_model, created_at__gte=_cutoff())
+            .order_by('-created_at')
+            .values_list('id', 'embedding', 'created_at')[:self.max_entries]
+        )
+        rows.reverse()
+        ids = [row[0] for row in rows]
+        created = [row[2].timestamp() for row in rows]
+        vectors = [unit_vector(row[1]) for row in rows]
+        return ids, created, vectors
+
+    def search(self, key, vector):
+        """(id, similarita') dell'entry piu' vicina non scaduta, o None"""
+        with self._lock:
+            now = time.monotonic()
+            if key not in self._indexes or now - self._loaded_at[key] > self.reload_interval:
+                self._indexes[key] = self._load(key)
+                self._loaded_at[key] = now
+            ids, created, vectors = self._indexes[key]
+            if not ids:
+                return None
+            matrix = np.vstack(vectors)
+            scores = matrix @ vector
+            cutoff = _cutoff().timestamp()
+            scores[np.asarray(created) < cutoff] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] == -np.inf:
+                return None
+            return ids[best], float(scores[best])
+
+    def add(self, key, entry_id, vector, created):
+        with self._lock:
+            if key not in self._indexes:
+                # Verra' caricato dal database alla prossima ricerca
+                return
+            ids, stamps, vectors = self._indexes[key]
+            ids.append(entry_id)
+            stamps.append(created.timestamp())
+            vectors.append(vector)
+            del ids[:-self.max_entries], stamps[:-self.max_entries], vectors[:-self.max_entries]
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+            self._loaded_at.clear()
+
+
+class PgvectorIndex:
+    """Ricerca con l'operatore <=> (distanza coseno) di pgvector"""
+
+    def search(self, key, vector):
+        endpoint, model, embedding_model = key
+        row = (
+            SemanticCacheEntry.objects
+            .filter(endpoint=endpoint, model=model, embedding_model=embedding_model, created_at__gte=_cutoff())
+            .annotate(distance=CosineDistance('embedding', vector))
+            .order_by('distance')
+            .values_list('id', 'distance')
+            .first()
+        )
+        return (row[0], 1 - float(row[1])) if row else None
+
+    def add(self, key, entry_id, vector, created):
+        pass
+
+    def clear(self):
+        pass
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Indice del backend configurato in settings.OLLAMA_SEMANTIC_CACHE"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                config = settings.OLLAMA_SEMANTIC_CACHE
+                backend = config.get('BACKEND', 'auto')
+                if backend not in BACKENDS:
+                    raise ValueError(f"Unknown OLLAMA_SEMANTIC_CACHE backend: {backend}")
+                if backend == 'pgvector' or (backend == 'auto' and connection.vendor == 'postgresql'):
+                    _index = PgvectorIndex()
+                else:
+                    _index = NumpyIndex(config['MAX_ENTRIES'], config['RELOAD_INTERVAL'])
+    return _index
+
+
+@receiver(setting_changed)
+def _reset_index(setting, **kwargs):
+    global _index
+    if setting in ('OLLAMA_SEMANTIC_CACHE', 'DATABASES'):
+        _index = None
+
+
+def enabled_for(endpoint):
+    config = settings.OLLAMA_SEMANTIC_CACHE
+    return config['ENABLED'] and endpoint in config['ENDPOINTS']
+
+
+def _key(query):
+    return query.endpoint, query.model, settings.OLLAMA_SEMANTIC_CACHE['MODEL']
+
+
+def _find(query):
+    found = get_index().search(_key(query), query.vector)
+    if found is None:
+        return None
+    entry_id, similarity = found
+    if similarity < settings.OLLAMA_SEMANTIC_CACHE['THRESHOLD']:
+        return None
+    entry = SemanticCacheEntry.objects.filter(pk=entry_id).values('text', 'output', 'seconds').first()
+    if entry is None:
+        return None
+    SemanticCacheEntry.objects.filter(pk=entry_id).update(hits=F('hits') + 1)
+    return Match(entry_id, entry['text'], entry['output'], similarity, entry['seconds'])
+
+
+async def alookup(endpoint, model, fields, cache_mode=None):
+    """
+    (query, match): match e' l'output di una richiesta simile o None; query
+    serve ad astore dopo la generazione (None se la cache non si usa o gli
+    embeddings non sono disponibili, e la richiesta prosegue normalmente).
+    """
+    if not enabled_for(endpoint) or cache_mode == BYPASS:
+        return None, None
+    model = model or settings.OLLAMA_MODEL
+    text = request_text(fields)
+    started = time.monotonic()
+    try:
+        embedding = await aembed(text, settings.OLLAMA_SEMANTIC_CACHE['MODEL'])
+    except OllamaError as e:
+        logger.warning('Semantic cache disabled for this request: %s', e)
+        return None, None
+    metrics.EMBED_SECONDS.observe(time.monotonic() - started, endpoint)
+    if len(embedding) != EMBEDDING_DIMENSIONS:
+        logger.warning(
+            'Semantic cache disabled for this request: %s returns %d dimensions, the index needs %d',
+            settings.OLLAMA_SEMANTIC_CACHE['MODEL'], len(embedding), EMBEDDING_DIMENSIONS
+        )
+        return None, None
+    query = Query(endpoint, model, text, unit_vector(embedding))
+    if cache_mode == REFRESH:
+        return query, None
+
+    match = await sync_to_async(_find)(query)
+    metrics.SEMANTIC_LOOKUPS.inc(endpoint, 'hit' if match else 'miss')
+    if match is not None:
+        metrics.SEMANTIC_SAVED_SECONDS.inc(endpoint, amount=match.seconds)
+        metrics.observe_cached(endpoint, model, 'semantic')
+    return query, match
+
+
+def _store(query, output, seconds):
+    config = settings.OLLAMA_SEMANTIC_CACHE
+    key = _key(query)
+    entry = SemanticCacheEntry.objects.create(
+        endpoint=query.endpoint, model=query.model, embedding_model=key[2], text=query.text,
+        embedding=query.vector, output=output, seconds=seconds
+    )
+    get_index().add(key, entry.pk, query.vector, entry.created_at)
+
+    # Tiene solo le MAX_ENTRIES piu' recenti per endpoint e modello
+    stale = list(
+        SemanticCacheEntry.objects
+        .filter(endpoint=query.endpoint, model=query.model, embedding_model=key[2])
+        .order_by('-created_at')
+        .values_list('pk', flat=True)[config['MAX_ENTRIES']:]
+    )
+    if stale:
+        SemanticCacheEntry.objects.filter(pk__in=stale).delete()
+    return entry
+
+
+async def astore(query, output, seconds):
+    """Salva l'output generato per la query di alookup"""
+    return await sync_to_async(_store)(query, output, seconds)
@@ -0,0 +1,78 @@
+"""
+Sessioni di generazione: il "context" che Ollama restituisce alla fine di una
+generazione viene salvato con un id (metadata.session) e rimandato con la
+richiesta successiva che lo cita (es. regenerate_strategy dopo
+generate_strategy), cosi' la conversazione precedente non va rimandata e
+rivalutata come testo.
+
+Il context vale solo per il modello che l'ha prodotto, quindi la sessione lo
+ricorda e la richiesta successiva usa lo stesso modello. Le sessioni stanno in
+memoria nel processo (settings.OLLAMA_SESSIONS): con piu' worker un id
+sconosciuto fa solo ripartire senza context.
+"""
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .cache import MemoryCache
+
+
+class Session:
+    def __init__(self, id, model, context):
+        self.id = id
+        self.model = model
+        self.context = context
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = settings.OLLAMA_SESSIONS
+                _store = MemoryCache(config['TTL'], config['MAX_ENTRIES'])
+    return _store
+
+
+def uses_sessions(endpoint):
+    return endpoint in settings.OLLAMA_SESSIONS['ENDPOINTS']
+
+
+def save_session(model, context):
+    """Salva il context e restituisce l'id della nuova sessione"""
+    session_id = uuid.uuid4().hex
+    get_store().set(session_id, (model, context))
+    return session_id
+
+
+def attach_session(result, endpoint, model, context):
+    """Aggiunge metadata.session al body se l'endpoint usa le sessioni"""
+    if context and uses_sessions(endpoint):
+        result['metadata'] = {**result.get('metadata', {}), 'session': save_session(model, context)}
+    return result
+
+
+def load_session(session_id):
+    """La Session con quell'id, None se sconosciuta o scaduta"""
+    if not isinstance(session_id, str):
+        return None
+    item = get_store().get(session_id)
+    if item is None:
+        return None
+    model, context = item
+    return Session(session_id, model, context)
+
+
+@receiver(setting_changed)
+def _reset_store(setting, **kwargs):
+    global _store
+    if setting == 'OLLAMA_SESSIONS':
+        with _store_lock:
+            _store = None
@@ -0,0 +1,223 @@
+"""
+Coalescing delle generazioni duplicate in corso (single-flight).
+
+La prima richiesta per una chiave diventa il "leader" ed esegue la chiamata;
+le richieste identiche che arrivano mentre e' in corso aspettano lo stesso
+risultato invece di avviare un'altra generazione. Le attese usano
+concurrent.futures.Future, quindi funzionano tra thread ed event loop diversi
+(async_to_sync sotto WSGI crea un loop per richiesta).
+
+Se il leader viene cancellato (il suo client si e' disconnesso) la
+generazione continua finche' qualcuno la sta aspettando; quando se ne va
+anche l'ultimo viene cancellata, cosi' Ollama smette di generare e lo slot
+dello scheduler si libera.
+
+Con settings.OLLAMA_SINGLEFLIGHT['CROSS_PROCESS'] il leader prende anche un
+lock file per chiave, cosi' i worker di altri processi aspettano e poi
+rileggono il risultato dalla cache condivisa (backend 'file' o 'django').
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import errno
+import os
+import threading
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: niente lock tra processi
+    fcntl = None
+
+
+class LeaderGone(Exception):
+    """Il leader e' stato cancellato: chi aspettava deve riprovare"""
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        # future -> quanti lo aspettano / generazione rimasta senza leader
+        self._followers = {}
+        self._orphans = {}
+
+    def claim(self, key):
+        """Restituisce (future, leader): leader=True se tocca a noi eseguire"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = concurrent.futures.Future()
+            self._calls[key] = future
+            return future, True
+
+    def resolve(self, key, future, result=None, exception=None):
+        """Pubblica il risultato del leader e libera la chiave"""
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    async def follow(self, future):
+        """Attende il risultato del leader contando tra chi aspetta"""
+        with self._lock:
+            self._followers[future] = self._followers.get(future, 0) + 1
+        try:
+            return await wait_future(future)
+        finally:
+            with self._lock:
+                self._followers[future] -= 1
+                left = self._followers[future]
+                if not left:
+                    del self._followers[future]
+                orphan = self._orphans.get(future) if not left else None
+            if orphan is not None:
+                loop, task = orphan
+                try:
+                    loop.call_soon_threadsafe(task.cancel)
+                except RuntimeError:
+                    pass
+
+    def _settle(self, key, future, task):
+        """Pubblica l'esito di una generazione rimasta senza leader"""
+        with self._lock:
+            self._orphans.pop(future, None)
+        if task.cancelled():
+            self.resolve(key, future, exception=LeaderGone())
+        elif task.exception() is not None:
+            self.resolve(key, future, exception=task.exception())
+        else:
+            self.resolve(key, future, result=task.result())
+
+    async def _abandon(self, key, future, task):
+        """
+        Il leader e' stato cancellato: la generazione prosegue se qualcuno
+        la aspetta, altrimenti viene cancellata anche lei
+        """
+        with self._lock:
+            followed = bool(self._followers.get(future))
+            if followed:
+                self._orphans[future] = (asyncio.get_running_loop(), task)
+        if followed:
+            task.add_done_callback(lambda done: self._settle(key, future, done))
+            return
+        task.cancel()
+        try:
+            # Si esce solo quando Ollama e lo slot dello scheduler sono liberati
+            await asyncio.wait([task])
+        finally:
+            if task.done():
+                self._settle(key, future, task)
+            else:
+                self.resolve(key, future, exception=LeaderGone())
+
+    async def ado(self, key, fn):
+        """Esegue await fn() una sola volta per chiave: restituisce (risultato, shared)"""
+        while True:
+            future, leader = self.claim(key)
+            if not leader:
+                try:
+                    return await self.follow(future), True
+                except LeaderGone:
+                    continue
+
+            task = asyncio.ensure_future(fn())
+            try:
+                result = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                await self._abandon(key, future, task)
+                raise
+            except Exception as e:
+                self.resolve(key, future, exception=e)
+                raise
+            self.resolve(key, future, result=result)
+            return result, False
+
+    def do(self, key, fn):
+        """Versione sync di ado per thread senza event loop"""
+        while True:
+            future, leader = self.claim(key)
+            if not leader:
+                try:
+                    return future.result(), True
+                except LeaderGone:
+                    continue
+
+            try:
+                result = fn()
+            except Exception as e:
+                self.resolve(key, future, exception=e)
+                raise
+            except BaseException:
+                self.resolve(key, future, exception=LeaderGone())
+                raise
+            self.resolve(key, future, result=result)
+            return result, False
+
+
+async def wait_future(future):
+    """
+    Attende un concurrent.futures.Future dal loop corrente.
+
+    A differenza di asyncio.wrap_future, se chi aspetta viene cancellato il
+    future condiviso resta valido per gli altri.
+    """
+    loop = asyncio.get_running_loop()
+    waiter = loop.create_future()
+
+    def copy_state(done):
+        if waiter.done():
+            return
+        exception = done.exception()
+        if exception is not None:
+            waiter.set_exception(exception)
+        else:
+            waiter.set_result(done.result())
+
+    def on_done(done):
+        try:
+            loop.call_soon_threadsafe(copy_state, done)
+        except RuntimeError:
+            # Loop gia' chiuso: chi aspettava non c'e' piu'
+            pass
+
+    future.add_done_callback(on_done)
+    return await waiter
+
+
+@contextlib.asynccontextmanager
+async def process_lock(key):
+    """Lock file per chiave tra processi (no-op se disattivato)"""
+    config = settings.OLLAMA_SINGLEFLIGHT
+    if not config.get('CROSS_PROCESS') or fcntl is None:
+        yield
+        return
+
+    lock_dir = config['LOCK_DIR']
+    os.makedirs(lock_dir, exist_ok=True)
+    fd = os.open(os.path.join(lock_dir, f'{key}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                await asyncio.sleep(config.get('POLL_INTERVAL', 0.2))
+        yield
+    finally:
+        # Il file resta: rimuoverlo qui creerebbe una race con chi ha gia' l'fd aperto
+        os.close(fd)
+
+
+flight = SingleFlight()
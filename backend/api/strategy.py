@@ -0,0 +1,278 @@
+"""
+Generazione della strategia a pipeline ("mode": "pipelined").
+
+Qui c'e' anche la rigenerazione incrementale ("mode": "incremental"):
+solo le sezioni toccate dal feedback vengono rigenerate con prompt mirati e
+poi riunite alla strategia precedente.
+
+Invece di un'unica chiamata da 4000 token che spesso sfora num_ctx, una
+prima chiamata breve produce pilastri, hashtag, orari e consigli; poi il
+calendario viene diviso in blocchi di giorni generati in parallelo (lo
+scheduler decide quanti arrivano davvero insieme a Ollama) e riunito nello
+stesso schema della modalita' classica.
+"""
+import asyncio
+import json
+import re
+
+from django.conf import settings
+
+from .generation import agenerate
+from .json_stream import extract_json
+from .metrics import parse_json
+from .ollama_client import OllamaError
+from .prompts import (
+    get_calendar_chunk_prompt,
+    get_regenerate_section_prompt,
+    get_strategy_outline_prompt
+)
+from .schemas import CALENDAR_DAYS, STRATEGY_SECTION_SCHEMAS, calendar_schema, ollama_format
+
+
+OUTLINE_TOKENS = 1200
+# Token stimati per giorno di calendario, piu' un margine per blocco
+TOKENS_PER_DAY = 90
+CHUNK_OVERHEAD_TOKENS = 100
+
+STRATEGY_SECTIONS = ['content_pillars', 'calendar', 'hashtags', 'posting_times', 'engagement_tips']
+
+# Frasi del feedback che indicano quale sezione va rigenerata. Solo frasi
+# proprie di una sezione: parole generiche (focus, topic, engagement, ...)
+# compaiono in quasi ogni feedback, e se nulla corrisponde la view rifa'
+# tutta la strategia
+SECTION_KEYWORDS = {
+    'content_pillars': ['pillar', 'content theme', 'core theme'],
+    'calendar': [
+        'calendar', 'content schedule', 'reel', 'carousel', 'post type', 'post format', 'static post',
+        'hook', 'post idea', 'content idea',
+    ],
+    'hashtags': ['hashtag', '#'],
+    'posting_times': [
+        'posting time', 'posting schedule', 'time to post', 'when to post', 'best time', 'time slot',
+        'post in the morning', 'post in the evening', 'post at night',
+    ],
+    'engagement_tips': ['tip', 'engagement tip', 'engagement advice', 'engagement strategy'],
+}
+
+
+def _keyword_pattern(keyword):
+    """Parola intera, anche al plurale ('tip' non trova 'multiple'); '#' ovunque"""
+    if not keyword[0].isalnum():
+        return re.escape(keyword)
+    return rf'\b{re.escape(keyword)}(?:s|es)?\b'
+
+
+SECTION_PATTERNS = {
+    section: re.compile('|'.join(_keyword_pattern(keyword) for keyword in keywords))
+    for section, keywords in SECTION_KEYWORDS.items()
+}
+
+# Budget di output per sezione rigenerata
+SECTION_TOKENS = {
+    'content_pillars': 400,
+    'calendar': 3000,
+    'hashtags': 300,
+    'posting_times': 400,
+    'engagement_tips': 400,
+}
+
+# Schema della prima chiamata della pipeline: tutto tranne il calendario
+OUTLINE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        name: schema for name, schema in STRATEGY_SECTION_SCHEMAS.items() if name != 'calendar'
+    },
+    'required': [name for name in STRATEGY_SECTIONS if name != 'calendar'],
+}
+
+
+def calendar_ranges(days, chunk_days):
+    """Divide 1..days in intervalli (start, end) di al massimo chunk_days giorni"""
+    return [
+        (start, min(start + chunk_days - 1, days))
+        for start in range(1, days + 1, chunk_days)
+    ]
+
+
+def parse_calendar_chunk(text, start_day, end_day):
+    """
+    Estrae le voci del calendario da un blocco. Le voci senza giorno, fuori
+    dal blocco (es. 1-10 invece di 11-20) o con un giorno gia' preso vengono
+    rinumerate, in ordine, sui giorni liberi del blocco.
+    """
+    value, _ = parse_json(text)
+    if isinstance(value, dict):
+        value = value.get('calendar', [])
+    if not isinstance(value, list):
+        raise ValueError('calendar chunk is not a list')
+
+    placed = {}
+    misplaced = []
+    for entry in value:
+        if not isinstance(entry, dict):
+            continue
+        day = entry.get('day')
+        if isinstance(day, int) and start_day <= day <= end_day and day not in placed:
+            placed[day] = entry
+        else:
+            misplaced.append(entry)
+    free = [day for day in range(start_day, end_day + 1) if day not in placed]
+    for day, entry in zip(free, misplaced):
+        entry['day'] = day
+        placed[day] = entry
+    return [placed[day] for day in sorted(placed)]
+
+
+async def _acalendar_chunk(niche, target_audience, goals, pillars, start_day, end_day, cache_mode,
+                           model=None):
+    """Restituisce (start, end, voci, errore) senza sollevare per errori di parsing"""
+    prompt = get_calendar_chunk_prompt(niche, target_audience, goals, pillars, start_day, end_day)
+    max_tokens = (end_day - start_day + 1) * TOKENS_PER_DAY + CHUNK_OVERHEAD_TOKENS
+    try:
+        generation = await agenerate(
+            prompt, 0.8, max_tokens, cache_mode, 'generate_strategy',
+            ollama_format(calendar_schema(end_day - start_day + 1)), model
+        )
+        return start_day, end_day, parse_calendar_chunk(generation.text, start_day, end_day), None
+    except (OllamaError, ValueError) as e:
+        return start_day, end_day, [], str(e)
+
+
+async def apipeline_strategy(niche, target_audience, goals, posting_frequency, cache_mode=None,
+                             model=None):
+    """
+    Async generator di eventi (nome, dati): 'outline', poi un 'calendar' per
+    ogni blocco completato e infine 'result' con (strategia, warnings).
+    """
+    outline_prompt = get_strategy_outline_prompt(niche, target_audience, goals, posting_frequency)
+    outline_generation = await agenerate(
+        outline_prompt, 0.8, OUTLINE_TOKENS, cache_mode, 'generate_strategy',
+        ollama_format(OUTLINE_SCHEMA), model
+    )
+    try:
+        outline, _ = parse_json(outline_generation.text, shape=dict)
+    except ValueError as e:
+        raise OllamaError(f'Strategy outline was not valid JSON: {str(e)}') from e
+    if not isinstance(outline, dict):
+        raise OllamaError('Strategy outline was not a JSON object')
+    yield 'outline', outline
+
+    pillars = [p for p in outline.get('content_pillars', []) if isinstance(p, dict)]
+    ranges = calendar_ranges(CALENDAR_DAYS, settings.STRATEGY_CALENDAR_CHUNK_DAYS)
+    tasks = [
+        asyncio.create_task(_acalendar_chunk(
+            niche, target_audience, goals, pillars, start, end, cache_mode, model
+        ))
+        for start, end in ranges
+    ]
+
+    calendar = []
+    warnings = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            start, end, entries, error = await next_done
+            if error:
+                warnings.append(f'Calendar days {start}-{end} failed: {error}')
+                continue
+            calendar.extend(entries)
+            yield 'calendar', {'start_day': start, 'end_day': end, 'entries': entries}
+    finally:
+        # Se il client se ne va (o un blocco fallisce male) i blocchi rimasti non
+        # servono: si aspetta che la cancellazione arrivi fino alla chiamata a Ollama
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    calendar.sort(key=lambda entry: entry['day'])
+    strategy = {
+        'content_pillars': outline.get('content_pillars', []),
+        'calendar': calendar,
+        'hashtags': outline.get('hashtags', {}),
+        'posting_times': outline.get('posting_times', []),
+        'engagement_tips': outline.get('engagement_tips', []),
+    }
+    yield 'result', (strategy, warnings)
+
+
+def parse_previous_strategy(previous_strategy):
+    """La strategia precedente come dict, o None se non e' JSON utilizzabile"""
+    if isinstance(previous_strategy, dict):
+        value = previous_strategy
+    elif not isinstance(previous_strategy, str):
+        return None
+    else:
+        try:
+            value, _ = extract_json(previous_strategy, dict)
+        except ValueError:
+            return None
+    if not isinstance(value, dict) or not any(section in value for section in STRATEGY_SECTIONS):
+        return None
+    return value
+
+
+def target_sections(feedback):
+    """Sezioni della strategia a cui si riferisce il feedback, in ordine di schema"""
+    text = feedback.lower()
+    sections = [
+        section for section in STRATEGY_SECTIONS
+        if SECTION_PATTERNS[section].search(text)
+    ]
+    # Il calendario cita i pilastri per nome: se cambiano va rifatto anche lui
+    if 'content_pillars' in sections and 'calendar' not in sections:
+        sections.insert(1, 'calendar')
+    return sections
+
+
+def parse_section(section, text):
+    value, _ = parse_json(text)
+    if isinstance(value, dict) and section in value:
+        value = value[section]
+    expected = dict if section == 'hashtags' else list
+    if not isinstance(value, expected):
+        raise ValueError(f'{section} is not a JSON {expected.__name__}')
+    return value
+
+
+async def _asection(section, current_value, feedback, pillars, cache_mode, model=None):
+    """Restituisce (valore, errore) senza sollevare per errori di parsing"""
+    prompt = get_regenerate_section_prompt(
+        section, json.dumps(current_value, indent=2), feedback, pillars
+    )
+    try:
+        generation = await agenerate(
+            prompt, 0.8, SECTION_TOKENS[section], cache_mode, 'regenerate_strategy',
+            ollama_format(STRATEGY_SECTION_SCHEMAS[section]), model
+        )
+        return parse_section(section, generation.text), None
+    except (OllamaError, ValueError) as e:
+        return None, str(e)
+
+
+async def apipeline_regenerate(previous, sections, feedback, cache_mode=None, model=None):
+    """
+    Async generator di eventi: un 'section' per ogni sezione rigenerata e
+    infine 'result' con (strategia aggiornata, warnings). Le sezioni sono
+    rigenerate in parallelo; se cambiano i pilastri il calendario viene
+    rifatto dopo, con i nuovi nomi.
+    """
+    strategy = {section: previous.get(section) for section in STRATEGY_SECTIONS}
+    warnings = []
+
+    rounds = [sections]
+    if 'content_pillars' in sections and 'calendar' in sections:
+        rounds = [[s for s in sections if s != 'calendar'], ['calendar']]
+
+    for section_list in rounds:
+        pillars = strategy['content_pillars'] if isinstance(strategy['content_pillars'], list) else None
+        results = await asyncio.gather(*[
+            _asection(section, strategy[section], feedback, pillars, cache_mode, model)
+            for section in section_list
+        ])
+        for section, (value, error) in zip(section_list, results):
+            if error:
+                warnings.append(f'Section {section} kept unchanged: {error}')
+                continue
+            strategy[section] = value
+            yield 'section', {'name': section, 'value': value}
+
+    yield 'result', (strategy, warnings)
@@ -0,0 +1,154 @@
+"""
+Relay dei token di Ollama verso il client come Server-Sent Events o NDJSON.
+
+Ogni chunk di Ollama diventa un evento 'token'; ogni oggetto di un array
+(idee dei reels, giorni del calendario, ...) diventa un evento 'item' appena
+si chiude; a generazione finita viene
+emesso un evento 'done' con lo stesso payload della risposta non streaming
+(JSON gia' parsato e validato con i retry mirati di api/validation.py).
+Gli errori a meta' stream diventano un evento 'error'.
+"""
+import json
+from contextlib import aclosing
+
+from django.http import StreamingHttpResponse
+
+from . import history, metrics
+from .generation import astream_generate
+from .json_stream import JSONStreamExtractor
+from .ollama_client import OllamaError, clean_json_response
+from .responses import build_pipeline_result
+from .scheduler import Overloaded
+from .sessions import attach_session
+from .validation import avalidate_result
+
+
+SSE = 'sse'
+NDJSON = 'ndjson'
+
+CONTENT_TYPES = {
+    SSE: 'text/event-stream',
+    NDJSON: 'application/x-ndjson',
+}
+
+
+def get_stream_format(request, data):
+    """Restituisce 'sse', 'ndjson' o None in base al body e all'header Accept"""
+    mode = data.get('stream')
+    if mode is True or mode == SSE:
+        return SSE
+    if mode == NDJSON:
+        return NDJSON
+    if mode not in (None, False):
+        return None
+
+    accept = request.headers.get('Accept', '')
+    if CONTENT_TYPES[SSE] in accept:
+        return SSE
+    if CONTENT_TYPES[NDJSON] in accept:
+        return NDJSON
+    return None
+
+
+def encode_event(fmt, event, data):
+    """Serializza un evento nel formato richiesto"""
+    if fmt == SSE:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+    return (json.dumps({'event': event, 'data': data}) + '\n').encode()
+
+
+async def relay_generation(fmt, prompt, temperature, max_tokens, build_result, cache_mode=None,
+                           endpoint=None, output_format=None, key=None, model=None, context=None,
+                           timings=None):
+    """
+    Inoltra i token di Ollama e chiude con il risultato di build_result(testo);
+    se c'e' key, result[key] viene validato con lo schema dell'endpoint.
+    context continua una sessione (api/sessions.py); timings sono i Timings
+    della richiesta, che lo stream riprende perche' gira fuori dalla view.
+    """
+    if timings is not None:
+        metrics.activate(timings)
+    parts = []
+    extractor = JSONStreamExtractor()
+    result_context = None
+    try:
+        # Client disconnesso: Django chiude questo generatore e aclosing
+        # propaga la chiusura fino alla connessione con Ollama
+        async with aclosing(astream_generate(
+            prompt, temperature, max_tokens, cache_mode, endpoint, output_format, model, context
+        )) as chunks:
+            async for chunk in chunks:
+                result_context = chunk.get('context', result_context)
+                token = chunk.get('response', '')
+                if chunk.get('cached'):
+                    # Risposta gia' in cache: si passa direttamente all'evento finale
+                    parts.append(token)
+                elif token:
+                    parts.append(token)
+                    yield encode_event(fmt, 'token', {'token': token})
+                    for item in extractor.feed(token):
+                        yield encode_event(fmt, 'item', item)
+
+        result = build_result(clean_json_response(''.join(parts)))
+        if key:
+            result = await avalidate_result(result, key, endpoint, cache_mode, model)
+        result = attach_session(result, endpoint, model, result_context)
+        result = await history.arecord(endpoint, metrics.finish(result, timings))
+        yield encode_event(fmt, 'done', result)
+
+    except OllamaError as e:
+        yield encode_event(fmt, 'error', {'success': False, 'error': str(e)})
+    except Overloaded as e:
+        yield encode_event(fmt, 'error', {
+            'success': False, 'error': str(e), 'retry_after': e.retry_after
+        })
+
+
+async def relay_pipeline(fmt, events, key, extra, endpoint=None, cache_mode=None, model=None,
+                         timings=None):
+    """
+    Inoltra gli eventi intermedi di una pipeline (es. 'outline', 'calendar')
+    e chiude con 'done' quando arriva il risultato finale, validato come in
+    relay_generation.
+    """
+    if timings is not None:
+        metrics.activate(timings)
+    try:
+        async with aclosing(events):
+            async for event, data in events:
+                if event == 'result':
+                    value, warnings = data
+                    result = build_pipeline_result(key, value, warnings, extra)
+                    result = await avalidate_result(result, key, endpoint, cache_mode, model)
+                    result = await history.arecord(endpoint, metrics.finish(result, timings))
+                    yield encode_event(fmt, 'done', result)
+                else:
+                    yield encode_event(fmt, event, data)
+
+    except OllamaError as e:
+        yield encode_event(fmt, 'error', {'success': False, 'error': str(e)})
+    except Overloaded as e:
+        yield encode_event(fmt, 'error', {
+            'success': False, 'error': str(e), 'retry_after': e.retry_after
+        })
+
+
+async def relay_batch(fmt, results, summarize, timings=None):
+    """Un evento 'item' per ogni elemento completato, poi 'done' con summarize(risultati)"""
+    if timings is not None:
+        metrics.activate(timings)
+    collected = []
+    async with aclosing(results):
+        async for result in results:
+            collected.append(result)
+            yield encode_event(fmt, 'item', result)
+    done = {'success': True, 'summary': summarize(collected)}
+    yield encode_event(fmt, 'done', metrics.finish(done, timings))
+
+
+def streaming_response(fmt, events):
+    """StreamingHttpResponse senza buffering intermedio (proxy/ngrok)"""
+    response = StreamingHttpResponse(events, content_type=CONTENT_TYPES[fmt])
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
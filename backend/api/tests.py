@@ -1,3 +1,2147 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import math
+import os
+import runpy
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.conf import settings
+from django.db import OperationalError
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from . import (
+    batch, budget, cache, generation, hedging, jobs, metrics, ollama_client, routing, scheduler, schemas, singleflight, strategy,
+    models, precompute, prompts, semantic_cache, sessions, streaming, tiering, validation, warmup
+)
+from .fake_ollama import FakeOllama, Replay
+from .management.commands import bench_load, bench_stack
+from .json_stream import JSONStreamExtractor, extract_json
+from .models import GenerationJob
+
+
+TEST_CACHE = {'BACKEND': 'memory', 'TTL': 60, 'MAX_ENTRIES': 8}
+# Per i test che usano risposte finte non conformi agli schemi
+NO_VALIDATION = {'ENABLED': False, 'MAX_ROUNDS': 2}
+# Per i SimpleTestCase che chiamano le view senza database
+NO_HISTORY = {'ENABLED': False, 'PAGE_SIZE': 20, 'MAX_PAGE_SIZE': 100}
+
+
+class FreshCacheMixin:
+    """Svuota la cache delle risposte prima di ogni test"""
+
+    def setUp(self):
+        super().setUp()
+        cache.get_cache().clear()
+
+
+def ollama_result(text, eval_count=10, eval_duration=10**9):
+    """JSON di /api/generate con stream disattivato"""
+    return {'response': text, 'done': True, 'eval_count': eval_count, 'eval_duration': eval_duration}
+
+
+def ollama_transport(handler):
+    """Client async che risponde con handler(payload) invece di chiamare Ollama"""
+    calls = []
+
+    def respond(request):
+        payload = json.loads(request.content)
+        calls.append(payload)
+        return httpx.Response(200, json=handler(payload))
+
+    client = httpx.AsyncClient(base_url='http://ollama.test', transport=httpx.MockTransport(respond))
+    return client, calls
+
+
+class OllamaClientTests(SimpleTestCase):
+    def test_async_client_is_shared_within_loop(self):
+        async def run():
+            return ollama_client.get_async_client(), ollama_client.get_async_client()
+
+        first, second = asyncio.run(run())
+        self.assertIs(first, second)
+
+    @override_settings(OLLAMA_MAX_CONNECTIONS=3)
+    def test_sync_session_is_pooled(self):
+        with mock.patch.object(ollama_client, '_sync_session', None):
+            session = ollama_client.get_sync_session()
+            self.assertIs(session, ollama_client.get_sync_session())
+            self.assertEqual(session.get_adapter('http://ollama').poolmanager.connection_pool_kw['maxsize'], 3)
+
+    def test_acall_ollama_raw_cleans_response(self):
+        client, calls = ollama_transport(lambda payload: {'response': '```json\n{"a": 1}\n```'})
+
+        async def run():
+            with mock.patch.object(ollama_client, 'get_async_client', return_value=client):
+                return await ollama_client.acall_ollama_raw('ciao', temperature=0.2, max_tokens=10)
+
+        self.assertEqual(asyncio.run(run())['response'], '{"a": 1}')
+        self.assertEqual(calls[0]['options']['num_predict'], 10)
+        self.assertFalse(calls[0]['stream'])
+
+    def test_acall_ollama_raw_wraps_errors(self):
+        client = httpx.AsyncClient(
+            base_url='http://ollama.test',
+            transport=httpx.MockTransport(lambda request: httpx.Response(500, text='boom'))
+        )
+
+        async def run():
+            with mock.patch.object(ollama_client, 'get_async_client', return_value=client):
+                await ollama_client.acall_ollama_raw('ciao')
+
+        with self.assertRaisesMessage(ollama_client.OllamaError, 'status 500: boom'):
+            asyncio.run(run())
+
+
+@override_settings(OLLAMA_CACHE=TEST_CACHE, OLLAMA_VALIDATION=NO_VALIDATION, GENERATION_HISTORY=NO_HISTORY)
+class ViewTests(FreshCacheMixin, SimpleTestCase):
+    def test_generate_strategy_requires_niche(self):
+        response = self.client.post('/api/generate-strategy/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_generate_strategy_returns_parsed_json(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=ollama_result('{"content_pillars": []}')) as call:
+            response = self.client.post(
+                '/api/generate-strategy/', {'niche': 'Fitness'}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['strategy'], {'content_pillars': []})
+        call.assert_awaited_once()
+
+
+def ndjson_stream(tokens):
+    """Risposta streaming di Ollama con un chunk per token"""
+    lines = [json.dumps({'response': token, 'done': False}) for token in tokens]
+    lines.append(json.dumps({'response': '', 'done': True, 'eval_count': len(tokens)}))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+async def fake_stream(tokens):
+    for token in tokens:
+        yield {'response': token, 'done': False}
+    yield {'response': '', 'done': True}
+
+
+@override_settings(OLLAMA_CACHE=TEST_CACHE, OLLAMA_VALIDATION=NO_VALIDATION, GENERATION_HISTORY=NO_HISTORY)
+class StreamingTests(FreshCacheMixin, SimpleTestCase):
+    def test_astream_ollama_yields_chunks(self):
+        client = httpx.AsyncClient(
+            base_url='http://ollama.test',
+            transport=httpx.MockTransport(lambda request: httpx.Response(200, content=ndjson_stream(['{"a"', ': 1}'])))
+        )
+
+        async def run():
+            with mock.patch.object(ollama_client, 'get_async_client', return_value=client):
+                return [chunk async for chunk in ollama_client.astream_ollama('ciao')]
+
+        chunks = asyncio.run(run())
+        self.assertEqual([c['response'] for c in chunks], ['{"a"', ': 1}', ''])
+        self.assertTrue(chunks[-1]['done'])
+
+    async def test_generate_content_streams_sse(self):
+        with mock.patch.object(generation, 'astream_ollama', return_value=fake_stream(['{"caption"', ': "hi"}'])):
+            response = await AsyncClient().post(
+                '/api/generate-content/', {'topic': 'Yoga', 'stream': 'sse'}, content_type='application/json'
+            )
+            body = b''.join([part async for part in response.streaming_content]).decode()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [block.split('\n', 1) for block in body.strip().split('\n\n')]
+        self.assertEqual([e[0] for e in events], ['event: token', 'event: token', 'event: done'])
+        done = json.loads(events[-1][1][len('data: '):])
+        self.assertEqual(done['content'], {'caption': 'hi'})
+        self.assertEqual(done['metadata']['topic'], 'Yoga')
+
+    async def test_ndjson_selected_by_accept_header(self):
+        with mock.patch.object(generation, 'astream_ollama', return_value=fake_stream(['[1, 2]'])):
+            response = await AsyncClient().post(
+                '/api/generate-trending-reels/', {'niche': 'Food'},
+                content_type='application/json', headers={'Accept': 'application/x-ndjson'}
+            )
+            lines = [json.loads(line) async for line in response.streaming_content]
+
+        self.assertEqual(lines[-1]['data'].pop('timings')['generations'], 1)
+        self.assertEqual(lines[-1], {'event': 'done', 'data': {
+            'success': True, 'ideas': [1, 2], 'metadata': {
+                'niche': 'Food', 'target_audience': 'General audience',
+                'model': settings.OLLAMA_MODELS['large'], 'model_reason': 'endpoint'
+            }
+        }})
+
+    async def test_upstream_error_becomes_error_event(self):
+        async def failing():
+            raise ollama_client.OllamaError('down')
+            yield
+
+        with mock.patch.object(generation, 'astream_ollama', return_value=failing()):
+            events = [e async for e in streaming.relay_generation('ndjson', 'p', 0.7, 10, lambda text: text)]
+
+        self.assertEqual([json.loads(e) for e in events], [
+            {'event': 'error', 'data': {'success': False, 'error': 'down'}}
+        ])
+
+
+class CacheTests(SimpleTestCase):
+    def test_key_depends_on_prompt_and_options(self):
+        payload = ollama_client.build_payload('p', 0.7, 100)
+        same = ollama_client.build_payload('p', 0.7, 100)
+        other = ollama_client.build_payload('p', 0.8, 100)
+        self.assertEqual(cache.make_cache_key(payload), cache.make_cache_key(same))
+        self.assertNotEqual(cache.make_cache_key(payload), cache.make_cache_key(other))
+
+    def test_memory_cache_evicts_least_recently_used(self):
+        store = cache.MemoryCache(ttl=60, max_entries=2)
+        store.set('a', 1)
+        store.set('b', 2)
+        store.get('a')
+        store.set('c', 3)
+        self.assertEqual((store.get('a'), store.get('b'), store.get('c')), (1, None, 3))
+
+    def test_memory_cache_expires(self):
+        store = cache.MemoryCache(ttl=-1, max_entries=2)
+        store.set('a', 1)
+        self.assertIsNone(store.get('a'))
+
+    def test_file_cache_persists_and_evicts(self):
+        with tempfile.TemporaryDirectory() as location:
+            store = cache.FileCache(ttl=60, max_entries=2, location=location)
+            store.set('a', 'uno')
+            time.sleep(0.01)
+            store.set('b', 'due')
+            time.sleep(0.01)
+            store.set('c', 'tre')
+            reopened = cache.FileCache(ttl=60, max_entries=2, location=location)
+            self.assertEqual([reopened.get(k) for k in 'abc'], [None, 'due', 'tre'])
+
+    def test_file_cache_scans_only_over_the_limit(self):
+        with tempfile.TemporaryDirectory() as location:
+            store = cache.FileCache(ttl=60, max_entries=20, location=location)
+            with mock.patch('api.cache.os.scandir', wraps=os.scandir) as scandir:
+                asyncio.run(store.aset('a', 'uno'))
+                for n in range(10):
+                    asyncio.run(store.aset('a', n))
+                    asyncio.run(store.aset(f'k{n}', n))
+                self.assertEqual(scandir.call_count, 1)
+                for n in range(10, 21):
+                    store.set(f'k{n}', n)
+                self.assertEqual(scandir.call_count, 2)
+            self.assertEqual(len(os.listdir(location)), 19)
+            self.assertEqual(asyncio.run(store.aget('k20')), 20)
+
+    @override_settings(OLLAMA_CACHE={'BACKEND': 'django', 'LOCATION': 'default', 'TTL': 60})
+    def test_django_backend(self):
+        store = cache.get_cache()
+        self.assertIsInstance(store, cache.DjangoCache)
+        store.set('k', 'v')
+        self.assertEqual(asyncio.run(store.aget('k')), 'v')
+
+
+@override_settings(OLLAMA_CACHE=TEST_CACHE, OLLAMA_VALIDATION=NO_VALIDATION, GENERATION_HISTORY=NO_HISTORY)
+class CachedViewTests(FreshCacheMixin, SimpleTestCase):
+    def post(self, **extra):
+        body = {'niche': 'Food', **extra}
+        return self.client.post('/api/generate-trending-reels/', body, content_type='application/json')
+
+    def test_repeat_request_is_served_from_cache(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=ollama_result('[1]')) as call:
+            first = self.post()
+            second = self.post()
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(second.json()['ideas'], [1])
+        self.assertEqual(call.await_count, 1)
+
+    def test_bypass_and_refresh(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=[ollama_result(t) for t in ['[1]', '[2]', '[3]']]) as call:
+            self.post()
+            bypass = self.post(cache='bypass')
+            refresh = self.post(cache='refresh')
+            cached = self.post()
+        self.assertEqual(bypass.json()['ideas'], [2])
+        self.assertEqual(refresh['X-Cache'], 'REFRESH')
+        self.assertEqual(cached.json()['ideas'], [3])
+        self.assertEqual(call.await_count, 3)
+
+    def test_invalid_cache_mode(self):
+        self.assertEqual(self.post(cache='sometimes').status_code, 400)
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'})
+class SingleFlightTests(SimpleTestCase):
+    def slow_ollama(self, delay=0.05):
+        calls = []
+
+        async def fake(prompt, temperature=0.7, max_tokens=2000, format=None, model=None, context=None):
+            calls.append(prompt)
+            await asyncio.sleep(delay)
+            return ollama_result(f'risposta {len(calls)}')
+
+        return fake, calls
+
+    def test_concurrent_identical_requests_share_one_generation(self):
+        fake, calls = self.slow_ollama()
+
+        async def run():
+            return await asyncio.gather(*[generation.agenerate('p') for _ in range(5)])
+
+        with mock.patch.object(generation, 'acall_ollama_raw', fake):
+            results = asyncio.run(run())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({r.text for r in results}, {'risposta 1'})
+        self.assertEqual(sorted(r.cache_status for r in results), ['coalesced'] * 4 + ['miss'])
+
+    def test_coalescing_across_threads(self):
+        fake, calls = self.slow_ollama(delay=0.2)
+        results = []
+
+        def worker():
+            results.append(asyncio.run(generation.agenerate('p')).text)
+
+        with mock.patch.object(generation, 'acall_ollama_raw', fake):
+            threads = [threading.Thread(target=worker) for _ in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['risposta 1'] * 3)
+
+    def test_generation_survives_leader_cancel_while_followers_wait(self):
+        fake, calls = self.slow_ollama()
+
+        async def run():
+            leader = asyncio.create_task(generation.agenerate('p'))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(generation.agenerate('p'))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+
+        with mock.patch.object(generation, 'acall_ollama_raw', fake):
+            result = asyncio.run(run())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(result.text, 'risposta 1')
+        self.assertEqual(result.cache_status, 'coalesced')
+
+    def test_errors_are_shared(self):
+        flight = singleflight.SingleFlight()
+
+        async def boom():
+            await asyncio.sleep(0.01)
+            raise ValueError('no')
+
+        async def run():
+            return await asyncio.gather(flight.ado('k', boom), flight.ado('k', boom), return_exceptions=True)
+
+        self.assertEqual([type(r) for r in asyncio.run(run())], [ValueError, ValueError])
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_process_lock_serializes_holders(self):
+        order = []
+
+        async def hold(name):
+            async with singleflight.process_lock('k'):
+                order.append(f'{name}-in')
+                await asyncio.sleep(0.05)
+                order.append(f'{name}-out')
+
+        async def run():
+            await asyncio.gather(hold('a'), hold('b'))
+
+        with tempfile.TemporaryDirectory() as lock_dir:
+            config = {'CROSS_PROCESS': True, 'LOCK_DIR': lock_dir, 'POLL_INTERVAL': 0.01}
+            with override_settings(OLLAMA_SINGLEFLIGHT=config):
+                asyncio.run(run())
+
+        self.assertEqual(order, ['a-in', 'a-out', 'b-in', 'b-out'])
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'}, OLLAMA_VALIDATION=NO_VALIDATION)
+class JobTests(TestCase):
+    def submit_strategy(self, **extra):
+        with mock.patch.object(jobs, 'submit') as submit:
+            response = self.client.post(
+                '/api/generate-strategy/', {'niche': 'Fitness', 'async': True, **extra},
+                content_type='application/json'
+            )
+        return response, submit
+
+    def test_async_post_returns_job_immediately(self):
+        response, submit = self.submit_strategy()
+        self.assertEqual(response.status_code, 202)
+        job = GenerationJob.objects.get(pk=response.json()['job_id'])
+        self.assertEqual(job.status, GenerationJob.QUEUED)
+        self.assertEqual(job.options['max_tokens'], 4000)
+        submit.assert_called_once_with(job.pk)
+        self.assertEqual(response.json()['status_url'], f'/api/jobs/{job.pk}/')
+
+    def test_job_runs_and_stores_result(self):
+        response, _ = self.submit_strategy()
+        job_id = response.json()['job_id']
+        tokens = ['{"content_pillars"', ': []', '}']
+
+        with mock.patch.object(generation, 'astream_ollama', return_value=fake_stream(tokens)):
+            async_to_sync(jobs._arun_job)(job_id)
+
+        data = self.client.get(f'/api/jobs/{job_id}/').json()['job']
+        self.assertEqual(data['status'], GenerationJob.SUCCEEDED)
+        self.assertEqual(data['progress_tokens'], 3)
+        self.assertEqual(data['result']['strategy'], {'content_pillars': []})
+        self.assertEqual(data['result']['metadata']['niche'], 'Fitness')
+
+    def test_failed_job_records_error(self):
+        response, _ = self.submit_strategy()
+        job_id = response.json()['job_id']
+
+        async def failing(*args):
+            raise ollama_client.OllamaError('down')
+            yield
+
+        with mock.patch.object(generation, 'astream_ollama', return_value=failing()):
+            async_to_sync(jobs._arun_job)(job_id)
+
+        job = GenerationJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.error), (GenerationJob.FAILED, 'down'))
+
+    @override_settings(JOB_MAX_QUEUED=1)
+    def test_queue_limit(self):
+        self.submit_strategy()
+        response, submit = self.submit_strategy()
+        self.assertEqual(response.status_code, 503)
+        submit.assert_not_called()
+
+    @override_settings(JOB_MAX_QUEUED=1, JOB_OWNER='web')
+    def test_jobs_of_a_previous_boot_fail_and_free_the_queue(self):
+        def create(status, owner='web', boot_id='previous'):
+            return GenerationJob.objects.create(
+                kind='generate_strategy', prompt='p', result_key='strategy', status=status,
+                owner=owner, boot_id=boot_id
+            )
+
+        stale = [create(GenerationJob.QUEUED), create(GenerationJob.RUNNING)]
+        done = create(GenerationJob.SUCCEEDED)
+        # Job vivi di un altro servizio (es. l'admin) sullo stesso database
+        other = create(GenerationJob.RUNNING, owner='admin')
+
+        # Solo i job di questo avvio contano per il limite
+        response, submit = self.submit_strategy()
+        self.assertEqual(response.status_code, 202)
+        current = GenerationJob.objects.get(pk=response.json()['job_id'])
+        self.assertEqual((current.owner, current.boot_id), ('web', jobs.BOOT_ID))
+
+        with self.assertLogs('api.jobs', 'WARNING'):
+            self.assertEqual(jobs.fail_stale_jobs(), 2)
+        for job in stale:
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.error), (GenerationJob.FAILED, jobs.INTERRUPTED))
+        statuses = [GenerationJob.objects.get(pk=job.pk).status for job in (done, other, current)]
+        self.assertEqual(statuses, [GenerationJob.SUCCEEDED, GenerationJob.RUNNING, GenerationJob.QUEUED])
+
+    def test_failed_job_is_not_overwritten_when_it_finishes(self):
+        response, _ = self.submit_strategy()
+        job_id = response.json()['job_id']
+
+        async def interrupted(*args):
+            # fail_stale_jobs di un altro avvio mentre il job girava
+            await GenerationJob.objects.filter(pk=job_id).aupdate(status=GenerationJob.FAILED)
+            yield {'response': '{}', 'done': True}
+
+        with mock.patch.object(generation, 'astream_ollama', return_value=interrupted()):
+            async_to_sync(jobs._arun_job)(job_id)
+        self.assertEqual(GenerationJob.objects.get(pk=job_id).status, GenerationJob.FAILED)
+
+    def test_unknown_job(self):
+        response = self.client.get('/api/jobs/00000000-0000-0000-0000-000000000000/')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'}, OLLAMA_VALIDATION=NO_VALIDATION,
+                   GENERATION_HISTORY=NO_HISTORY, JOB_WORKERS=2)
+class JobLoopTests(TransactionTestCase):
+    def test_jobs_share_one_loop_and_client(self):
+        with FakeOllama(response='{"content_pillars": []}') as node, routing_settings([node.url]):
+            ids = [
+                async_to_sync(jobs.acreate_job)('generate_strategy', f'prompt {n}', 0.8, 100, 'strategy', {})
+                for n in range(3)
+            ]
+            # acreate_job ha gia' chiamato submit: si aspetta la fine dei job
+            deadline = time.monotonic() + 10
+            finished = GenerationJob.objects.filter(status=GenerationJob.SUCCEEDED)
+            while finished.count() < 3 and time.monotonic() < deadline:
+                time.sleep(0.02)
+        self.assertEqual(finished.count(), 3)
+        self.assertEqual(len(node.requests), 3)
+        # Un client per il loop dei job, non uno (mai chiuso) per job
+        loop = jobs.get_loop()
+        clients = [client for key, client in list(ollama_client._async_clients.items()) if key is loop]
+        self.assertEqual(len(clients), 1)
+
+
+class SchedulerTests(SimpleTestCase):
+    def test_priority_order_when_slots_free_up(self):
+        sched = scheduler.Scheduler(max_concurrency=1, max_queue=10, tokens_per_second=10)
+        order = []
+
+        async def job(name, priority):
+            async with sched.aslot(priority, 100):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async def run():
+            first = asyncio.create_task(job('first', 3))
+            await asyncio.sleep(0)
+            await asyncio.gather(first, job('strategy', 3), job('optimize', 0))
+
+        asyncio.run(run())
+        self.assertEqual(order, ['first', 'optimize', 'strategy'])
+        self.assertEqual((sched.active, sched.queued), (0, 0))
+
+    def test_full_queue_is_rejected_with_retry_after(self):
+        sched = scheduler.Scheduler(max_concurrency=1, max_queue=1, tokens_per_second=10)
+        sched.acquire(0, 100)
+        sched.acquire(0, 50)
+        with self.assertRaises(scheduler.Overloaded) as ctx:
+            sched.acquire(0, 50)
+        # 150 token in coda a 10 token/s su uno slot
+        self.assertEqual(ctx.exception.retry_after, 15)
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        sched = scheduler.Scheduler(max_concurrency=1, max_queue=5, tokens_per_second=10)
+
+        async def run():
+            async with sched.aslot(0, 10):
+                waiter = asyncio.create_task(sched.aslot(0, 10).__aenter__())
+                await asyncio.sleep(0)
+                waiter.cancel()
+                await asyncio.gather(waiter, return_exceptions=True)
+                self.assertEqual(sched.queued, 0)
+
+        asyncio.run(run())
+        self.assertEqual(sched.active, 0)
+
+    def test_throughput_is_smoothed(self):
+        sched = scheduler.Scheduler(max_concurrency=1, max_queue=1, tokens_per_second=10, smoothing=0.5)
+        sched.record_throughput(200, 10)
+        self.assertEqual(sched.tokens_per_second, 15)
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'})
+class OverloadTests(SimpleTestCase):
+    @override_settings(OLLAMA_SCHEDULER={
+        'MAX_CONCURRENCY': 1, 'MAX_QUEUE': 0, 'INITIAL_TOKENS_PER_SECOND': 100,
+        'DEFAULT_PRIORITY': 0, 'PRIORITIES': {},
+    })
+    def test_view_returns_503_when_saturated(self):
+        scheduler.get_scheduler().acquire(0, 1000)
+        response = self.client.post('/api/optimize-idea/', {'idea_content': 'x'}, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '10')
+
+        stream = self.client.post(
+            '/api/optimize-idea/', {'idea_content': 'x', 'stream': 'sse'}, content_type='application/json'
+        )
+        self.assertEqual(stream.status_code, 503)
+
+
+def fake_pipeline_ollama(prompt, temperature=0.7, max_tokens=2000, format=None, model=None, context=None):
+    """Risponde all'outline o al blocco di calendario in base al prompt"""
+    if 'Do NOT include a content calendar' in prompt:
+        return ollama_result(json.dumps({
+            'content_pillars': [{'name': 'Tips', 'description': '...'}],
+            'hashtags': {'niche': ['#a']},
+            'posting_times': [],
+            'engagement_tips': ['tip'],
+        }))
+    start, end = [int(n) for n in prompt.split('for days ')[1].split(':')[0].split(' to ')]
+    return ollama_result(json.dumps([{'day': d, 'topic': f'topic {d}'} for d in range(end, start - 1, -1)]))
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'}, STRATEGY_CALENDAR_CHUNK_DAYS=10,
+                   OLLAMA_VALIDATION=NO_VALIDATION, GENERATION_HISTORY=NO_HISTORY)
+class PipelinedStrategyTests(SimpleTestCase):
+    def post(self, **extra):
+        return self.client.post(
+            '/api/generate-strategy/', {'niche': 'Fitness', 'mode': 'pipelined', **extra},
+            content_type='application/json'
+        )
+
+    def test_calendar_ranges(self):
+        self.assertEqual(strategy.calendar_ranges(30, 12), [(1, 12), (13, 24), (25, 30)])
+
+    def test_merges_chunks_into_strategy_schema(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=fake_pipeline_ollama) as call:
+            response = self.post()
+
+        data = response.json()
+        self.assertEqual(call.await_count, 4)
+        self.assertEqual(list(data['strategy']), [
+            'content_pillars', 'calendar', 'hashtags', 'posting_times', 'engagement_tips'
+        ])
+        self.assertEqual([e['day'] for e in data['strategy']['calendar']], list(range(1, 31)))
+        self.assertEqual(data['metadata']['mode'], 'pipelined')
+        self.assertNotIn('warning', data)
+
+    def test_chunk_days_are_renumbered_into_the_chunk(self):
+        text = json.dumps([
+            {'day': 1, 'topic': 'a'}, {'topic': 'b'}, {'day': 13, 'topic': 'c'}, {'day': 13, 'topic': 'd'}
+        ])
+        entries = strategy.parse_calendar_chunk(text, 11, 14)
+        self.assertEqual([(e['day'], e['topic']) for e in entries], [(11, 'a'), (12, 'b'), (13, 'c'), (14, 'd')])
+        # Piu' voci che giorni: le ultime non ci stanno
+        self.assertEqual(len(strategy.parse_calendar_chunk(text, 11, 12)), 2)
+
+    async def test_closing_the_pipeline_waits_for_cancelled_chunks(self):
+        finished = []
+
+        async def chunk(niche, audience, goals, pillars, start, end, cache_mode, model=None):
+            try:
+                if start > 1:
+                    await asyncio.Event().wait()
+                return start, end, [{'day': start}], None
+            finally:
+                finished.append(start)
+
+        outline = ollama_result(json.dumps({'content_pillars': []}))
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=outline), \
+                mock.patch.object(strategy, '_acalendar_chunk', chunk):
+            events = strategy.apipeline_strategy('Fitness', 'Moms', 'Sales', 'Daily')
+            self.assertEqual((await anext(events))[0], 'outline')
+            self.assertEqual((await anext(events))[1]['start_day'], 1)
+            await events.aclose()
+        self.assertEqual(sorted(finished), [1, 11, 21])
+
+    def test_failed_chunk_becomes_warning(self):
+        def flaky(prompt, *args):
+            if 'days 11 to 20' in prompt:
+                return ollama_result('not json')
+            return fake_pipeline_ollama(prompt)
+
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=flaky):
+            data = self.post().json()
+
+        self.assertEqual(len(data['strategy']['calendar']), 20)
+        self.assertIn('Calendar days 11-20 failed', data['warning'])
+
+    async def test_streams_outline_and_chunks(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=fake_pipeline_ollama):
+            response = await AsyncClient().post(
+                '/api/generate-strategy/', {'niche': 'Fitness', 'mode': 'pipelined', 'stream': 'ndjson'},
+                content_type='application/json'
+            )
+            events = [json.loads(line)['event'] async for line in response.streaming_content]
+
+        self.assertEqual(events, ['outline', 'calendar', 'calendar', 'calendar', 'done'])
+
+    def test_invalid_mode(self):
+        self.assertEqual(self.post(mode='parallel').status_code, 400)
+
+
+PREVIOUS_STRATEGY = {
+    'content_pillars': [{'name': 'Old', 'description': '...'}],
+    'calendar': [{'day': 1, 'pillar': 'Old', 'topic': 'x'}],
+    'hashtags': {'niche': ['#old']},
+    'posting_times': [{'day': 'Monday', 'times': ['9:00 AM']}],
+    'engagement_tips': ['old tip'],
+}
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'}, OLLAMA_VALIDATION=NO_VALIDATION, GENERATION_HISTORY=NO_HISTORY)
+class IncrementalRegenerateTests(SimpleTestCase):
+    def post(self, feedback, previous=PREVIOUS_STRATEGY):
+        return self.client.post('/api/regenerate-strategy/', {
+            'previous_strategy': previous, 'feedback': feedback, 'mode': 'incremental'
+        }, content_type='application/json')
+
+    def test_target_sections(self):
+        self.assertEqual(strategy.target_sections('Better hashtags please'), ['hashtags'])
+        self.assertEqual(strategy.target_sections('New pillars'), ['content_pillars', 'calendar'])
+        self.assertEqual(strategy.target_sections('Make it better'), [])
+        # Solo parole intere: 'multiple' non contiene il 'tip' dei consigli
+        self.assertEqual(strategy.target_sections('Make it multiple times funnier, ideally'), [])
+        self.assertEqual(strategy.target_sections('More tips and #fitness'), ['hashtags', 'engagement_tips'])
+        self.assertEqual(strategy.target_sections('Post in the evenings'), ['posting_times'])
+        self.assertEqual(strategy.target_sections('More reels in the calendar'), ['calendar'])
+
+    def test_generic_feedback_targets_no_section(self):
+        for feedback in ['Focus more on beginners', 'I want more engagement', 'Another topic idea',
+                         'Make it feel like a morning routine', 'Tags are fine, change the tone']:
+            self.assertEqual(strategy.target_sections(feedback), [], feedback)
+
+    def test_only_targeted_section_is_regenerated(self):
+        with mock.patch.object(generation, 'acall_ollama_raw',
+                               return_value=ollama_result('{"niche": ["#new"]}')) as call:
+            data = self.post('I want different hashtags').json()
+
+        self.assertEqual(call.await_count, 1)
+        self.assertIn('**Section:** hashtags', call.await_args.args[0])
+        self.assertEqual(data['strategy']['hashtags'], {'niche': ['#new']})
+        self.assertEqual(data['strategy']['calendar'], PREVIOUS_STRATEGY['calendar'])
+        self.assertEqual(data['metadata']['regenerated_sections'], ['hashtags'])
+
+    def test_calendar_follows_new_pillars(self):
+        def fake(prompt, *args):
+            if '**Section:** content_pillars' in prompt:
+                return ollama_result('[{"name": "Fresh", "description": "..."}]')
+            self.assertIn('(use these names):** Fresh', prompt)
+            return ollama_result('[{"day": 1, "pillar": "Fresh"}]')
+
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=fake):
+            data = self.post('Change the pillars').json()
+
+        self.assertEqual(data['strategy']['calendar'], [{'day': 1, 'pillar': 'Fresh'}])
+
+    def test_falls_back_to_full_regeneration(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=ollama_result('{}')) as call:
+            data = self.post('Make it better').json()
+
+        self.assertIn('**Current Strategy:**', call.await_args.args[0])
+        self.assertEqual(data['metadata']['mode'], 'full')
+
+    def test_invalid_section_output_keeps_previous_value(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=ollama_result('"nope"')):
+            data = self.post('More engagement tips').json()
+
+        self.assertEqual(data['strategy']['engagement_tips'], ['old tip'])
+        self.assertIn('engagement_tips kept unchanged', data['warning'])
+
+
+RECORDED_OUTPUTS = Path(__file__).resolve().parent / 'testdata' / 'ollama_outputs'
+
+
+class JSONStreamTests(SimpleTestCase):
+    def test_strips_prose_and_fences(self):
+        value, repairs = extract_json('Sure! Here it is:\n```json\n{"a": [1, 2]}\n```\nEnjoy!')
+        self.assertEqual((value, repairs), ({'a': [1, 2]}, []))
+
+    def test_repairs_comments_and_trailing_commas(self):
+        text = '{"calendar": [\n  // Generate exactly 30 entries\n  {"day": 1,},\n], /* note */ "tips": ["a",]}'
+        value, repairs = extract_json(text)
+        self.assertEqual(value, {'calendar': [{'day': 1}], 'tips': ['a']})
+        self.assertEqual(repairs, ['comment', 'trailing_comma'])
+
+    def test_slashes_inside_strings_are_kept(self):
+        value, _ = extract_json('{"url": "https://example.com/a//b", "x": 1,}')
+        self.assertEqual(value['url'], 'https://example.com/a//b')
+
+    def test_truncated_output_drops_incomplete_member(self):
+        value, repairs = extract_json('{"pillars": ["a", "b"], "calendar": [{"day": 1}, {"day": 2, "topic": "Hal')
+        self.assertEqual(value, {'pillars': ['a', 'b'], 'calendar': [{'day': 1}, {'day': 2, 'topic': 'Hal'}]})
+        self.assertIn('truncated', repairs)
+
+        value, _ = extract_json('{"a": 1, "b": ')
+        self.assertEqual(value, {'a': 1})
+
+    def test_no_json_raises(self):
+        with self.assertRaises(ValueError):
+            extract_json('I cannot help with that.')
+
+    def test_skips_brackets_in_prose(self):
+        value, _ = extract_json('Here are [10] ideas:\n[{"a":1}]')
+        self.assertEqual(value, [{'a': 1}])
+        value, _ = extract_json('Sure (see [1]):\n{"x": 1}')
+        self.assertEqual(value, {'x': 1})
+        value, _ = extract_json('{"x": 1}\nSources: [1]')
+        self.assertEqual(value, {'x': 1})
+        value, repairs = extract_json('Here are [10] ideas:\n[{"a": 1}, {"b": 2,},]')
+        self.assertEqual((value, repairs), ([{'a': 1}, {'b': 2}], ['trailing_comma']))
+        value, repairs = extract_json('Here are [10] ideas:\n[{"a": 1}, {"b": "x')
+        self.assertEqual(value, [{'a': 1}, {'b': 'x'}])
+        self.assertIn('truncated', repairs)
+
+    def test_skips_values_of_the_wrong_shape(self):
+        value, _ = extract_json('Fields [1, 2]: {"a": 1}', dict)
+        self.assertEqual(value, {'a': 1})
+        value, _ = extract_json('Note {"n": 1} then [{"a": 1}]', list)
+        self.assertEqual(value, [{'a': 1}])
+        with self.assertRaises(ValueError):
+            extract_json('[1, 2]', dict)
+
+    def test_numbers_are_not_altered(self):
+        with self.assertRaises(ValueError):
+            extract_json('{"a": 1/2}')
+        with self.assertRaises(ValueError):
+            extract_json('[1/2]')
+
+    def test_emits_items_as_they_close(self):
+        extractor = JSONStreamExtractor()
+        text = '{"calendar": [{"day": 1}, {"day": 2}], "hashtags": {"niche": ["#a"]}}'
+        emitted = []
+        for start in range(0, len(text), 3):
+            emitted.append(extractor.feed(text[start:start + 3]))
+        items = [item for batch in emitted for item in batch]
+        self.assertEqual(items, [
+            {'container': 'calendar', 'index': 0, 'value': {'day': 1}},
+            {'container': 'calendar', 'index': 1, 'value': {'day': 2}},
+        ])
+        # Il primo giorno arriva prima della fine del testo
+        self.assertTrue(emitted.index([items[0]]) < len(emitted) - 1)
+        self.assertTrue(extractor.done)
+
+    def test_recorded_outputs_parse(self):
+        for path in sorted(RECORDED_OUTPUTS.glob('*.txt')):
+            with self.subTest(path.name):
+                value, _ = extract_json(path.read_text())
+                self.assertIsInstance(value, (dict, list))
+
+    def test_truncated_strategy_warns(self):
+        from .responses import parse_json_response
+        value, warning = parse_json_response((RECORDED_OUTPUTS / 'strategy_truncated.txt').read_text())
+        self.assertIn('calendar', value)
+        self.assertIn('truncated', warning)
+
+    async def test_stream_emits_item_events(self):
+        tokens = ['[{"title": "A"}', ', {"title"', ': "B"}]']
+        with mock.patch.object(generation, 'astream_ollama', return_value=fake_stream(tokens)):
+            events = [
+                json.loads(e) async for e in streaming.relay_generation(
+                    'ndjson', 'p', 0.7, 10, lambda text: text, cache.BYPASS
+                )
+            ]
+        items = [e['data'] for e in events if e['event'] == 'item']
+        self.assertEqual([i['value']['title'] for i in items], ['A', 'B'])
+
+
+def reel(n):
+    return {'title': f'Reel {n}', 'hook': '...', 'structure': ['a'], 'call_to_action': '...', 'viral_score': 8}
+
+
+def calendar_entry(day):
+    return {'day': day, 'post_type': 'Reel', 'pillar': 'Tips', 'topic': 't', 'hook': 'h', 'best_time': '9:00 AM'}
+
+
+VALID_STRATEGY = {
+    'content_pillars': [{'name': name, 'description': '...'} for name in ['Tips', 'Stories', 'Community']],
+    'calendar': [calendar_entry(day) for day in range(1, 31)],
+    'hashtags': {key: [f'#{key}{i}' for i in range(5)] for key in ['niche', 'trending', 'engagement']},
+    'posting_times': [{'day': 'Monday', 'times': ['9:00 AM']}],
+    'engagement_tips': ['one', 'two', 'three'],
+}
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'}, STRATEGY_CALENDAR_CHUNK_DAYS=10,
+                   OLLAMA_VALIDATION={'ENABLED': True, 'MAX_ROUNDS': 2}, GENERATION_HISTORY=NO_HISTORY)
+class ValidationTests(SimpleTestCase):
+    def test_short_calendar_is_invalid(self):
+        value = {**VALID_STRATEGY, 'calendar': VALID_STRATEGY['calendar'][:12]}
+        self.assertEqual(schemas.validate(VALID_STRATEGY, schemas.STRATEGY_SCHEMA), [])
+        self.assertEqual(schemas.validate(value, schemas.STRATEGY_SCHEMA), [
+            {'path': 'calendar', 'message': 'expected at least 30 items, got 12'}
+        ])
+
+    def test_missing_day_ranges(self):
+        self.assertEqual(
+            validation.missing_day_ranges([3, 4, 5, 9, 10, 11, 12, 13], 3),
+            [(3, 5), (9, 11), (12, 13)]
+        )
+
+    def test_schema_is_sent_as_format(self):
+        payload = ollama_client.build_payload('p', format=schemas.REELS_SCHEMA)
+        self.assertEqual(payload['format']['minItems'], 10)
+        self.assertNotEqual(
+            cache.make_cache_key(payload), cache.make_cache_key(ollama_client.build_payload('p'))
+        )
+        with override_settings(OLLAMA_STRUCTURED_OUTPUT='json'):
+            self.assertEqual(schemas.ollama_format(schemas.REELS_SCHEMA), 'json')
+        with override_settings(OLLAMA_STRUCTURED_OUTPUT='off'):
+            self.assertIsNone(schemas.ollama_format(schemas.REELS_SCHEMA))
+
+    def test_short_reel_list_asks_only_for_missing_ideas(self):
+        responses = [
+            ollama_result(json.dumps([reel(n) for n in range(4)] + [{'title': 'broken'}])),
+            ollama_result(json.dumps([reel(n) for n in range(4, 10)]), eval_count=300),
+        ]
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=responses) as call:
+            data = self.client.post('/api/generate-trending-reels/', {'niche': 'Food'},
+                                    content_type='application/json').json()
+
+        first, retry = call.await_args_list
+        self.assertEqual(first.args[3], schemas.REELS_SCHEMA)
+        self.assertIn('EXACTLY 6 NEW', retry.args[0])
+        self.assertIn('- Reel 3', retry.args[0])
+        self.assertEqual(retry.args[3]['minItems'], 6)
+        self.assertEqual([idea['title'] for idea in data['ideas']], [f'Reel {n}' for n in range(10)])
+        report = data['metadata']['validation']
+        self.assertTrue(report['valid'])
+        self.assertEqual(report['retries'], 1)
+        self.assertGreater(report['wasted_tokens'], 0)
+
+    def test_strategy_retries_missing_days_and_sections(self):
+        broken = {**VALID_STRATEGY, 'calendar': VALID_STRATEGY['calendar'][:12]}
+        del broken['hashtags']
+
+        def fake(prompt, *args):
+            if 'for days ' in prompt:
+                start, end = [int(n) for n in prompt.split('for days ')[1].split(':')[0].split(' to ')]
+                return ollama_result(json.dumps([calendar_entry(day) for day in range(start, end + 1)]))
+            if '**Section:** hashtags' in prompt:
+                return ollama_result(json.dumps(VALID_STRATEGY['hashtags']))
+            return ollama_result(json.dumps(broken))
+
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=fake) as call:
+            data = self.client.post('/api/generate-strategy/', {'niche': 'Fitness'},
+                                    content_type='application/json').json()
+
+        prompts = [c.args[0] for c in call.await_args_list]
+        self.assertEqual(len(prompts), 4)
+        self.assertTrue(any('for days 13 to 22' in p for p in prompts))
+        self.assertTrue(any('for days 23 to 30' in p for p in prompts))
+        self.assertTrue(any('Niche: Fitness' in p for p in prompts[1:]))
+        self.assertEqual([e['day'] for e in data['strategy']['calendar']], list(range(1, 31)))
+        self.assertEqual(data['strategy']['hashtags'], VALID_STRATEGY['hashtags'])
+        self.assertEqual(data['metadata']['validation']['retries'], 3)
+        self.assertTrue(data['metadata']['validation']['valid'])
+
+    def test_missing_content_fields_are_completed(self):
+        content = {
+            'caption': 'Hi',
+            'visual_suggestions': {'description': 'd', 'colors': ['red'], 'composition': 'c'},
+            'posting_recommendations': {'best_time': '9:00 AM', 'engagement_tips': ['ask']},
+        }
+        responses = [
+            ollama_result(json.dumps(content)),
+            ollama_result(json.dumps({'hashtags': ['#a', '#b', '#c', '#d', '#e']})),
+        ]
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=responses) as call:
+            data = self.client.post('/api/generate-content/', {'topic': 'Coffee'},
+                                    content_type='application/json').json()
+
+        retry = call.await_args_list[1]
+        self.assertIn('- topic: Coffee', retry.args[0])
+        self.assertEqual(retry.args[3]['required'], ['hashtags'])
+        self.assertEqual(data['content']['hashtags'], ['#a', '#b', '#c', '#d', '#e'])
+        self.assertEqual(data['metadata']['validation']['retries'], 1)
+
+    def test_failed_retries_are_reported(self):
+        responses = [ollama_result(json.dumps([reel(0)]))] + [ollama_result('not json', eval_count=50)] * 2
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=responses) as call:
+            data = self.client.post('/api/generate-trending-reels/', {'niche': 'Food'},
+                                    content_type='application/json').json()
+
+        self.assertEqual(call.await_count, 3)
+        self.assertEqual(len(data['ideas']), 1)
+        report = data['metadata']['validation']
+        self.assertFalse(report['valid'])
+        self.assertEqual(report['retries'], 2)
+        self.assertEqual(report['wasted_tokens'], 100)
+        self.assertEqual(len(report['retry_errors']), 2)
+        self.assertTrue(data['success'])
+        self.assertIn('does not match the generate_trending_reels schema after 2 retries', data['warning'])
+
+
+VALID_CONTENT = {
+    'caption': 'Hi',
+    'hashtags': ['#a', '#b', '#c', '#d', '#e'],
+    'visual_suggestions': {'description': 'd', 'colors': ['red'], 'composition': 'c'},
+    'posting_recommendations': {'best_time': '9:00 AM', 'engagement_tips': ['ask']},
+}
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'}, GENERATION_HISTORY=NO_HISTORY, BATCH_CONTENT={
+    'MAX_ITEMS': 10, 'CONCURRENCY': 2, 'PACK_SIZE': 3, 'PACK_MAX_TOPIC_CHARS': 20
+})
+class BatchContentTests(SimpleTestCase):
+    def post(self, **body):
+        return self.client.post('/api/generate-content/batch/', body, content_type='application/json')
+
+    def test_pack_briefs(self):
+        briefs = [(i, {'topic': topic}) for i, topic in enumerate(['a', 'b', 'x' * 50, 'c', 'd'])]
+        groups = batch.pack_briefs(briefs, 3, 20)
+        self.assertEqual([[i for i, _ in group] for group in groups], [[0, 1, 3], [2], [4]])
+        self.assertEqual(len(batch.pack_briefs(briefs, 1, 20)), 5)
+
+    def test_item_errors_are_isolated(self):
+        def fake(prompt, *args):
+            if 'Topic: Broken' in prompt:
+                raise ollama_client.OllamaError('down')
+            return ollama_result(json.dumps(VALID_CONTENT))
+
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=fake):
+            data = self.post(items=[{'topic': 'Coffee'}, {'post_type': 'reel'}, {'topic': 'Broken'}]).json()
+
+        self.assertEqual([r['index'] for r in data['results']], [0, 1, 2])
+        self.assertEqual(data['results'][0]['content'], VALID_CONTENT)
+        self.assertEqual(data['results'][0]['metadata']['topic'], 'Coffee')
+        self.assertEqual(data['results'][1]['error'], 'Topic is required')
+        self.assertIn('down', data['results'][2]['error'])
+        self.assertEqual(data['summary']['succeeded'], 1)
+        self.assertEqual(data['summary']['failed'], 2)
+
+    async def test_closing_the_stream_waits_for_cancelled_groups(self):
+        finished = []
+
+        async def group(items, cache_mode, model=None):
+            index = items[0][0]
+            try:
+                if index > 0:
+                    await asyncio.Event().wait()
+                return [{'index': index, 'success': True}]
+            finally:
+                finished.append(index)
+
+        with mock.patch.object(batch, '_agroup', group):
+            results = batch.abatch_content([{'topic': t} for t in 'abc'], pack=False)
+            self.assertEqual((await anext(results))['index'], 0)
+            await results.aclose()
+        self.assertEqual(sorted(finished), [0, 1, 2])
+
+    def test_concurrency_is_limited(self):
+        running = []
+        peak = []
+
+        async def fake(prompt, *args):
+            running.append(prompt)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(prompt)
+            return ollama_result(json.dumps(VALID_CONTENT))
+
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=fake):
+            data = self.post(items=[{'topic': f'Topic {n}'} for n in range(6)]).json()
+
+        self.assertEqual(data['summary']['succeeded'], 6)
+        self.assertLessEqual(max(peak), 2)
+
+    def test_packed_briefs_share_a_prompt(self):
+        def fake(prompt, *args):
+            if '**Content Briefs:**' in prompt:
+                # Il modello ha prodotto solo 2 dei 3 post
+                return ollama_result(json.dumps([VALID_CONTENT, VALID_CONTENT]))
+            self.assertIn('Topic: Tea', prompt)
+            return ollama_result(json.dumps(VALID_CONTENT))
+
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=fake) as call:
+            data = self.post(items=[{'topic': 'Coffee'}, {'topic': 'Cake'}, {'topic': 'Tea'}], pack=True).json()
+
+        self.assertEqual(call.await_count, 2)
+        self.assertEqual(call.await_args_list[0].args[3]['minItems'], 3)
+        self.assertEqual(data['summary']['succeeded'], 3)
+        self.assertTrue(all(r['metadata']['validation']['valid'] for r in data['results']))
+
+    async def test_stream_emits_items_then_summary(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=ollama_result(json.dumps(VALID_CONTENT))):
+            response = await AsyncClient().post(
+                '/api/generate-content/batch/',
+                {'items': [{'topic': 'Coffee'}, {'topic': 'Tea'}], 'stream': 'ndjson'},
+                content_type='application/json'
+            )
+            events = [json.loads(line) async for line in response.streaming_content]
+
+        self.assertEqual([e['event'] for e in events], ['item', 'item', 'done'])
+        self.assertEqual(sorted(e['data']['index'] for e in events[:2]), [0, 1])
+        self.assertEqual(events[-1]['data']['summary']['total'], 2)
+
+    def test_invalid_items(self):
+        self.assertEqual(self.post(items=[]).status_code, 400)
+        self.assertEqual(self.post(items=[{'topic': 't'}] * 11).status_code, 400)
+
+
+# Porta locale su cui non ascolta nessuno: connessione rifiutata
+DEAD_NODE = 'http://127.0.0.1:9'
+
+
+def routing_settings(urls, **config):
+    return override_settings(
+        OLLAMA_BASE_URLS=urls,
+        OLLAMA_BACKEND_MODELS={},
+        OLLAMA_ROUTING={
+            'STRATEGY': 'least_outstanding', 'FAILURE_THRESHOLD': 2, 'RECOVERY_TIME': 30,
+            'HEALTH_CHECK_INTERVAL': 0, 'LATENCY_SMOOTHING': 0.5, **config
+        },
+    )
+
+
+class RouterTests(SimpleTestCase):
+    def test_least_outstanding(self):
+        router = routing.Router(['http://a', 'http://b'])
+        first = router.pick('llama3.2')
+        second = router.pick('llama3.2')
+        self.assertNotEqual(first, second)
+        router.release(first)
+        self.assertIs(router.pick('llama3.2'), first)
+
+    def test_latency_weighted(self):
+        router = routing.Router(['http://a', 'http://b'], strategy=routing.LATENCY)
+        slow, fast = router.backends
+        router.record_success(slow, 1.8)
+        router.record_success(fast, 0.5)
+        picked = [router.pick('llama3.2') for _ in range(3)]
+        # Il nodo veloce regge 3 richieste in corso prima di pesare quanto quello lento
+        self.assertEqual(picked, [fast, fast, fast])
+        self.assertIs(router.pick('llama3.2'), slow)
+
+    def test_circuit_breaker(self):
+        router = routing.Router(['http://a', 'http://b'], failure_threshold=2, recovery_time=30)
+        bad, good = router.backends
+        with self.assertLogs('api.routing', 'WARNING'):
+            router.record_failure(bad)
+            router.record_failure(bad)
+        self.assertEqual(bad.state, routing.OPEN)
+        self.assertEqual({router.pick('llama3.2').url for _ in range(3)}, {good.url})
+
+        # Dopo RECOVERY_TIME una sola richiesta di prova
+        bad.opened_at -= 31
+        self.assertEqual(sum(router.pick('llama3.2') is bad for _ in range(4)), 1)
+        router.record_success(bad, 0.1)
+        self.assertEqual(bad.state, routing.CLOSED)
+
+    def test_all_ejected(self):
+        router = routing.Router(['http://a'], failure_threshold=1)
+        with self.assertLogs('api.routing', 'WARNING'):
+            router.record_failure(router.backends[0])
+        with self.assertRaisesMessage(routing.NoBackendAvailable, 'No healthy'):
+            router.pick('llama3.2')
+
+    def test_model_pinning(self):
+        router = routing.Router(
+            ['http://big', 'http://small', 'http://unknown'],
+            models={'http://big': ['llama3.2:latest'], 'http://small': ['llama3.2:1b']}
+        )
+        big, small, unknown = router.backends
+        for _ in range(4):
+            self.assertIn(router.pick('llama3.2:1b'), (small, unknown))
+            self.assertIn(router.pick('llama3.2'), (big, unknown))
+        unknown.models = {'llama3.2'}
+        with self.assertRaisesMessage(routing.NoBackendAvailable, 'has model mistral'):
+            router.pick('mistral')
+
+
+class RoutingStubServerTests(SimpleTestCase):
+    def test_fails_over_to_live_node(self):
+        with FakeOllama(response='{"ok": true}') as node, routing_settings([DEAD_NODE, node.url]), \
+                self.assertLogs('api.routing', 'WARNING'):
+            for _ in range(3):
+                result = asyncio.run(ollama_client.acall_ollama_raw('p', max_tokens=10))
+                self.assertEqual(result['response'], '{"ok": true}')
+            dead, live = routing.get_router().backends
+
+        self.assertEqual(len(node.requests), 3)
+        self.assertEqual(dead.state, routing.OPEN)
+        self.assertEqual(live.state, routing.CLOSED)
+        self.assertIsNotNone(live.latency)
+
+    def test_server_errors_eject_node(self):
+        with FakeOllama(status=500) as broken, FakeOllama() as healthy, \
+                routing_settings([broken.url, healthy.url]), self.assertLogs('api.routing', 'WARNING'):
+            outcomes = []
+            for _ in range(4):
+                try:
+                    asyncio.run(ollama_client.acall_ollama_raw('p'))
+                    outcomes.append('ok')
+                except ollama_client.BackendError:
+                    outcomes.append('error')
+            router = routing.get_router()
+
+        # Due 500 (FAILURE_THRESHOLD) poi il nodo rotto viene escluso
+        self.assertEqual(outcomes.count('error'), 2)
+        self.assertEqual(router.backends[0].state, routing.OPEN)
+        self.assertEqual(outcomes[-1], 'ok')
+
+    def test_streaming_through_pool(self):
+        async def collect():
+            return [chunk async for chunk in ollama_client.astream_ollama('p')]
+
+        with FakeOllama(response='{"a": 1}') as node, routing_settings([node.url]):
+            chunks = asyncio.run(collect())
+
+        self.assertEqual(''.join(c['response'] for c in chunks), '{"a": 1}')
+        self.assertTrue(chunks[-1]['done'])
+
+    def test_active_health_check_learns_models(self):
+        with FakeOllama(models=['llama3.2:1b']) as small, routing_settings([small.url, DEAD_NODE]), \
+                override_settings(OLLAMA_MODEL='llama3.2:1b'), self.assertLogs('api.routing', 'WARNING'):
+            router = routing.get_router()
+            self.assertEqual(router.check_all(), {small.url: True, DEAD_NODE: False})
+            self.assertEqual(router.backends[0].models, {'llama3.2:1b'})
+            result = asyncio.run(ollama_client.acall_ollama_raw('p'))
+            self.assertEqual(result['response'], '{"message": "Hello, I am working!"}')
+            with override_settings(OLLAMA_MODEL='llama3.2'):
+                router = routing.get_router()
+                router.check_all()
+                with self.assertRaises(routing.NoBackendAvailable):
+                    router.pick('llama3.2')
+
+
+MODEL_TIERS = {'large': 'llama3.2', 'fast': 'llama3.2:1b'}
+MODEL_POLICY = {
+    'DEFAULT_TIER': 'large',
+    'ENDPOINT_TIERS': {'test_ollama': 'fast', 'optimize_idea': 'fast'},
+    'DEGRADABLE': ['generate_strategy', 'regenerate_strategy'],
+    'MAX_QUEUE_DEPTH': 2,
+    'MAX_P95_SECONDS': 10,
+    'WINDOW_SECONDS': 60,
+}
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'}, OLLAMA_VALIDATION=NO_VALIDATION,
+                   OLLAMA_MODELS=MODEL_TIERS, OLLAMA_MODEL_POLICY=MODEL_POLICY, GENERATION_HISTORY=NO_HISTORY)
+class ModelTieringTests(SimpleTestCase):
+    def setUp(self):
+        # Latenze registrate dagli altri test
+        tiering._reset_tracker('OLLAMA_MODEL_POLICY')
+
+    def test_endpoint_tiers(self):
+        self.assertEqual(tiering.choose_model('optimize_idea').model, 'llama3.2:1b')
+        choice = tiering.choose_model('generate_strategy')
+        self.assertEqual((choice.model, choice.reason), ('llama3.2', tiering.ENDPOINT))
+
+    def test_request_overrides_endpoint(self):
+        self.assertEqual(tiering.choose_model('optimize_idea', 'large').model, 'llama3.2')
+        choice = tiering.choose_model('generate_strategy', 'llama3.2:1b')
+        self.assertEqual((choice.tier, choice.reason), ('fast', tiering.REQUEST))
+        with self.assertRaises(tiering.InvalidModel):
+            tiering.choose_model('generate_strategy', 'mistral')
+
+    @override_settings(OLLAMA_MODEL='llama3.2:1b')
+    def test_tier_without_model_on_any_node_falls_back(self):
+        with routing_settings(['http://a']):
+            # /api/tags non ancora letto: si prova il modello del tier
+            self.assertEqual(tiering.choose_model('generate_strategy').model, 'llama3.2')
+            with mock.patch.object(routing.get_router().backends[0], 'models', {'llama3.2:1b'}):
+                choice = tiering.choose_model('generate_strategy')
+                self.assertEqual((choice.model, choice.reason), ('llama3.2:1b', tiering.UNAVAILABLE))
+                # Chi lo chiede esplicitamente riceve l'errore del router
+                self.assertEqual(tiering.choose_model('generate_strategy', 'large').model, 'llama3.2')
+
+    def test_degrades_on_p95_latency(self):
+        for seconds in [1] * 18 + [30, 30]:
+            tiering.record_latency('llama3.2', seconds)
+        choice = tiering.choose_model('generate_strategy')
+        self.assertEqual((choice.model, choice.reason), ('llama3.2:1b', tiering.P95_LATENCY))
+        # Solo le strategie vengono degradate
+        self.assertEqual(tiering.choose_model('generate_content').model, 'llama3.2')
+
+    def test_degrades_on_queue_depth(self):
+        with mock.patch.object(scheduler.Scheduler, 'queued', new_callable=mock.PropertyMock, return_value=2):
+            choice = tiering.choose_model('regenerate_strategy')
+        self.assertEqual(choice.reason, tiering.QUEUE_DEPTH)
+
+    def test_old_samples_leave_the_window(self):
+        tracker = tiering.LatencyTracker(window_seconds=60)
+        tracker.record('m', 100)
+        self.assertEqual(tracker.percentile('m'), 100)
+        with mock.patch.object(tiering.time, 'monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(tracker.percentile('m'))
+
+    def test_model_is_sent_and_reported(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=ollama_result('{"a": 1}')) as call:
+            data = self.client.post('/api/optimize-idea/', {'idea_content': 'x'},
+                                    content_type='application/json').json()
+        self.assertEqual(call.await_args.args[4], 'llama3.2:1b')
+        self.assertEqual(data['metadata'], {'model': 'llama3.2:1b', 'model_reason': 'endpoint'})
+
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=ollama_result('{}')) as call:
+            data = self.client.post('/api/generate-strategy/', {'niche': 'Food', 'model': 'fast'},
+                                    content_type='application/json').json()
+        self.assertEqual(call.await_args.args[4], 'llama3.2:1b')
+        self.assertEqual(data['metadata']['model_reason'], 'request')
+
+    def test_unknown_model_is_rejected(self):
+        response = self.client.post('/api/generate-content/', {'topic': 't', 'model': 'gpt-4'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('llama3.2:1b', response.json()['error'])
+
+
+class WarmupTests(SimpleTestCase):
+    def test_keep_alive_per_model(self):
+        with override_settings(OLLAMA_KEEP_ALIVE={'default': '30m', 'llama3.2:1b': '-1'}):
+            self.assertEqual(ollama_client.build_payload('x', model='llama3.2')['keep_alive'], '30m')
+            self.assertEqual(ollama_client.build_payload('x', model='llama3.2:1b')['keep_alive'], -1)
+
+    def test_warm_all_loads_models_where_available(self):
+        warm = {'ON_STARTUP': False, 'MODELS': ['llama3.2', 'llama3.2:1b'], 'KEEP_WARM_INTERVAL': 0}
+        with FakeOllama(models=['llama3.2', 'llama3.2:1b']) as big, FakeOllama(models=['llama3.2:1b']) as small, \
+                routing_settings([big.url, small.url]), override_settings(OLLAMA_WARMUP=warm):
+            results = warmup.warm_all()
+            self.assertEqual(len(results), 3)
+            self.assertTrue(all(result['ok'] for result in results))
+            self.assertEqual(big.loaded, {'llama3.2', 'llama3.2:1b'})
+            self.assertEqual(small.loaded, {'llama3.2:1b'})
+            self.assertEqual(small.requests[0]['prompt'], '')
+            self.assertIn('keep_alive', small.requests[0])
+
+    def test_unreachable_node_is_reported(self):
+        with routing_settings([DEAD_NODE]):
+            results = warmup.warm_all(['llama3.2'])
+        self.assertEqual(results, [
+            {'backend': DEAD_NODE, 'model': 'llama3.2', 'ok': False, 'error': 'unreachable'}
+        ])
+
+    def test_health_reports_readiness(self):
+        warm = {'ON_STARTUP': False, 'MODELS': ['llama3.2'], 'KEEP_WARM_INTERVAL': 0}
+        with FakeOllama() as node, routing_settings([node.url]), override_settings(OLLAMA_WARMUP=warm):
+            response = self.client.get('/api/health/')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()['status'], warmup.LOADING)
+
+            warmup.warm_all()
+            response = self.client.get('/api/health/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['status'], warmup.READY)
+            self.assertEqual(response.json()['models_loaded'], {'llama3.2': [node.url]})
+
+        with routing_settings([DEAD_NODE]):
+            self.assertEqual(self.client.get('/api/health/').json()['status'], warmup.UNAVAILABLE)
+
+    def test_startup_only_for_server_processes(self):
+        with mock.patch.object(warmup.sys, 'argv', ['manage.py', 'migrate']):
+            self.assertFalse(warmup.is_server_process())
+        with mock.patch.object(warmup.sys, 'argv', ['manage.py', 'runserver', '--noreload']):
+            self.assertTrue(warmup.is_server_process())
+        for argv in [['/usr/local/bin/gunicorn'], ['/usr/lib/python3/site-packages/gunicorn/__main__.py']]:
+            with mock.patch.object(warmup.sys, 'argv', argv):
+                self.assertTrue(warmup.is_server_process())
+        for argv in [['/usr/local/bin/pytest'], ['/usr/local/bin/celery', 'worker'], ['script.py'], ['']]:
+            with mock.patch.object(warmup.sys, 'argv', argv):
+                self.assertFalse(warmup.is_server_process())
+
+
+class PromptLayoutTests(SimpleTestCase):
+    def test_client_fields_come_after_the_static_prefix(self):
+        cases = [
+            (prompts.STRATEGY_INSTRUCTIONS, prompts.get_strategy_prompt('Fitness', 'Moms', 'Sales', 'Daily')),
+            (prompts.CONTENT_INSTRUCTIONS, prompts.get_content_prompt('Fitness', 'reel', 'fun', 'Moms')),
+            (prompts.REELS_INSTRUCTIONS, prompts.get_trending_reels_prompt('Fitness', 'Moms')),
+            (prompts.OPTIMIZE_IDEA_INSTRUCTIONS, prompts.get_optimize_idea_prompt('Fitness', 'reach')),
+            (prompts.OUTLINE_INSTRUCTIONS, prompts.get_strategy_outline_prompt('Fitness', 'Moms', 'Sales', 'Daily')),
+            (prompts.CALENDAR_CHUNK_INSTRUCTIONS,
+             prompts.get_calendar_chunk_prompt('Fitness', 'Moms', 'Sales', [], 1, 10)),
+            (prompts.SECTION_INSTRUCTIONS, prompts.get_regenerate_section_prompt('hashtags', '{}', 'Fitness')),
+            (prompts.REGENERATE_STRATEGY_INSTRUCTIONS, prompts.get_regenerate_strategy_prompt('{}', 'Fitness')),
+        ]
+        for instructions, prompt in cases:
+            self.assertTrue(prompt.startswith(instructions))
+            self.assertNotIn('Fitness', instructions)
+            self.assertIn('Fitness', prompt[len(instructions):])
+
+    def test_system_prefix_is_sent_and_part_of_the_cache_key(self):
+        payload = ollama_client.build_payload('p')
+        self.assertEqual(payload['system'], prompts.SYSTEM_PROMPT)
+        self.assertNotIn('context', payload)
+        self.assertNotEqual(
+            cache.make_cache_key(payload),
+            cache.make_cache_key(ollama_client.build_payload('p', context=[1, 2]))
+        )
+
+    def test_bench_shows_prefix_reuse(self):
+        with FakeOllama() as node, routing_settings([node.url]):
+            out = io.StringIO()
+            call_command('bench_prompt_cache', runs=3, stdout=out)
+        rows = {line.split()[0]: line.split() for line in out.getvalue().splitlines()[2:4]}
+        # Con il prefisso statico si rivaluta solo la coda variabile del prompt
+        self.assertLess(int(rows['prefix'][3]) * 5, int(rows['legacy'][3]))
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'}, OLLAMA_VALIDATION=NO_VALIDATION, GENERATION_HISTORY=NO_HISTORY)
+class SessionTests(SimpleTestCase):
+    def generate(self, context):
+        result = {**ollama_result('{"content_pillars": []}'), 'context': context}
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=result):
+            return self.client.post('/api/generate-strategy/', {'niche': 'Fitness', 'mode': 'single'},
+                                    content_type='application/json').json()
+
+    def regenerate(self, body):
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=ollama_result('{}')) as call:
+            data = self.client.post('/api/regenerate-strategy/', {
+                'previous_strategy': '{"old": true}', 'feedback': 'More fun', 'mode': 'full', **body
+            }, content_type='application/json').json()
+        return data, call.await_args.args
+
+    def test_regenerate_continues_the_session(self):
+        session = self.generate([1, 2, 3])['metadata']['session']
+        data, (prompt, *_, model, context) = self.regenerate({'session': session, 'model': 'fast'})
+
+        self.assertEqual(context, [1, 2, 3])
+        self.assertNotIn('"old"', prompt)
+        self.assertIn('the strategy you generated above', prompt)
+        # Il context vale solo per il modello che l'ha prodotto
+        self.assertEqual(model, settings.OLLAMA_MODELS['large'])
+        self.assertEqual(data['metadata']['model_reason'], tiering.SESSION)
+
+    def test_unknown_session_sends_the_previous_strategy(self):
+        data, (prompt, *_, context) = self.regenerate({'session': 'missing'})
+        self.assertIsNone(context)
+        self.assertIn('{"old":true}', prompt)
+
+    def test_only_configured_endpoints_get_a_session(self):
+        self.assertNotIn('session', self.generate(None)['metadata'])
+        result = {**ollama_result('{}'), 'context': [1]}
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=result):
+            data = self.client.post('/api/optimize-idea/', {'idea_content': 'x'},
+                                    content_type='application/json').json()
+        self.assertNotIn('session', data['metadata'])
+        self.assertIsNone(sessions.load_session(None))
+
+
+def timed_result(text):
+    """Risposta di /api/generate con i campi di timing di Ollama"""
+    return {
+        **ollama_result(text, eval_count=40, eval_duration=2 * 10**9),
+        'total_duration': 3 * 10**9, 'load_duration': 10**8,
+        'prompt_eval_count': 120, 'prompt_eval_duration': 5 * 10**8,
+    }
+
+
+@override_settings(OLLAMA_CACHE=TEST_CACHE, OLLAMA_VALIDATION=NO_VALIDATION, STRATEGY_CALENDAR_CHUNK_DAYS=10,
+                   GENERATION_HISTORY=NO_HISTORY)
+class MetricsTests(FreshCacheMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.REGISTRY.reset()
+
+    def post(self, url, body):
+        return self.client.post(url, body, content_type='application/json').json()
+
+    def test_response_has_timings_and_metrics_are_exported(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=timed_result('{"caption": "hi"}')):
+            data = self.post('/api/generate-content/', {'topic': 'Yoga'})
+
+        timings = data['timings']
+        self.assertEqual((timings['ollama'], timings['load'], timings['prompt_eval']), (3.0, 0.1, 0.5))
+        self.assertEqual((timings['prompt_tokens'], timings['generated_tokens']), (120, 40))
+        self.assertEqual(timings['tokens_per_second'], 20.0)
+        self.assertEqual(timings['generations'], 1)
+
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        labels = f'endpoint="generate_content",model="{settings.OLLAMA_MODELS["large"]}"'
+        self.assertIn(f'dotty_ollama_eval_seconds_count{{{labels}}} 1', body)
+        self.assertIn(f'dotty_ollama_tokens_per_second_bucket{{{labels},le="20"}} 1', body)
+        self.assertIn('dotty_json_parse_total{endpoint="generate_content",outcome="ok"} 1', body)
+        self.assertIn('# TYPE dotty_queue_wait_seconds histogram', body)
+
+    def test_cache_hits_and_parse_failures_are_counted(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=timed_result('not json')):
+            self.post('/api/optimize-idea/', {'idea_content': 'x'})
+            data = self.post('/api/optimize-idea/', {'idea_content': 'x'})
+
+        self.assertEqual((data['timings']['generations'], data['timings']['cached']), (0, 1))
+        self.assertEqual(metrics.PARSES.value('optimize_idea', metrics.PARSE_FAILED), 2)
+        self.assertEqual(metrics.GENERATIONS.value('optimize_idea', settings.OLLAMA_MODELS['fast'], 'hit'), 1)
+
+    def test_pipeline_timings_sum_all_calls(self):
+        def fake(prompt, *args):
+            return {**fake_pipeline_ollama(prompt), 'prompt_eval_count': 100}
+
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=fake):
+            data = self.post('/api/generate-strategy/', {'niche': 'Fitness', 'mode': 'pipelined'})
+
+        self.assertEqual(data['timings']['generations'], 4)
+        self.assertEqual(data['timings']['prompt_tokens'], 400)
+        self.assertEqual(metrics.REQUEST_SECONDS.count('generate_strategy'), 1)
+
+
+@override_settings(GENERATION_HISTORY=NO_HISTORY)
+class LoadBenchmarkTests(SimpleTestCase):
+    def test_replay_picks_recording_by_prompt_template(self):
+        replay = Replay()
+        content = replay({'prompt': prompts.get_content_prompt('Yoga', 'post', 'fun', 'Moms')})
+        self.assertIn('"caption"', content)
+        self.assertIn('optimized_content', replay({'prompt': prompts.get_optimize_idea_prompt('x', 'reach')}))
+        self.assertEqual(replay({'prompt': 'Hi'}), replay.default)
+
+    def test_report_percentiles_and_error_rate(self):
+        samples = [('generate_content', 200, n / 1000) for n in range(1, 101)]
+        samples += [('optimize_idea', 503, 0.5), ('optimize_idea', 200, 0.1)]
+        report = bench_load.summarize(samples, elapsed=2.0)
+
+        content = report['endpoints']['generate_content']
+        self.assertEqual((content['p50_ms'], content['p95_ms'], content['p99_ms']), (50, 95, 99))
+        self.assertEqual(report['endpoints']['optimize_idea']['error_rate'], 0.5)
+        self.assertEqual(report['endpoints']['optimize_idea']['statuses'], {'503': 1, '200': 1})
+        self.assertEqual((report['total']['errors'], report['total']['throughput_rps']), (1, 51.0))
+        self.assertIsNone(bench_load.percentile([], 50))
+
+    def test_all_endpoints_run_against_the_fake_server(self):
+        with tempfile.NamedTemporaryFile(suffix='.json') as out:
+            call_command('bench_load', requests=7, concurrency=2, json=out.name, stdout=io.StringIO())
+            report = json.load(open(out.name))
+        self.assertEqual(set(report['endpoints']), set(bench_load.SCENARIOS))
+        self.assertEqual(report['total']['requests'], 7)
+        self.assertEqual(report['total']['errors'], 0)
+
+    def test_open_loop_rate(self):
+        out = io.StringIO()
+        call_command('bench_load', endpoints='generate_content', requests=5, rps=50, stdout=out)
+        self.assertIn('generate_content', out.getvalue())
+        self.assertIn('error rate 0.0%', out.getvalue())
+
+
+class GunicornConfigTests(SimpleTestCase):
+    CONFIG = str(Path(settings.BASE_DIR) / 'gunicorn.conf.py')
+
+    def load(self, **env):
+        with mock.patch.dict('os.environ', env, clear=True):
+            return runpy.run_path(self.CONFIG)
+
+    def test_defaults_to_one_worker_and_timeouts_to_generation(self):
+        with mock.patch('multiprocessing.cpu_count', return_value=6):
+            config = self.load(OLLAMA_TIMEOUT='300')
+        # Lo scheduler e' per processo: un worker solo tiene il limite di concorrenza
+        self.assertEqual(config['workers'], 1)
+        self.assertEqual(config['worker_class'], 'uvicorn_worker.UvicornWorker')
+        self.assertGreater(config['timeout'], 300)
+        self.assertGreater(config['graceful_timeout'], 300)
+
+    def test_environment_overrides(self):
+        config = self.load(GUNICORN_GRACEFUL_TIMEOUT='45', GUNICORN_BIND='127.0.0.1:9000')
+        self.assertEqual(config['graceful_timeout'], 45)
+        self.assertEqual(config['bind'], '127.0.0.1:9000')
+        with mock.patch('multiprocessing.cpu_count', return_value=6):
+            self.assertEqual(self.load(GUNICORN_WORKERS='auto')['workers'], 6)
+        self.assertEqual(self.load(GUNICORN_WORKERS='3')['workers'], 3)
+
+    def test_more_workers_are_logged(self):
+        config = self.load()
+        server = mock.Mock(cfg=mock.Mock(workers=1))
+        config['on_starting'](server)
+        server.log.warning.assert_not_called()
+        server = mock.Mock(cfg=mock.Mock(workers=4))
+        config['on_starting'](server)
+        self.assertIn('per process', server.log.warning.call_args.args[0])
+
+
+class ApiProfileTests(SimpleTestCase):
+    def test_api_profile_drops_unused_apps_and_middleware(self):
+        from dotty_backend import settings_api
+
+        self.assertNotIn('django.contrib.admin', settings_api.INSTALLED_APPS)
+        self.assertNotIn('rest_framework', settings_api.INSTALLED_APPS)
+        self.assertNotIn('django.middleware.csrf.CsrfViewMiddleware', settings_api.MIDDLEWARE)
+        self.assertNotIn('django.contrib.sessions.middleware.SessionMiddleware', settings_api.MIDDLEWARE)
+        self.assertIn('corsheaders.middleware.CorsMiddleware', settings_api.MIDDLEWARE)
+
+    @override_settings(ROOT_URLCONF='dotty_backend.urls_api')
+    def test_api_urls_without_admin(self):
+        self.assertEqual(self.client.get('/admin/').status_code, 404)
+        response = self.client.post('/api/regenerate-strategy/', '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bench_stack_measures_each_profile(self):
+        result = bench_stack.measure('dotty_backend.settings_api', requests=5)
+        self.assertEqual(result['status'], 400)
+        self.assertEqual(result['middleware'], 3)
+        self.assertGreater(result['setup_ms'], 0)
+
+
+SEMANTIC = {
+    'ENABLED': True, 'MODEL': 'embed-test', 'THRESHOLD': 0.85, 'BACKEND': 'numpy',
+    'ENDPOINTS': ['generate_trending_reels'], 'TTL': 3600, 'MAX_ENTRIES': 10, 'RELOAD_INTERVAL': 60,
+}
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'}, OLLAMA_VALIDATION=NO_VALIDATION, OLLAMA_SEMANTIC_CACHE=SEMANTIC)
+class SemanticCacheTests(TestCase):
+    def setUp(self):
+        semantic_cache._reset_index('OLLAMA_SEMANTIC_CACHE')
+        metrics.REGISTRY.reset()
+
+    def reels(self, node, niche, audience='Women', **body):
+        with routing_settings([node.url]):
+            response = self.client.post('/api/generate-trending-reels/', {
+                'niche': niche, 'target_audience': audience, **body
+            }, content_type='application/json')
+        return response, response.json()
+
+    def fake(self, embed_models=('embed-test',)):
+        return FakeOllama(models=[*settings.OLLAMA_MODELS.values(), *embed_models], response='{"ideas": [1]}')
+
+    def test_normalized_request_text(self):
+        self.assertEqual(semantic_cache.normalize('  Fitness & Wellness!! '), 'fitness and wellness')
+        self.assertEqual(
+            semantic_cache.request_text({'niche': 'Yoga', 'goal': 'Reach'}), 'goal: reach\nniche: yoga'
+        )
+
+    def test_near_duplicate_request_reuses_output(self):
+        with self.fake() as node:
+            first, _ = self.reels(node, 'Fitness and Wellness')
+            second, data = self.reels(node, 'fitness & wellness for women')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'SEMANTIC')
+        self.assertEqual(data['ideas'], {'ideas': [1]})
+        self.assertEqual(data['metadata']['niche'], 'fitness & wellness for women')
+        match = data['metadata']['semantic_cache']
+        self.assertGreaterEqual(match['similarity'], 0.85)
+        self.assertEqual(match['matched'], 'niche: fitness and wellness\ntarget_audience: women')
+        self.assertEqual(len(node.requests), 1)
+        self.assertEqual(models.SemanticCacheEntry.objects.get().hits, 1)
+        self.assertEqual(metrics.SEMANTIC_LOOKUPS.value('generate_trending_reels', 'hit'), 1)
+        self.assertEqual(metrics.SEMANTIC_LOOKUPS.value('generate_trending_reels', 'miss'), 1)
+
+    def test_different_request_generates(self):
+        with self.fake() as node:
+            self.reels(node, 'Fitness and Wellness')
+            response, _ = self.reels(node, 'Vegan street food', audience='Students')
+            bypass, _ = self.reels(node, 'Fitness and Wellness', cache='bypass')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(bypass['X-Cache'], 'BYPASS')
+        self.assertEqual(len(node.requests), 3)
+        self.assertEqual(models.SemanticCacheEntry.objects.count(), 2)
+
+    def test_numpy_index_reloads_entries_of_other_processes(self):
+        index = semantic_cache.NumpyIndex(10, reload_interval=60)
+        key = ('generate_trending_reels', 'm', 'embed-test')
+        vector = semantic_cache.unit_vector([1.0] * models.EMBEDDING_DIMENSIONS)
+        self.assertIsNone(index.search(key, vector))
+
+        # Scritta da un altro processo: questo indice non la vede finche' non ricarica
+        entry = models.SemanticCacheEntry.objects.create(
+            endpoint=key[0], model=key[1], embedding_model=key[2], text='t', embedding=vector, output={}
+        )
+        self.assertIsNone(index.search(key, vector))
+        later = time.monotonic() + 61
+        with mock.patch.object(semantic_cache.time, 'monotonic', return_value=later):
+            entry_id, similarity = index.search(key, vector)
+        self.assertEqual(entry_id, entry.pk)
+        self.assertAlmostEqual(similarity, 1.0, places=5)
+
+    def test_embeddings_of_another_size_skip_the_cache(self):
+        with self.fake() as node, self.assertLogs('api.semantic_cache', 'WARNING'), \
+                mock.patch.object(semantic_cache, 'aembed', return_value=[1.0] * 64):
+            response, data = self.reels(node, 'Fitness')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertNotIn('semantic_cache', data['metadata'])
+        self.assertFalse(models.SemanticCacheEntry.objects.exists())
+
+    def test_missing_embedding_model_falls_back_to_generation(self):
+        with self.fake(embed_models=()) as node, self.assertLogs('api.semantic_cache', 'WARNING'):
+            response, data = self.reels(node, 'Fitness')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('semantic_cache', data['metadata'])
+        self.assertFalse(models.SemanticCacheEntry.objects.exists())
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'}, OLLAMA_VALIDATION=NO_VALIDATION,
+                   GENERATION_HISTORY={'ENABLED': True, 'PAGE_SIZE': 2, 'MAX_PAGE_SIZE': 3})
+class HistoryTests(TestCase):
+    def store(self, count, **fields):
+        return [
+            models.ReelIdeas.objects.create(
+                endpoint='generate_trending_reels', result=[i], **{'niche': f'Niche {i}', **fields}
+            )
+            for i in range(count)
+        ]
+
+    def test_generation_is_stored_and_readable(self):
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=ollama_result('{"caption": "Hi"}')):
+            data = self.client.post('/api/generate-content/', {'topic': 'Yoga', 'tone': 'calm'},
+                                    content_type='application/json').json()
+        stored = data['metadata']['history']
+        self.assertEqual(stored['kind'], 'content')
+
+        item = self.client.get(stored['url']).json()['item']
+        self.assertEqual((item['topic'], item['tone']), ('Yoga', 'calm'))
+        self.assertEqual(item['result'], {'caption': 'Hi'})
+        self.assertIn('total', item['timings'])
+        self.assertEqual(self.client.get(stored['url'] + '?fields=id,topic').json()['item'],
+                         {'id': stored['id'], 'topic': 'Yoga'})
+        self.assertEqual(self.client.get('/api/history/content/999/').status_code, 404)
+
+    def test_failed_write_still_returns_the_generation(self):
+        locked = OperationalError('database is locked')
+
+        async def collect(stream):
+            return [event async for event in stream]
+
+        def build(text):
+            return {'success': True, 'content': json.loads(text), 'metadata': {'topic': 'Yoga'}}
+
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=ollama_result('{"caption": "Hi"}')), \
+                mock.patch.object(generation, 'astream_ollama', return_value=fake_stream(['{"caption": "Hi"}'])), \
+                mock.patch.object(models.ContentPiece.objects, 'create', side_effect=locked), \
+                self.assertLogs('api.history', 'ERROR'):
+            response = self.client.post('/api/generate-content/', {'topic': 'Yoga'}, content_type='application/json')
+            events = async_to_sync(collect)(
+                streaming.relay_generation('ndjson', 'p', 0.7, 10, build, endpoint='generate_content')
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['content'], {'caption': 'Hi'})
+        self.assertNotIn('history', response.json()['metadata'])
+        done = json.loads(events[-1])
+        self.assertEqual((done['event'], done['data']['content']), ('done', {'caption': 'Hi'}))
+
+    def test_batch_items_are_stored_as_content(self):
+        def fake(prompt, *args):
+            if 'Topic: Broken' in prompt:
+                raise ollama_client.OllamaError('down')
+            return ollama_result(json.dumps(VALID_CONTENT))
+
+        with mock.patch.object(generation, 'acall_ollama_raw', side_effect=fake):
+            data = self.client.post('/api/generate-content/batch/', {
+                'items': [{'topic': 'Coffee', 'tone': 'fun'}, {'topic': 'Broken'}, {'topic': 'Tea'}], 'model': 'fast'
+            }, content_type='application/json').json()
+
+        stored = data['results'][0]['metadata']['history']
+        self.assertEqual(stored['kind'], 'content')
+        self.assertNotIn('metadata', data['results'][1])
+        rows = models.ContentPiece.objects.order_by('topic')
+        self.assertEqual([(row.topic, row.endpoint) for row in rows],
+                         [('Coffee', 'generate_content_batch'), ('Tea', 'generate_content_batch')])
+        self.assertEqual(rows[0].tone, 'fun')
+        self.assertEqual(rows[0].result, VALID_CONTENT)
+        self.assertEqual(rows[0].model, settings.OLLAMA_MODELS['fast'])
+
+    def test_keyset_pages_cover_every_row_once(self):
+        entries = self.store(5)
+        # Stesso created_at: l'ordine lo decide l'id
+        models.ReelIdeas.objects.filter(pk__in=[e.pk for e in entries[1:4]]).update(
+            created_at=entries[2].created_at
+        )
+        seen, url = [], '/api/history/reels/'
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['results']), 2)
+            seen += [row['id'] for row in data['results']]
+            url = data['next']
+        self.assertEqual(sorted(seen), sorted(e.pk for e in entries))
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertNotIn('result', data['results'][0])
+
+    def test_filters_and_projection(self):
+        self.store(3, target_audience='Moms')
+        self.store(2, target_audience='Students')
+        data = self.client.get('/api/history/reels/?target_audience=Moms&limit=10&fields=niche,result').json()
+        self.assertEqual(len(data['results']), 3)
+        self.assertIsNone(data['next'])
+        self.assertEqual(set(data['results'][0]), {'niche', 'result'})
+
+        for query in ('fields=password', 'cursor=bad', 'limit=x', 'target_audience=x&fields=topic'):
+            self.assertEqual(self.client.get(f'/api/history/reels/?{query}').status_code, 400, query)
+        self.assertEqual(self.client.get('/api/history/nope/').status_code, 400)
+
+
+PRECOMPUTE_REELS = {**settings.PRECOMPUTE, 'ENDPOINTS': ['generate_trending_reels'], 'NICHES': ['Yoga']}
+
+
+@override_settings(OLLAMA_CACHE=TEST_CACHE, OLLAMA_VALIDATION=NO_VALIDATION, PRECOMPUTE=PRECOMPUTE_REELS)
+class PrecomputeTests(FreshCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(generation, 'acall_ollama_raw', return_value=ollama_result('{"ideas": [1]}'))
+        self.ollama = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reels(self, **body):
+        return self.client.post('/api/generate-trending-reels/', body, content_type='application/json')
+
+    def age_entry(self, seconds):
+        spec = precompute.SPECS['generate_trending_reels']
+        key = precompute.entry_key('generate_trending_reels', settings.OLLAMA_MODELS['large'], spec.fields('yoga'))
+        entry = cache.get_cache().get(key)
+        cache.get_cache().set(key, {**entry, 'generated_at': time.time() - seconds})
+
+    @override_settings(OLLAMA_MODELS=MODEL_TIERS)
+    def test_default_request_served_with_age(self):
+        async_to_sync(precompute.aprecompute)('generate_trending_reels', 'Yoga')
+        response = self.reels(niche='  YOGA ')
+        data = response.json()
+        self.assertEqual(response['X-Cache'], 'PRECOMPUTED')
+        self.assertEqual(response['Age'], '0')
+        self.assertEqual(data['ideas'], {'ideas': [1]})
+        self.assertFalse(data['metadata']['precomputed']['stale'])
+        self.assertEqual(self.reels(niche='Yoga', target_audience='Moms')['X-Cache'], 'MISS')
+        self.assertEqual(self.reels(niche='Yoga', cache='bypass')['X-Cache'], 'BYPASS')
+        # Precalcolato col modello grande: chi chiede il veloce genera
+        fast = self.reels(niche='Yoga', model='fast')
+        self.assertEqual(fast['X-Cache'], 'MISS')
+        self.assertEqual(fast.json()['metadata']['model'], settings.OLLAMA_MODELS['fast'])
+        self.assertEqual(self.ollama.call_count, 4)
+
+    def test_stale_entry_served_and_refreshed(self):
+        async_to_sync(precompute.aprecompute)('generate_trending_reels', 'Yoga')
+        refresher = mock.Mock()
+        with mock.patch.object(precompute, 'get_refresher', return_value=refresher):
+            self.age_entry(settings.PRECOMPUTE['MAX_AGE'] + 60)
+            response = self.reels(niche='Yoga')
+            self.assertEqual(response['X-Cache'], 'PRECOMPUTED')
+            self.assertTrue(response.json()['metadata']['precomputed']['stale'])
+            refresher.request.assert_called_once_with('generate_trending_reels', 'yoga')
+
+            self.age_entry(settings.PRECOMPUTE['MAX_STALE'] + 60)
+            self.assertEqual(self.reels(niche='Yoga')['X-Cache'], 'MISS')
+
+    def test_popular_niches_learned_from_history(self):
+        for niche in ['Fitness', 'fitness', 'Cooking', 'YOGA']:
+            models.ReelIdeas.objects.create(endpoint='generate_trending_reels', result=[], niche=niche)
+        old = models.Strategy.objects.create(endpoint='generate_strategy', result={}, niche='Travel')
+        models.Strategy.objects.filter(pk=old.pk).update(created_at=old.created_at - timedelta(days=30))
+        self.assertEqual(precompute.popular_niches(), ['yoga', 'fitness', 'cooking'])
+        self.assertEqual(precompute.popular_niches(limit=2), ['yoga', 'fitness'])
+        self.assertEqual(precompute.due(), [('generate_trending_reels', n) for n in ['yoga', 'fitness', 'cooking']])
+
+    def test_command_precomputes_due_niches(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('precompute_niches', stdout=out, stderr=err)
+        self.assertIn('yoga', out.getvalue())
+        self.assertIn("'memory'", err.getvalue())
+        self.assertEqual(precompute.due(), [])
+
+        call_command('precompute_niches', stdout=out, stderr=err)
+        self.assertEqual(self.ollama.call_count, 1)
+        listing = io.StringIO()
+        call_command('precompute_niches', '--list', stdout=listing, stderr=err)
+        self.assertRegex(listing.getvalue(), r'generate_trending_reels\s+yoga\s+\d+s')
+
+    def refresher_settings(self, tmp):
+        return override_settings(PRECOMPUTE={
+            **PRECOMPUTE_REELS, 'IDLE_POLL': 0.01, 'LOCK_FILE': str(Path(tmp) / 'precompute.lock'),
+        })
+
+    def test_refresher_waits_for_idle_ollama(self):
+        queue = scheduler.get_scheduler()
+        backend = routing.get_router().backends[0]
+        busy = [
+            mock.patch.object(type(queue), 'active', new_callable=mock.PropertyMock, return_value=1),
+            mock.patch.object(backend, 'outstanding', 1),
+        ]
+        for patch in busy:
+            refresher = precompute.Refresher()
+            with tempfile.TemporaryDirectory() as tmp, self.refresher_settings(tmp), patch:
+                refresher.request('generate_trending_reels', 'Yoga')
+                time.sleep(0.1)
+                self.assertEqual(self.ollama.call_count, 0)
+                refresher.stop()
+                refresher._thread.join(1)
+            self.assertFalse(refresher._thread.is_alive())
+
+    def test_one_refresher_across_processes(self):
+        refresher = precompute.Refresher()
+        with tempfile.TemporaryDirectory() as tmp, self.refresher_settings(tmp):
+            # Il lock tenuto da un altro processo (qui dal test)
+            other = precompute.try_lock(settings.PRECOMPUTE['LOCK_FILE'])
+            self.assertIsNotNone(other)
+            refresher.request('generate_trending_reels', 'Yoga')
+            time.sleep(0.1)
+            self.assertEqual(self.ollama.call_count, 0)
+
+            os.close(other)
+            deadline = time.monotonic() + 5
+            while self.ollama.call_count == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(self.ollama.call_count, 1)
+            self.assertIsNone(precompute.try_lock(settings.PRECOMPUTE['LOCK_FILE']))
+            refresher.stop()
+            refresher._thread.join(1)
+        self.assertFalse(refresher._thread.is_alive())
+
+
+RECORDED_ENDPOINTS = {
+    'strategy': 'generate_strategy', 'content': 'generate_content',
+    'reels': 'generate_trending_reels', 'optimize': 'optimize_idea',
+}
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'})
+class TokenBudgetTests(SimpleTestCase):
+    def setUp(self):
+        metrics.REGISTRY.reset()
+
+    def plan(self, endpoint, prompt, max_tokens, context=None, model=None):
+        return budget.plan(prompt, max_tokens, endpoint, schemas.get_schema(endpoint), context, model)
+
+    def test_num_ctx_is_fixed_per_model(self):
+        sizes = {'default': 8192, 'llama3.2:1b': 4096}
+        with override_settings(OLLAMA_TOKEN_BUDGET={**settings.OLLAMA_TOKEN_BUDGET, 'NUM_CTX': sizes}):
+            strategy_prompt = prompts.get_strategy_prompt('Fitness', 'Moms', 'Sales', 'Daily')
+            strategy = self.plan('generate_strategy', strategy_prompt, 4000)
+            content = self.plan('generate_content', prompts.get_content_prompt('Yoga', 'reel', 'fun', 'Moms'), 1500)
+            fast = self.plan('optimize_idea', 'p', 1500, model='llama3.2:1b')
+            payload = ollama_client.build_payload('p', model='llama3.2:1b')
+            with mock.patch.object(warmup, 'get_sync_session') as session:
+                warmup.warm_model(routing.Backend('http://a'), 'llama3.2:1b')
+            warm = session.return_value.post.call_args.kwargs['json']
+            with override_settings(OLLAMA_TOKEN_BUDGET={**settings.OLLAMA_TOKEN_BUDGET, 'ENABLED': False}):
+                disabled = self.plan('generate_strategy', 'p', 4000)
+        # Stesso num_ctx per endpoint diversi sullo stesso modello, warm-up compreso
+        self.assertEqual((strategy.num_ctx, content.num_ctx, disabled.num_ctx), (8192, 8192, 8192))
+        self.assertEqual((fast.num_ctx, payload['options']['num_ctx'], warm['options']['num_ctx']), (4096,) * 3)
+        self.assertGreaterEqual(strategy.num_ctx, strategy.prompt_tokens + strategy.num_predict)
+        self.assertEqual(disabled.num_predict, 4000)
+
+        with self.assertLogs('api.budget', 'WARNING'):
+            with_session = self.plan('regenerate_strategy', 'More fun', 4000, context=list(range(6000)))
+        self.assertGreaterEqual(with_session.prompt_tokens, 6000)
+        self.assertEqual(with_session.num_predict, with_session.num_ctx - with_session.prompt_tokens)
+
+    def test_view_max_tokens_is_a_floor(self):
+        content = self.plan('generate_content', prompts.get_content_prompt('Yoga', 'reel', 'fun', 'Moms'), 1500)
+        optimize = self.plan('optimize_idea', prompts.get_optimize_idea_prompt('A yoga reel', 'reach'), 1500)
+        self.assertEqual((content.num_predict, optimize.num_predict), (1500, 1500))
+        self.assertEqual(self.plan('generate_content', 'p', 10).num_predict,
+                         math.ceil(content.output_tokens * settings.OLLAMA_TOKEN_BUDGET['OUTPUT_MARGIN']))
+
+    def test_realistic_content_fits_the_budget(self):
+        # Quello che chiede CONTENT_INSTRUCTIONS: caption di 150-200 parole e 25-30 hashtag
+        caption = ' '.join(['Transform your morning routine with five minutes of mindful stretching'] * 20)
+        content = {
+            'caption': caption + ' \U0001f9d8\u2728 Save this post and tag a friend who needs it!',
+            'hashtags': [f'#yogaforbeginners{n}' for n in range(30)],
+            'visual_suggestions': {
+                'description': 'A woman on a mat by a sunny window, slow pans between three poses',
+                'colors': ['warm beige', 'sage green', 'soft white'],
+                'composition': 'Rule of thirds, subject on the left, text overlay on the right',
+            },
+            'posting_recommendations': {
+                'best_time': 'Weekdays 7-9 AM, when the audience plans the day',
+                'engagement_tips': ['Ask a question in the first comment', 'Reply within the first hour',
+                                    'Share to stories with a poll sticker'],
+            },
+        }
+        self.assertGreaterEqual(len(caption.split()), 200)
+        plan = self.plan('generate_content', prompts.get_content_prompt('Yoga', 'reel', 'calm', 'Moms'), 1500)
+        self.assertLessEqual(budget.estimate_tokens(json.dumps(content, indent=2)), plan.num_predict)
+
+    def test_recorded_outputs_fit_their_budget(self):
+        for path in sorted(Path(settings.BASE_DIR / 'api' / 'testdata' / 'ollama_outputs').glob('*.txt')):
+            endpoint = RECORDED_ENDPOINTS[path.stem.split('_')[0]]
+            plan = self.plan(endpoint, 'p', 4000)
+            self.assertLessEqual(budget.estimate_tokens(path.read_text()), plan.num_predict, path.name)
+
+    def test_large_inputs_are_limited(self):
+        limits = {**settings.OLLAMA_TOKEN_BUDGET, 'MAX_INPUT_TOKENS': {'previous_strategy': 600, 'idea_content': 20}}
+        calendar = [{'day': day, 'pillar': 'Tips', 'topic': f'Topic {day}', 'hook': 'A long hook ' * 5}
+                    for day in range(1, 31)]
+        strategy = {'content_pillars': [{'name': 'Tips'}], 'calendar': calendar}
+        with override_settings(OLLAMA_TOKEN_BUDGET=limits):
+            small = budget.limit_strategy(json.dumps({'calendar': calendar[:2]}, indent=2))
+            summarized = budget.limit_strategy(strategy)
+            truncated = budget.limit_strategy({**strategy, 'engagement_tips': ['tip ' * 500]})
+            idea = budget.limit_text('word ' * 100, 'idea_content')
+        self.assertEqual(json.loads(small), {'calendar': calendar[:2]})
+        self.assertNotIn('\n', small)
+        self.assertEqual(json.loads(summarized)['calendar'][29], {'day': 30, 'pillar': 'Tips', 'topic': 'Topic 30'})
+        self.assertTrue(truncated.endswith(budget.TRUNCATED))
+        self.assertLessEqual(len(truncated), budget.max_input_chars('previous_strategy'))
+        self.assertTrue(idea.startswith('word word'))
+        self.assertTrue(idea.endswith('word' + budget.TRUNCATED))
+        self.assertLessEqual(len(idea), 70)
+
+    def test_generation_uses_the_plan_and_logs_usage(self):
+        prompt = prompts.get_optimize_idea_prompt('A yoga reel', 'reach')
+        plan = self.plan('optimize_idea', prompt, 1500)
+        result = ollama_result('{}', eval_count=plan.num_predict)
+        with mock.patch.object(generation, 'acall_ollama_raw', return_value=result) as call, \
+                self.assertLogs('api.budget', 'INFO') as logs:
+            async_to_sync(generation.agenerate)(
+                prompt, 0.7, 1500, endpoint='optimize_idea', format=schemas.get_schema('optimize_idea')
+            )
+        args = call.await_args.args
+        self.assertEqual(args[2], plan.num_predict)
+        self.assertEqual(logs.records[0].levelname, 'WARNING')
+        self.assertIn('hit num_predict', logs.output[0])
+        self.assertEqual(metrics.BUDGET_EXHAUSTED.value('optimize_idea', settings.OLLAMA_MODEL), 1)
+
+
+@override_settings(OLLAMA_CACHE={'BACKEND': 'none'}, OLLAMA_VALIDATION=NO_VALIDATION, GENERATION_HISTORY=NO_HISTORY)
+class CancellationTests(SimpleTestCase):
+    def setUp(self):
+        metrics.REGISTRY.reset()
+        scheduler._reset_scheduler('OLLAMA_SCHEDULER')
+
+    def hanging_ollama(self):
+        """acall_ollama_raw che non risponde mai; started/cancelled sono asyncio.Event"""
+        state = {}
+
+        async def fake(*args):
+            state['started'].set()
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                state['cancelled'].set()
+                raise
+
+        def events():
+            state['started'], state['cancelled'] = asyncio.Event(), asyncio.Event()
+            return state['started'], state['cancelled']
+
+        return fake, events
+
+    def cancelled(self, endpoint, stage):
+        return metrics.CANCELLED.value(endpoint, settings.OLLAMA_MODEL, stage)
+
+    def test_generation_cancelled_when_nobody_waits(self):
+        fake, events = self.hanging_ollama()
+
+        async def run():
+            started, cancelled = events()
+            leader = asyncio.create_task(generation.agenerate('p', endpoint='optimize_idea'))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(generation.agenerate('p', endpoint='optimize_idea'))
+            await started.wait()
+            leader.cancel()
+            await asyncio.sleep(0.01)
+            # Il follower tiene in vita la generazione; quando se ne va anche lui si chiude
+            self.assertFalse(cancelled.is_set())
+            follower.cancel()
+            await asyncio.wait_for(cancelled.wait(), 1)
+            await asyncio.gather(leader, follower, return_exceptions=True)
+
+        with mock.patch.object(generation, 'acall_ollama_raw', fake):
+            asyncio.run(run())
+
+        self.assertEqual(scheduler.get_scheduler().active, 0)
+        self.assertEqual(singleflight.flight.in_flight(), 0)
+        self.assertEqual(self.cancelled('optimize_idea', metrics.GENERATING), 1)
+
+    def test_client_disconnect_cancels_asgi_view(self):
+        fake, events = self.hanging_ollama()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+            'scheme': 'http', 'path': '/api/optimize-idea/', 'raw_path': b'/api/optimize-idea/',
+            'root_path': '', 'query_string': b'', 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+            'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')],
+        }
+        sent = []
+
+        async def run():
+            started, cancelled = events()
+            messages = [{'type': 'http.request', 'body': json.dumps({'idea_content': 'A yoga reel'}).encode()}]
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await started.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            await asyncio.wait_for(ASGIHandler()(scope, receive, send), 2)
+            return cancelled.is_set()
+
+        with mock.patch.object(generation, 'acall_ollama_raw', fake):
+            self.assertTrue(asyncio.run(run()))
+
+        self.assertEqual(sent, [])
+        self.assertEqual(scheduler.get_scheduler().active, 0)
+        model = tiering.choose_model('optimize_idea', None).model
+        self.assertEqual(metrics.CANCELLED.value('optimize_idea', model, metrics.GENERATING), 1)
+
+    def test_closing_a_stream_closes_the_ollama_connection(self):
+        async def run(node):
+            stream = streaming.relay_generation(
+                'ndjson', 'p', 0.7, 2000, lambda text: text, endpoint='generate_content'
+            )
+            received = [await anext(stream) for _ in range(3)]
+            # Come fa Django quando il client si disconnette a meta' stream
+            await stream.aclose()
+            return received
+
+        with FakeOllama(models=[settings.OLLAMA_MODEL], response='x' * 4000, tokens_per_second=100) as node, \
+                routing_settings([node.url]):
+            received = asyncio.run(run(node))
+            deadline = time.monotonic() + 2
+            while not node.aborted and time.monotonic() < deadline:
+                time.sleep(0.02)
+
+        self.assertEqual(len(received), 3)
+        self.assertEqual(node.aborted, 1)
+        self.assertEqual(scheduler.get_scheduler().active, 0)
+        self.assertEqual(self.cancelled('generate_content', metrics.GENERATING), 1)
+        self.assertGreaterEqual(metrics.CANCELLED_TOKENS.value('generate_content', settings.OLLAMA_MODEL), 3)
+
+
+def hedging_settings(**config):
+    return override_settings(OLLAMA_HEDGING={
+        'ENABLED': True, 'ENDPOINTS': ['optimize_idea'], 'PERCENTILE': 95, 'WINDOW_SECONDS': 600,
+        'MIN_SAMPLES': 3, 'INITIAL_DELAY': 0.05, 'MAX_RATE': 0.1, 'BURST': 5, **config
+    })
+
+
+class HedgingTests(SimpleTestCase):
+    def setUp(self):
+        metrics.REGISTRY.reset()
+
+    def generate(self, endpoint='optimize_idea'):
+        return asyncio.run(generation.agenerate(
+            'p', max_tokens=50, cache_mode=cache.BYPASS, endpoint=endpoint, model=settings.OLLAMA_MODEL
+        ))
+
+    def test_slow_node_is_hedged(self):
+        models = [settings.OLLAMA_MODEL]
+        slow_response = '{"node": "slow", "padding": "%s"}' % ('x ' * 2000)
+        with FakeOllama(models=models, response=slow_response, delay=1.0, tokens_per_second=1000) as slow, \
+                FakeOllama(models=models, response='{"node": "fast"}') as fast, \
+                routing_settings([slow.url, fast.url]), hedging_settings(INITIAL_DELAY=0.3):
+            # INITIAL_DELAY lascia arrivare la richiesta al nodo lento prima del duplicato
+            started = time.monotonic()
+            result = self.generate()
+            elapsed = time.monotonic() - started
+            deadline = time.monotonic() + 2
+            while not slow.aborted and time.monotonic() < deadline:
+                time.sleep(0.02)
+
+        self.assertEqual(json.loads(result.text), {'node': 'fast'})
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual(len(fast.requests), 1)
+        # Il perdente chiude la connessione: il nodo lento smette di generare
+        self.assertEqual(slow.aborted, 1)
+        self.assertEqual(metrics.HEDGES.value('optimize_idea', hedging.WON), 1)
+        self.assertEqual(scheduler.get_scheduler().active, 0)
+
+    def test_budget_exhausted_waits_for_primary(self):
+        models = [settings.OLLAMA_MODEL]
+        with FakeOllama(models=models, response='{"node": "slow"}', delay=0.2) as slow, \
+                FakeOllama(models=models, response='{"node": "fast"}') as fast, \
+                routing_settings([slow.url, fast.url]), hedging_settings(MAX_RATE=0, BURST=0):
+            result = self.generate()
+
+        self.assertEqual(json.loads(result.text), {'node': 'slow'})
+        self.assertEqual(fast.requests, [])
+        self.assertEqual(metrics.HEDGES.value('optimize_idea', hedging.DENIED), 1)
+
+    def test_other_endpoints_and_single_node_are_not_hedged(self):
+        with FakeOllama(models=[settings.OLLAMA_MODEL]) as node, routing_settings([node.url]), \
+                hedging_settings():
+            self.assertFalse(hedging.enabled_for('optimize_idea'))
+        with routing_settings(['http://a', 'http://b']), hedging_settings():
+            self.assertTrue(hedging.enabled_for('optimize_idea'))
+            self.assertFalse(hedging.enabled_for('generate_strategy'))
+        with routing_settings(['http://a', 'http://b']), hedging_settings(ENABLED=False):
+            self.assertFalse(hedging.enabled_for('optimize_idea'))
+
+    def test_fails_over_from_dead_node(self):
+        with FakeOllama(models=[settings.OLLAMA_MODEL], response='{"ok": true}') as node, \
+                routing_settings([DEAD_NODE, node.url]), hedging_settings(INITIAL_DELAY=5):
+            started = time.monotonic()
+            result = self.generate()
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(json.loads(result.text), {'ok': True})
+        self.assertEqual(len(node.requests), 1)
+        # Il secondo nodo subito, non dopo INITIAL_DELAY
+        self.assertLess(elapsed, 2)
+
+    def test_delay_learned_from_first_tokens(self):
+        with hedging_settings(MIN_SAMPLES=3, PERCENTILE=50):
+            tracker = hedging.get_tracker()
+            tracker.record(('optimize_idea', 'm'), 0.3)
+            tracker.record(('optimize_idea', 'm'), 0.1)
+            self.assertEqual(hedging.hedge_delay('optimize_idea', 'm'), 0.05)
+            tracker.record(('optimize_idea', 'm'), 0.2)
+            self.assertEqual(hedging.hedge_delay('optimize_idea', 'm'), 0.2)
+            self.assertEqual(hedging.hedge_delay('generate_content', 'm'), 0.05)
+
+    def test_budget(self):
+        budget = hedging.HedgeBudget(rate=0.5, burst=1)
+        self.assertTrue(budget.try_spend())
+        self.assertFalse(budget.try_spend())
+        budget.deposit()
+        self.assertFalse(budget.try_spend())
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.try_spend())
+        self.assertFalse(budget.try_spend())
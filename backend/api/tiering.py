@@ -0,0 +1,156 @@
+"""
+Scelta del modello per richiesta: tier 'large' (llama3.2) o 'fast'
+(llama3.2:1b) invece di un unico OLLAMA_MODEL per tutto il servizio.
+
+- Per endpoint: OLLAMA_MODEL_POLICY['ENDPOINT_TIERS'] (i task brevi come
+  optimize_idea e test_ollama vanno sul modello veloce).
+- Per richiesta: il campo "model" del body, un nome di tier o di modello.
+- Per sessione: una richiesta che continua una sessione (api/sessions.py)
+  usa il modello che ha prodotto il context.
+- Adattiva: gli endpoint in DEGRADABLE passano al modello veloce quando la
+  coda dello scheduler supera MAX_QUEUE_DEPTH o il p95 della latenza del
+  modello grande (ultimi WINDOW_SECONDS) supera MAX_P95_SECONDS.
+
+Senza "model" nella richiesta, un tier il cui modello non e' su nessun nodo
+(secondo /api/tags) torna a OLLAMA_MODEL: configurare OLLAMA_LARGE_MODEL o
+OLLAMA_FAST_MODEL senza averli scaricati non rompe le generazioni.
+
+Il modello scelto e il motivo finiscono in metadata.model e
+metadata.model_reason.
+"""
+import math
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .routing import get_router
+from .scheduler import get_scheduler
+
+
+LARGE = 'large'
+FAST = 'fast'
+
+# Motivi della scelta
+ENDPOINT = 'endpoint'
+REQUEST = 'request'
+QUEUE_DEPTH = 'queue_depth'
+P95_LATENCY = 'p95_latency'
+SESSION = 'session'
+UNAVAILABLE = 'unavailable'
+
+
+class InvalidModel(ValueError):
+    """Il campo "model" non corrisponde a nessun tier o modello configurato"""
+
+
+class ModelChoice:
+    def __init__(self, model, tier, reason):
+        self.model = model
+        self.tier = tier
+        self.reason = reason
+
+    def metadata(self):
+        return {'model': self.model, 'model_reason': self.reason}
+
+
+class LatencyTracker:
+    """Latenze delle generazioni per modello in una finestra temporale"""
+
+    def __init__(self, window_seconds, max_samples=500):
+        self.window_seconds = window_seconds
+        self._samples = defaultdict(lambda: deque(maxlen=max_samples))
+        self._lock = threading.Lock()
+
+    def record(self, model, seconds):
+        with self._lock:
+            self._samples[model].append((time.monotonic(), seconds))
+
+    def percentile(self, model, percentile=95, min_samples=1):
+        """Percentile delle latenze recenti, None con meno di min_samples campioni nella finestra"""
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            samples = self._samples[model]
+            # Senza campioni recenti (es. modello gia' degradato) si torna a provarlo
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            values = sorted(seconds for _, seconds in samples)
+        if not values or len(values) < min_samples:
+            return None
+        index = max(0, math.ceil(percentile / 100 * len(values)) - 1)
+        return values[index]
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker():
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = LatencyTracker(settings.OLLAMA_MODEL_POLICY['WINDOW_SECONDS'])
+    return _tracker
+
+
+def record_latency(model, seconds):
+    get_tracker().record(model or settings.OLLAMA_MODEL, seconds)
+
+
+def resolve_model(requested):
+    """(modello, tier) per il valore del campo "model"; InvalidModel se sconosciuto"""
+    tiers = settings.OLLAMA_MODELS
+    if requested in tiers:
+        return tiers[requested], requested
+    for tier, model in tiers.items():
+        if requested == model:
+            return model, tier
+    choices = sorted(set(tiers) | set(tiers.values()))
+    raise InvalidModel(f"model must be one of: {', '.join(choices)}")
+
+
+def available_model(model):
+    """model, o OLLAMA_MODEL se nessun nodo ce l'ha (nodi mai controllati: si prova)"""
+    if model == settings.OLLAMA_MODEL or any(backend.has_model(model) for backend in get_router().backends):
+        return model
+    return settings.OLLAMA_MODEL
+
+
+def choose_model(endpoint, requested=None):
+    """Il modello per una richiesta all'endpoint"""
+    if requested:
+        model, tier = resolve_model(requested)
+        return ModelChoice(model, tier, REQUEST)
+
+    choice = _policy_choice(endpoint)
+    model = available_model(choice.model)
+    if model != choice.model:
+        return ModelChoice(model, choice.tier, UNAVAILABLE)
+    return choice
+
+
+def _policy_choice(endpoint):
+    policy = settings.OLLAMA_MODEL_POLICY
+    tiers = settings.OLLAMA_MODELS
+    tier = policy['ENDPOINT_TIERS'].get(endpoint, policy['DEFAULT_TIER'])
+
+    if tier == LARGE and endpoint in policy['DEGRADABLE']:
+        if get_scheduler().queued >= policy['MAX_QUEUE_DEPTH']:
+            return ModelChoice(tiers[FAST], FAST, QUEUE_DEPTH)
+        p95 = get_tracker().percentile(tiers[LARGE])
+        if p95 is not None and p95 > policy['MAX_P95_SECONDS']:
+            return ModelChoice(tiers[FAST], FAST, P95_LATENCY)
+
+    return ModelChoice(tiers[tier], tier, ENDPOINT)
+
+
+@receiver(setting_changed)
+def _reset_tracker(setting, **kwargs):
+    global _tracker
+    if setting == 'OLLAMA_MODEL_POLICY':
+        with _tracker_lock:
+            _tracker = None
@@ -9,6 +9,14 @@ urlpatterns = [
     path('generate-strategy/', views.generate_strategy, name='generate_strategy'),
     path('regenerate-strategy/', views.regenerate_strategy, name='regenerate_strategy'),
     path('generate-content/', views.generate_content, name='generate_content'),
+    path('generate-content/batch/', views.generate_content_batch, name='generate_content_batch'),
     path('generate-trending-reels/', views.generate_trending_reels, name='generate_trending_reels'),
     path('optimize-idea/', views.optimize_idea, name='optimize_idea'),
+
+    # Job asincroni (POST con "async": true)
+    path('jobs/<uuid:job_id>/', views.job_status, name='job_status'),
+
+    # Storico delle generazioni (strategies, content, reels, optimizations)
+    path('history/<str:kind>/', views.history_list, name='history_list'),
+    path('history/<str:kind>/<int:pk>/', views.history_detail, name='history_detail'),
 ]
\ No newline at end of file
@@ -0,0 +1,328 @@
+"""
+Validazione delle risposte contro gli schemi e retry mirato.
+
+Invece di rifare tutta la generazione si richiede solo la parte che manca o
+non e' valida: i giorni mancanti del calendario con il prompt dei blocchi,
+le idee di reels mancanti con un prompt "genera N idee in piu'", le sezioni
+della strategia con il prompt di sezione e i campi mancanti di contenuti e
+ottimizzazioni con un prompt per quei soli campi. Il resoconto (retry,
+token sprecati, errori rimasti) finisce in metadata.validation.
+"""
+import asyncio
+import json
+
+from django.conf import settings
+
+from . import schemas
+from .budget import estimate_tokens
+from .cache import BYPASS, REFRESH
+from .generation import agenerate
+from .metrics import parse_json
+from .ollama_client import OllamaError
+from .prompts import (
+    get_calendar_chunk_prompt,
+    get_missing_fields_prompt,
+    get_more_reels_prompt,
+    get_regenerate_section_prompt
+)
+from .scheduler import Overloaded
+from .strategy import (
+    CHUNK_OVERHEAD_TOKENS,
+    SECTION_TOKENS,
+    STRATEGY_SECTIONS,
+    TOKENS_PER_DAY,
+    parse_calendar_chunk,
+    parse_section
+)
+
+
+REPAIR_FEEDBACK = 'This section was missing or invalid. Generate it from scratch.'
+TOKENS_PER_REEL = 250
+FIELD_TOKENS = 400
+# Quanti errori riportare al client al massimo
+MAX_REPORTED_ERRORS = 20
+
+# Temperatura dei retry, la stessa della chiamata originale
+TEMPERATURES = {
+    'generate_strategy': 0.8,
+    'regenerate_strategy': 0.8,
+    'generate_content': 0.7,
+    'generate_trending_reels': 0.9,
+    'optimize_idea': 0.7,
+}
+
+
+def is_valid(value, schema):
+    return not schemas.validate(value, schema)
+
+
+class Report:
+    """Contatori dei retry di una risposta"""
+
+    def __init__(self, endpoint, cache_mode, model=None):
+        self.endpoint = endpoint
+        self.cache_mode = cache_mode
+        self.model = model
+        self.retries = 0
+        self.wasted_tokens = 0
+        self.retry_errors = []
+
+    def discard(self, value):
+        self.wasted_tokens += estimate_tokens(json.dumps(value, ensure_ascii=False))
+
+    async def generate(self, prompt, max_tokens, schema, parse):
+        """Una chiamata di retry: il valore parsato, o None se fallisce"""
+        self.retries += 1
+        try:
+            generation = await agenerate(
+                prompt, TEMPERATURES[self.endpoint], max_tokens, self.cache_mode,
+                self.endpoint, schemas.ollama_format(schema), self.model
+            )
+        except (OllamaError, Overloaded) as e:
+            self.retry_errors.append(str(e))
+            return None
+        try:
+            return parse(generation.text)
+        except ValueError as e:
+            self.wasted_tokens += generation.eval_count
+            self.retry_errors.append(str(e))
+            return None
+
+    def to_dict(self, errors):
+        report = {
+            'valid': not errors,
+            'retries': self.retries,
+            'wasted_tokens': self.wasted_tokens,
+        }
+        if errors:
+            report['errors'] = errors[:MAX_REPORTED_ERRORS]
+        if self.retry_errors:
+            report['retry_errors'] = self.retry_errors
+        return report
+
+
+def parse_list(text):
+    value, _ = parse_json(text, shape=list)
+    if not isinstance(value, list):
+        raise ValueError('response is not a JSON array')
+    return value
+
+
+def parse_object(text):
+    value, _ = parse_json(text, shape=dict)
+    if not isinstance(value, dict):
+        raise ValueError('response is not a JSON object')
+    return value
+
+
+def missing_day_ranges(days, chunk_days):
+    """Raggruppa i giorni mancanti in intervalli contigui di al massimo chunk_days"""
+    ranges = []
+    for day in days:
+        if ranges and ranges[-1][1] == day - 1 and day - ranges[-1][0] < chunk_days:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(r) for r in ranges]
+
+
+async def _arepair_calendar(calendar, context, pillars, report):
+    days = {}
+    for entry in calendar if isinstance(calendar, list) else []:
+        if (not is_valid(entry, schemas.CALENDAR_ENTRY_SCHEMA)
+                or not 1 <= entry['day'] <= schemas.CALENDAR_DAYS or entry['day'] in days):
+            report.discard(entry)
+            continue
+        days[entry['day']] = entry
+
+    missing = [day for day in range(1, schemas.CALENDAR_DAYS + 1) if day not in days]
+
+    async def fill(start, end):
+        prompt = get_calendar_chunk_prompt(
+            context.get('niche', 'the niche of these content pillars'),
+            context.get('target_audience', 'General audience'),
+            context.get('goals', 'Increase engagement'),
+            pillars, start, end
+        )
+        count = end - start + 1
+        entries = await report.generate(
+            prompt, count * TOKENS_PER_DAY + CHUNK_OVERHEAD_TOKENS, schemas.calendar_schema(count),
+            lambda text: parse_calendar_chunk(text, start, end)
+        )
+        for entry in entries or []:
+            if is_valid(entry, schemas.CALENDAR_ENTRY_SCHEMA) and entry['day'] not in days:
+                days[entry['day']] = entry
+            else:
+                report.discard(entry)
+
+    await asyncio.gather(*[
+        fill(start, end)
+        for start, end in missing_day_ranges(missing, settings.STRATEGY_CALENDAR_CHUNK_DAYS)
+    ])
+    return [days[day] for day in sorted(days)]
+
+
+async def _arepair_strategy(strategy, context, report):
+    if not isinstance(strategy, dict):
+        return strategy
+
+    pillars = strategy.get('content_pillars')
+    pillars = pillars if isinstance(pillars, list) else []
+
+    async def section(name):
+        current = strategy.get(name)
+        schema = schemas.STRATEGY_SECTION_SCHEMAS[name]
+        if name in strategy:
+            report.discard(current)
+        prompt = get_regenerate_section_prompt(
+            name, json.dumps(current, indent=2), REPAIR_FEEDBACK, pillars
+        )
+        value = await report.generate(
+            prompt, SECTION_TOKENS[name], schema, lambda text: parse_section(name, text)
+        )
+        if value is not None and is_valid(value, schema):
+            strategy[name] = value
+        elif value is not None:
+            report.discard(value)
+
+    broken = [
+        name for name in STRATEGY_SECTIONS
+        if name != 'calendar' and not is_valid(strategy.get(name), schemas.STRATEGY_SECTION_SCHEMAS[name])
+    ]
+    calendar_ok = is_valid(strategy.get('calendar'), schemas.STRATEGY_SECTION_SCHEMAS['calendar'])
+
+    tasks = [section(name) for name in broken]
+    if not calendar_ok:
+        async def calendar():
+            strategy['calendar'] = await _arepair_calendar(
+                strategy.get('calendar'), context, [p for p in pillars if isinstance(p, dict)], report
+            )
+        tasks.append(calendar())
+    await asyncio.gather(*tasks)
+    return strategy
+
+
+async def _arepair_reels(ideas, context, report):
+    if not isinstance(ideas, list):
+        return ideas
+
+    valid = []
+    for idea in ideas:
+        if len(valid) < schemas.REEL_IDEAS and is_valid(idea, schemas.REEL_IDEA_SCHEMA):
+            valid.append(idea)
+        else:
+            report.discard(idea)
+
+    missing = schemas.REEL_IDEAS - len(valid)
+    if missing:
+        prompt = get_more_reels_prompt(
+            context.get('niche', 'content creation'),
+            context.get('target_audience', 'General audience'),
+            missing,
+            [idea['title'] for idea in valid]
+        )
+        more = await report.generate(
+            prompt, missing * TOKENS_PER_REEL, schemas.reels_schema(missing), parse_list
+        )
+        for idea in more or []:
+            if len(valid) < schemas.REEL_IDEAS and is_valid(idea, schemas.REEL_IDEA_SCHEMA):
+                valid.append(idea)
+            else:
+                report.discard(idea)
+    return valid
+
+
+async def _arepair_fields(value, context, report):
+    if not isinstance(value, dict):
+        return value
+
+    schema = schemas.get_schema(report.endpoint)
+    properties = schema['properties']
+    broken = [
+        name for name in schema['required']
+        if not is_valid(value.get(name), properties[name])
+    ]
+    if not broken:
+        return value
+
+    for name in broken:
+        if name in value:
+            report.discard(value.pop(name))
+    fields_schema = {
+        'type': 'object',
+        'properties': {name: properties[name] for name in broken},
+        'required': broken,
+    }
+    brief = '\n'.join(
+        f'- {name}: {field}' for name, field in context.items() if isinstance(field, str)
+    )
+    prompt = get_missing_fields_prompt(
+        brief, json.dumps(value, indent=2), json.dumps(fields_schema, indent=2)
+    )
+    fields = await report.generate(prompt, FIELD_TOKENS * len(broken), fields_schema, parse_object)
+    for name, field in (fields or {}).items():
+        if name in broken and is_valid(field, properties[name]):
+            value[name] = field
+        else:
+            report.discard(field)
+    return value
+
+
+REPAIRERS = {
+    'generate_strategy': _arepair_strategy,
+    'regenerate_strategy': _arepair_strategy,
+    'generate_content': _arepair_fields,
+    'generate_trending_reels': _arepair_reels,
+    'optimize_idea': _arepair_fields,
+}
+
+
+async def avalidate(endpoint, value, context, cache_mode=None, model=None):
+    """
+    Valida value con lo schema dell'endpoint e ripara le parti mancanti:
+    restituisce (valore, resoconto per metadata.validation).
+    """
+    schema = schemas.get_schema(endpoint)
+    report = Report(endpoint, cache_mode, model)
+    errors = schemas.validate(value, schema)
+
+    for round_number in range(settings.OLLAMA_VALIDATION['MAX_ROUNDS']):
+        if not errors:
+            break
+        if round_number and cache_mode != BYPASS:
+            # Lo stesso prompt di retry non deve rileggere dalla cache la risposta scartata
+            report.cache_mode = REFRESH
+        retries = report.retries
+        value = await REPAIRERS[endpoint](value, context, report)
+        errors = schemas.validate(value, schema)
+        if report.retries == retries:
+            # Niente che si possa riparare in modo mirato (es. JSON non parsabile)
+            break
+
+    return value, report.to_dict(errors)
+
+
+async def avalidate_result(result, key, endpoint, cache_mode=None, model=None):
+    """
+    Valida e ripara result[key] e aggiunge metadata.validation al body della
+    risposta; se resta invalido anche dopo i retry lo dice anche in warning
+    """
+    if not settings.OLLAMA_VALIDATION['ENABLED'] or schemas.get_schema(endpoint) is None:
+        return result
+
+    metadata = result.get('metadata', {})
+    # I dati della richiesta (niche, topic, original_idea, ...) servono ai prompt di retry
+    context = {
+        name: value for name, value in {**result, **metadata}.items()
+        if name not in (key, 'success', 'warning')
+    }
+    value, report = await avalidate(endpoint, result[key], context, cache_mode, model)
+    result[key] = value
+    result['metadata'] = {**metadata, 'validation': report}
+    if not report['valid']:
+        invalid = (
+            f"Response does not match the {endpoint} schema after {report['retries']} retries: "
+            f"{report['errors'][0]}"
+        )
+        result['warning'] = '; '.join(filter(None, [result.get('warning'), invalid]))
+    return result
@@ -1,7 +1,8 @@
 import json
-import re
-import requests
-from django.http import JsonResponse
+import time
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
@@ -12,88 +13,248 @@ from .prompts import (
     get_optimize_idea_prompt,
     get_regenerate_strategy_prompt
 )
+from .batch import abatch_content, batch_summary
+from .cache import CACHE_MODES
+from .generation import agenerate
+from .jobs import QueueFull, acreate_job
+from .metrics import REGISTRY, finish, start_timings
+from .models import GenerationJob
+from .responses import build_pipeline_result, build_result
+from . import budget, history, precompute, semantic_cache
+from .routing import get_router
+from .scheduler import Overloaded, get_scheduler
+from .schemas import get_schema, ollama_format
+from .sessions import attach_session, load_session
+from .strategy import (
+    apipeline_regenerate,
+    apipeline_strategy,
+    parse_previous_strategy,
+    target_sections
+)
+from .streaming import (
+    get_stream_format,
+    relay_batch,
+    relay_generation,
+    relay_pipeline,
+    streaming_response
+)
+from .tiering import SESSION, InvalidModel, choose_model, resolve_model
+from .validation import avalidate_result
+from .warmup import READY, areadiness
+
+
+STRATEGY_MODES = ('single', 'pipelined')
+REGENERATE_MODES = ('full', 'incremental')
+
+
+def overloaded_response(error):
+    """503 con Retry-After stimato dallo scheduler"""
+    response = JsonResponse({
+        'success': False,
+        'error': str(error),
+        'retry_after': error.retry_after
+    }, status=503)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def invalid_cache_mode(data):
+    """400 se il campo "cache" non e' valido, altrimenti None"""
+    cache_mode = data.get('cache')
+    if cache_mode is not None and cache_mode not in CACHE_MODES:
+        return JsonResponse({
+            'success': False,
+            'error': f"cache must be one of: {', '.join(CACHE_MODES)}"
+        }, status=400)
+    return None
+
+
+def invalid_model(data):
+    """400 se il campo "model" non e' un tier o un modello configurato, altrimenti None"""
+    requested = data.get('model')
+    if requested is None:
+        return None
+    try:
+        resolve_model(requested)
+    except InvalidModel as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+    return None
+
 
+def select_model(data, endpoint, extra):
+    """Sceglie il modello (api/tiering.py) e lo riporta in extra['metadata']"""
+    choice = choose_model(endpoint, data.get('model'))
+    extra['metadata'] = {**extra.get('metadata', {}), **choice.metadata()}
+    return choice.model
+
+
+async def _reuse(endpoint, key, extra, output, timings, source, metadata):
+    """Risposta con un output gia' generato (precalcolato o dalla cache semantica)"""
+    result = {'success': True, key: output, **extra}
+    result['metadata'] = {**result.get('metadata', {}), source: metadata}
+    response = JsonResponse(await history.arecord(endpoint, finish(result, timings)))
+    response['X-Cache'] = 'PRECOMPUTED' if source == 'precomputed' else 'SEMANTIC'
+    return response
+
+
+async def _generate(request, data, endpoint, prompt, temperature, max_tokens, key, extra,
+                    allow_async=False, session=None, fields=None):
+    """
+    Chiama Ollama in modalita' normale, streaming (SSE/NDJSON) o come job;
+    con session continua dal suo context con lo stesso modello. fields sono
+    i campi della richiesta per la cache semantica (solo modalita' normale).
+    """
+    error = invalid_cache_mode(data) or invalid_model(data)
+    if error:
+        return error
+    timings = start_timings(endpoint)
+    cache_mode = data.get('cache')
+    output_format = ollama_format(get_schema(endpoint))
+    if session is not None:
+        model, context = session.model, session.context
+        extra['metadata'] = {**extra.get('metadata', {}), 'model': model, 'model_reason': SESSION}
+    else:
+        model, context = select_model(data, endpoint, extra), None
+
+    if allow_async and data.get('async'):
+        try:
+            job = await acreate_job(
+                endpoint, prompt, temperature, max_tokens, key, extra, cache_mode, output_format,
+                model, context
+            )
+        except QueueFull as e:
+            return JsonResponse({
+                'success': False,
+                'error': str(e),
+                'message': 'Too many queued jobs, retry later.'
+            }, status=503)
+        return JsonResponse({
+            'success': True,
+            'job_id': str(job.pk),
+            'status': job.status,
+            'status_url': reverse('job_status', args=[job.pk])
+        }, status=202)
+
+    build = build_result(key, extra)
 
-def clean_json_response(text):
-    """Pulisce la risposta da markdown code blocks e altri artifacts"""
-    if not text:
-        return ""
-    
-    # Rimuovi markdown code blocks
-    text = re.sub(r'^```json\s*', '', text.strip())
-    text = re.sub(r'^```\s*', '', text.strip())
-    text = re.sub(r'\s*```$', '', text.strip())
-    
-    # Rimuovi eventuali spazi extra
-    text = text.strip()
-    
-    return text
-
-
-def call_ollama(prompt, temperature=0.7, max_tokens=2000):
-    """Helper function per chiamare Ollama"""
     try:
-        response = requests.post(
-            f"{settings.OLLAMA_BASE_URL}/api/generate",
-            json={
-                'model': settings.OLLAMA_MODEL,
-                'prompt': prompt,
-                'stream': False,
-                'options': {
-                    'temperature': temperature,
-                    'num_predict': max_tokens,
-                    'num_ctx': 2048
-                }
-            },
-            timeout=600
+        fmt = get_stream_format(request, data)
+        if fmt:
+            # Meglio un 503 subito che un errore a stream gia' aperto
+            get_scheduler().check_admission()
+            return streaming_response(fmt, relay_generation(
+                fmt, prompt, temperature, max_tokens, build, cache_mode, endpoint, output_format, key,
+                model, context, timings
+            ))
+
+        query = match = None
+        if fields is not None and session is None:
+            precomputed = await precompute.alookup(endpoint, model, fields, cache_mode)
+            if precomputed is not None:
+                response = await _reuse(endpoint, key, extra, precomputed.output, timings,
+                                        'precomputed', precomputed.metadata())
+                response['Age'] = str(int(precomputed.age))
+                return response
+            query, match = await semantic_cache.alookup(endpoint, model, fields, cache_mode)
+        if match is not None:
+            return await _reuse(endpoint, key, extra, match.output, timings, 'semantic_cache', match.metadata())
+
+        generation = await agenerate(
+            prompt, temperature, max_tokens, cache_mode, endpoint, output_format, model, context
         )
-        
-        if response.status_code == 200:
-            result = response.json()
-            raw_response = result.get('response', '')
-            
-            # Pulisci la risposta
-            cleaned_response = clean_json_response(raw_response)
-            
-            return cleaned_response
-        else:
-            raise Exception(f"Ollama returned status {response.status_code}: {response.text}")
-    
-    except Exception as e:
-        raise Exception(f"Failed to connect to Ollama: {str(e)}")
+        result = await avalidate_result(build(generation.text), key, endpoint, cache_mode, model)
+        result = attach_session(result, endpoint, model, generation.context)
+        if query is not None and generation.cache_status not in ('hit', 'coalesced') and 'warning' not in result:
+            await semantic_cache.astore(query, result[key], time.monotonic() - timings.started)
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    response = JsonResponse(await history.arecord(endpoint, finish(result, timings)))
+    response['X-Cache'] = generation.cache_status.upper()
+    return response
+
+
+async def _pipeline(request, data, endpoint, events, key, extra, model=None):
+    """Esegue una pipeline di piu' chiamate, in streaming o restituendo il risultato finale"""
+    cache_mode = data.get('cache')
+    timings = start_timings(endpoint)
+    try:
+        fmt = get_stream_format(request, data)
+        if fmt:
+            get_scheduler().check_admission()
+            return streaming_response(
+                fmt, relay_pipeline(fmt, events, key, extra, endpoint, cache_mode, model, timings)
+            )
+
+        async for event, payload in events:
+            if event == 'result':
+                value, warnings = payload
+        result = await avalidate_result(
+            build_pipeline_result(key, value, warnings, extra), key, endpoint, cache_mode, model
+        )
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    return JsonResponse(await history.arecord(endpoint, finish(result, timings)))
 
 
 @csrf_exempt
 @require_http_methods(["GET"])
-def health_check(request):
-    """Health check endpoint"""
+async def health_check(request):
+    """Health check endpoint: 200 solo se i modelli da tenere caldi sono caricati"""
+    readiness = await areadiness()
     return JsonResponse({
-        'status': 'healthy',
+        'status': readiness['status'],
         'message': 'Django backend is running',
         'ollama_url': settings.OLLAMA_BASE_URL,
-        'ollama_model': settings.OLLAMA_MODEL
-    })
+        'ollama_model': settings.OLLAMA_MODEL,
+        'ollama_backends': get_router().to_dict(),
+        'models_loaded': readiness['models']
+    }, status=200 if readiness['status'] == READY else 503)
+
+
+@require_http_methods(["GET"])
+async def metrics(request):
+    """Metriche delle generazioni in formato testo Prometheus"""
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @csrf_exempt
 @require_http_methods(["POST", "GET"])
-def test_ollama(request):
+async def test_ollama(request):
     """Test Ollama connection"""
     try:
         if request.method == "GET":
+            data = {}
             prompt = "Say 'Hello, I am working!' in one sentence."
         else:
             data = json.loads(request.body)
             prompt = data.get('prompt', 'Hello, how are you?')
         
-        response_text = call_ollama(prompt, max_tokens=500)
+        error = invalid_model(data)
+        if error:
+            return error
+        choice = choose_model('test_ollama', data.get('model'))
+        timings = start_timings('test_ollama')
         
-        return JsonResponse({
+        generation = await agenerate(
+            prompt, max_tokens=500, cache_mode=data.get('cache'), endpoint='test_ollama',
+            model=choice.model
+        )
+        
+        response = JsonResponse(finish({
             'success': True,
-            'response': response_text,
-            'model': settings.OLLAMA_MODEL
-        })
+            'response': generation.text,
+            **choice.metadata()
+        }, timings))
+        response['X-Cache'] = generation.cache_status.upper()
+        return response
         
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -103,7 +264,7 @@ def test_ollama(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def generate_strategy(request):
+async def generate_strategy(request):
     """Genera una strategia di contenuto completa"""
     try:
         data = json.loads(request.body)
@@ -119,36 +280,36 @@ def generate_strategy(request):
                 'error': 'Niche is required'
             }, status=400)
         
-        prompt = get_strategy_prompt(niche, target_audience, goals, posting_frequency)
-        response_text = call_ollama(prompt, temperature=0.8, max_tokens=4000)
-        
-        # Prova a parsare come JSON
-        try:
-            strategy_json = json.loads(response_text)
-            
-            return JsonResponse({
-                'success': True,
-                'strategy': strategy_json,
-                'metadata': {
-                    'niche': niche,
-                    'target_audience': target_audience,
-                    'goals': goals,
-                    'posting_frequency': posting_frequency
-                }
-            })
-        except json.JSONDecodeError as e:
-            # Se il parsing fallisce, restituisci comunque il testo pulito
+        mode = data.get('mode', settings.STRATEGY_DEFAULT_MODE)
+        if mode not in STRATEGY_MODES:
             return JsonResponse({
-                'success': True,
-                'strategy': response_text,
-                'metadata': {
-                    'niche': niche,
-                    'target_audience': target_audience,
-                    'goals': goals,
-                    'posting_frequency': posting_frequency
-                },
-                'warning': f'Response was not valid JSON: {str(e)}'
-            })
+                'success': False,
+                'error': f"mode must be one of: {', '.join(STRATEGY_MODES)}"
+            }, status=400)
+        
+        extra = {
+            'metadata': {
+                'niche': niche,
+                'target_audience': target_audience,
+                'goals': goals,
+                'posting_frequency': posting_frequency,
+                'mode': mode
+            }
+        }
+        
+        if mode == 'pipelined':
+            error = invalid_cache_mode(data) or invalid_model(data)
+            if error:
+                return error
+            model = select_model(data, 'generate_strategy', extra)
+            events = apipeline_strategy(
+                niche, target_audience, goals, posting_frequency, data.get('cache'), model
+            )
+            return await _pipeline(request, data, 'generate_strategy', events, 'strategy', extra, model)
+        
+        prompt = get_strategy_prompt(niche, target_audience, goals, posting_frequency)
+        return await _generate(request, data, 'generate_strategy', prompt, 0.8, 4000,
+                               'strategy', extra, allow_async=True, fields=extra['metadata'])
         
     except Exception as e:
         return JsonResponse({
@@ -160,7 +321,7 @@ def generate_strategy(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def generate_content(request):
+async def generate_content(request):
     """Genera contenuto per un singolo post"""
     try:
         data = json.loads(request.body)
@@ -177,45 +338,83 @@ def generate_content(request):
             }, status=400)
         
         prompt = get_content_prompt(topic, post_type, tone, target_audience)
-        response_text = call_ollama(prompt, temperature=0.7, max_tokens=1500)
+        extra = {
+            'metadata': {
+                'topic': topic,
+                'post_type': post_type,
+                'tone': tone,
+                'target_audience': target_audience
+            }
+        }
+        return await _generate(request, data, 'generate_content', prompt, 0.7, 1500, 'content', extra,
+                               fields=extra['metadata'])
         
-        try:
-            content_json = json.loads(response_text)
-            
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to generate content.'
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def generate_content_batch(request):
+    """Genera contenuti per piu' brief in una sola chiamata"""
+    try:
+        data = json.loads(request.body)
+        
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
             return JsonResponse({
-                'success': True,
-                'content': content_json,
-                'metadata': {
-                    'topic': topic,
-                    'post_type': post_type,
-                    'tone': tone,
-                    'target_audience': target_audience
-                }
-            })
-        except json.JSONDecodeError as e:
+                'success': False,
+                'error': 'items must be a non-empty list'
+            }, status=400)
+        
+        max_items = settings.BATCH_CONTENT['MAX_ITEMS']
+        if len(items) > max_items:
             return JsonResponse({
-                'success': True,
-                'content': response_text,
-                'metadata': {
-                    'topic': topic,
-                    'post_type': post_type,
-                    'tone': tone,
-                    'target_audience': target_audience
-                },
-                'warning': f'Response was not valid JSON: {str(e)}'
-            })
+                'success': False,
+                'error': f'At most {max_items} items per batch'
+            }, status=400)
+        
+        error = invalid_cache_mode(data) or invalid_model(data)
+        if error:
+            return error
         
+        choice = choose_model('generate_content_batch', data.get('model'))
+        timings = start_timings('generate_content_batch')
+        started = time.monotonic()
+        results = abatch_content(items, bool(data.get('pack')), data.get('cache'), choice.model)
+        
+        def summarize(done):
+            return {**batch_summary(done, started), **choice.metadata()}
+        
+        fmt = get_stream_format(request, data)
+        if fmt:
+            get_scheduler().check_admission()
+            return streaming_response(fmt, relay_batch(fmt, results, summarize, timings))
+        
+        collected = sorted([result async for result in results], key=lambda result: result['index'])
+        return JsonResponse(finish({
+            'success': True,
+            'results': collected,
+            'summary': summarize(collected)
+        }, timings))
+        
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return JsonResponse({
             'success': False,
             'error': str(e),
-            'message': 'Failed to generate content.'
+            'message': 'Failed to generate content batch.'
         }, status=500)
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def generate_trending_reels(request):
+async def generate_trending_reels(request):
     """Genera 10 idee per reels trending"""
     try:
         data = json.loads(request.body)
@@ -224,29 +423,14 @@ def generate_trending_reels(request):
         target_audience = data.get('target_audience', 'General audience')
         
         prompt = get_trending_reels_prompt(niche, target_audience)
-        response_text = call_ollama(prompt, temperature=0.9, max_tokens=3000)
-        
-        try:
-            ideas_json = json.loads(response_text)
-            
-            return JsonResponse({
-                'success': True,
-                'ideas': ideas_json,
-                'metadata': {
-                    'niche': niche,
-                    'target_audience': target_audience
-                }
-            })
-        except json.JSONDecodeError as e:
-            return JsonResponse({
-                'success': True,
-                'ideas': response_text,
-                'metadata': {
-                    'niche': niche,
-                    'target_audience': target_audience
-                },
-                'warning': f'Response was not valid JSON: {str(e)}'
-            })
+        extra = {
+            'metadata': {
+                'niche': niche,
+                'target_audience': target_audience
+            }
+        }
+        return await _generate(request, data, 'generate_trending_reels', prompt, 0.9, 3000, 'ideas', extra,
+                               fields=extra['metadata'])
         
     except Exception as e:
         return JsonResponse({
@@ -258,7 +442,7 @@ def generate_trending_reels(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def optimize_idea(request):
+async def optimize_idea(request):
     """Ottimizza un'idea di contenuto esistente"""
     try:
         data = json.loads(request.body)
@@ -272,24 +456,11 @@ def optimize_idea(request):
                 'error': 'Idea content is required'
             }, status=400)
         
-        prompt = get_optimize_idea_prompt(idea_content, optimization_goal)
-        response_text = call_ollama(prompt, temperature=0.7, max_tokens=1500)
-        
-        try:
-            optimized_json = json.loads(response_text)
-            
-            return JsonResponse({
-                'success': True,
-                'optimized_idea': optimized_json,
-                'original_idea': idea_content
-            })
-        except json.JSONDecodeError as e:
-            return JsonResponse({
-                'success': True,
-                'optimized_idea': response_text,
-                'original_idea': idea_content,
-                'warning': f'Response was not valid JSON: {str(e)}'
-            })
+        prompt = get_optimize_idea_prompt(budget.limit_text(idea_content, 'idea_content'), optimization_goal)
+        extra = {'original_idea': idea_content, 'optimization_goal': optimization_goal}
+        fields = {'idea_content': idea_content, 'optimization_goal': optimization_goal}
+        return await _generate(request, data, 'optimize_idea', prompt, 0.7, 1500,
+                               'optimized_idea', extra, fields=fields)
         
     except Exception as e:
         return JsonResponse({
@@ -301,7 +472,7 @@ def optimize_idea(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def regenerate_strategy(request):
+async def regenerate_strategy(request):
     """Rigenera una strategia basata su feedback"""
     try:
         data = json.loads(request.body)
@@ -315,28 +486,112 @@ def regenerate_strategy(request):
                 'error': 'Feedback is required'
             }, status=400)
         
-        prompt = get_regenerate_strategy_prompt(previous_strategy, feedback)
-        response_text = call_ollama(prompt, temperature=0.8, max_tokens=4000)
-        
-        try:
-            strategy_json = json.loads(response_text)
-            
+        mode = data.get('mode', settings.REGENERATE_DEFAULT_MODE)
+        if mode not in REGENERATE_MODES:
             return JsonResponse({
-                'success': True,
-                'strategy': strategy_json,
-                'feedback_applied': feedback
-            })
-        except json.JSONDecodeError as e:
-            return JsonResponse({
-                'success': True,
-                'strategy': response_text,
-                'feedback_applied': feedback,
-                'warning': f'Response was not valid JSON: {str(e)}'
-            })
+                'success': False,
+                'error': f"mode must be one of: {', '.join(REGENERATE_MODES)}"
+            }, status=400)
+        
+        extra = {'feedback_applied': feedback}
+        
+        if mode == 'incremental':
+            error = invalid_cache_mode(data) or invalid_model(data)
+            if error:
+                return error
+            previous = parse_previous_strategy(previous_strategy)
+            sections = target_sections(feedback) if previous else []
+            if sections:
+                extra['metadata'] = {'mode': 'incremental', 'regenerated_sections': sections}
+                model = select_model(data, 'regenerate_strategy', extra)
+                events = apipeline_regenerate(previous, sections, feedback, data.get('cache'), model)
+                return await _pipeline(
+                    request, data, 'regenerate_strategy', events, 'strategy', extra, model
+                )
+            # Strategia non parsabile o feedback generico: rigenerazione completa
+            extra['metadata'] = {
+                'mode': 'full',
+                'fallback_reason': 'previous_strategy is not valid JSON' if not previous
+                else 'feedback does not target specific sections'
+            }
+        
+        # La strategia precedente e' gia' nel context della sessione
+        session = load_session(data.get('session'))
+        if session is not None:
+            previous_strategy = None
+        else:
+            previous_strategy = budget.limit_strategy(previous_strategy)
+        prompt = get_regenerate_strategy_prompt(previous_strategy, feedback)
+        return await _generate(request, data, 'regenerate_strategy', prompt, 0.8, 4000,
+                               'strategy', extra, allow_async=True, session=session)
         
     except Exception as e:
         return JsonResponse({
             'success': False,
             'error': str(e),
             'message': 'Failed to regenerate strategy.'
-        }, status=500)
\ No newline at end of file
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+async def job_status(request, job_id):
+    """Stato, avanzamento e risultato di un job di generazione"""
+    try:
+        job = await GenerationJob.objects.aget(pk=job_id)
+    except GenerationJob.DoesNotExist:
+        return JsonResponse({
+            'success': False,
+            'error': 'Job not found'
+        }, status=404)
+
+    return JsonResponse({
+        'success': True,
+        'job': job.to_dict()
+    })
+
+
+@require_http_methods(["GET"])
+async def history_list(request, kind):
+    """Generazioni salvate, dalla piu' recente, con paginazione keyset"""
+    try:
+        items, cursor = await sync_to_async(history.list_page)(kind, request.GET)
+    except history.InvalidQuery as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+
+    next_url = None
+    if cursor:
+        params = request.GET.copy()
+        params['cursor'] = cursor
+        next_url = f"{request.path}?{params.urlencode()}"
+    return JsonResponse({
+        'success': True,
+        'results': items,
+        'next_cursor': cursor,
+        'next': next_url
+    })
+
+
+@require_http_methods(["GET"])
+async def history_detail(request, kind, pk):
+    """Una generazione salvata; ?fields= per limitare i campi"""
+    try:
+        entry = await sync_to_async(history.get_entry)(kind, pk, request.GET.get('fields'))
+    except history.InvalidQuery as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+    if entry is None:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not found'
+        }, status=404)
+
+    return JsonResponse({
+        'success': True,
+        'item': entry
+    })
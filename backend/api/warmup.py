@@ -0,0 +1,147 @@
+"""
+Warm-up dei modelli Ollama, per non pagare il caricamento del modello sulla
+prima richiesta dopo un riavvio o un periodo di inattivita'.
+
+- warm_all(): una generazione vuota (prompt '') per ogni modello di
+  OLLAMA_WARMUP['MODELS'] su ogni nodo del pool che lo ha; Ollama carica il
+  modello e lo tiene in memoria per il keep_alive configurato.
+- start_background(): warm-up all'avvio del server (AppConfig.ready) e poi
+  ogni KEEP_WARM_INTERVAL secondi, in un thread daemon.
+- areadiness(): quali modelli risultano caricati (/api/ps) e su quali nodi,
+  per l'health check.
+
+Da riga di comando: python manage.py warm_models
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+
+import httpx
+import requests
+from django.conf import settings
+
+from .budget import num_ctx_for
+from .ollama_client import get_async_client, get_sync_session, keep_alive_for
+from .routing import OPEN, get_router, model_matches
+
+
+logger = logging.getLogger(__name__)
+
+# Stati dell'health check
+READY = 'ready'
+LOADING = 'loading'
+UNAVAILABLE = 'unavailable'
+
+# Comandi di manage.py che servono richieste
+SERVER_COMMANDS = ('runserver',)
+# Server ASGI/WSGI che caricano l'applicazione
+SERVER_PROGRAMS = ('gunicorn', 'uvicorn', 'daphne', 'hypercorn')
+
+_stop = threading.Event()
+
+
+def warm_model(backend, model):
+    """Carica il modello sul nodo; restituisce i secondi impiegati"""
+    started = time.monotonic()
+    response = get_sync_session().post(
+        f'{backend.url}/api/generate',
+        # Stesso num_ctx delle generazioni, se no la prima richiesta ricarica il modello
+        json={'model': model, 'prompt': '', 'stream': False, 'keep_alive': keep_alive_for(model),
+              'options': {'num_ctx': num_ctx_for(model)}},
+        timeout=(settings.OLLAMA_CONNECT_TIMEOUT, settings.OLLAMA_TIMEOUT)
+    )
+    response.raise_for_status()
+    return time.monotonic() - started
+
+
+def warm_all(models=None):
+    """Warm-up di ogni modello su ogni nodo che lo ha; un risultato per coppia"""
+    router = get_router()
+    models = models or settings.OLLAMA_WARMUP['MODELS']
+    results = []
+    for backend in router.backends:
+        # Modelli del nodo non ancora noti: li chiede a /api/tags
+        if backend.models is None and not router.check(backend):
+            results.extend(
+                {'backend': backend.url, 'model': model, 'ok': False, 'error': 'unreachable'}
+                for model in models
+            )
+            continue
+        for model in models:
+            if not backend.has_model(model):
+                continue
+            try:
+                seconds = warm_model(backend, model)
+            except requests.RequestException as e:
+                logger.warning('Warm-up of %s on %s failed: %s', model, backend.url, e)
+                results.append({'backend': backend.url, 'model': model, 'ok': False, 'error': str(e)})
+            else:
+                results.append({'backend': backend.url, 'model': model, 'ok': True, 'seconds': round(seconds, 3)})
+    return results
+
+
+def is_server_process():
+    """True sotto gunicorn/uvicorn o runserver, non per migrate, test, pytest, celery, script..."""
+    argv0 = sys.argv[0] if sys.argv else ''
+    program = os.path.basename(argv0)
+    if program == '__main__.py':
+        # python -m gunicorn: argv[0] e' .../gunicorn/__main__.py
+        program = os.path.basename(os.path.dirname(argv0))
+    if program != 'manage.py':
+        return program in SERVER_PROGRAMS
+    if len(sys.argv) < 2 or sys.argv[1] not in SERVER_COMMANDS:
+        return False
+    # Con l'autoreload serve solo il processo figlio (RUN_MAIN)
+    return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+
+
+def start_background(interval=None):
+    """Warm-up subito e poi ogni interval secondi (0 = solo all'avvio)"""
+    if interval is None:
+        interval = settings.OLLAMA_WARMUP['KEEP_WARM_INTERVAL']
+    _stop.clear()
+
+    def loop():
+        warm_all()
+        while interval > 0 and not _stop.wait(interval):
+            warm_all()
+
+    thread = threading.Thread(target=loop, name='ollama-keep-warm', daemon=True)
+    thread.start()
+    return thread
+
+
+def stop_background():
+    _stop.set()
+
+
+async def aloaded_models(backend):
+    """Modelli in memoria sul nodo secondo /api/ps, None se non risponde"""
+    try:
+        response = await get_async_client().get(
+            f'{backend.url}/api/ps', timeout=settings.OLLAMA_CONNECT_TIMEOUT
+        )
+        response.raise_for_status()
+        return {model['name'] for model in response.json().get('models', [])}
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+async def areadiness():
+    """Stato e, per ogni modello da tenere caldo, i nodi su cui e' caricato"""
+    backends = [backend for backend in get_router().backends if backend.state != OPEN]
+    loaded = await asyncio.gather(*(aloaded_models(backend) for backend in backends))
+    models = {
+        model: [backend.url for backend, names in zip(backends, loaded) if names and model_matches(model, names)]
+        for model in settings.OLLAMA_WARMUP['MODELS']
+    }
+    if all(names is None for names in loaded):
+        status = UNAVAILABLE
+    elif all(models.values()):
+        status = READY
+    else:
+        status = LOADING
+    return {'status': status, 'models': models}
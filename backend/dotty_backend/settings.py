@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import socket
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -24,7 +25,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'django-insecure-change-this-in-production')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# DJANGO_DEBUG=false nel profilo di produzione (Dockerfile / gunicorn)
+DEBUG = os.environ.get('DJANGO_DEBUG', 'true').lower() == 'true'
 
 """ ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
 ALLOWED_HOSTS.extend(['.ngrok-free.app', '.ngrok.io']) """
@@ -55,6 +57,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Middleware da togliere per deployment, separati da virgole, es.
+# DJANGO_DISABLED_MIDDLEWARE=django.contrib.messages.middleware.MessageMiddleware
+DISABLED_MIDDLEWARE = [
+    name.strip() for name in os.environ.get('DJANGO_DISABLED_MIDDLEWARE', '').split(',') if name.strip()
+]
+MIDDLEWARE = [name for name in MIDDLEWARE if name not in DISABLED_MIDDLEWARE]
+
 # Configura CORS per Supabase Edge Functions
 """ CORS_ALLOWED_ORIGINS = os.environ.get('CORS_ALLOWED_ORIGINS', '').split(',')
 CORS_ALLOW_ALL_ORIGINS = DEBUG  # Solo in development """
@@ -86,12 +95,33 @@ WSGI_APPLICATION = 'dotty_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite di default, in WAL: le letture dello storico non aspettano le
+# scritture delle generazioni. Con POSTGRES_DB si usa Postgres (psycopg).
+if os.environ.get('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', '0')),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -135,3 +165,244 @@ STATIC_URL = 'static/'
 
 OLLAMA_BASE_URL = os.environ.get('OLLAMA_BASE_URL', 'http://ollama:11434')
 OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3.2')
+
+# Pool di connessioni verso Ollama (condiviso da tutte le view async)
+OLLAMA_TIMEOUT = float(os.environ.get('OLLAMA_TIMEOUT', '600'))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get('OLLAMA_CONNECT_TIMEOUT', '10'))
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get('OLLAMA_MAX_CONNECTIONS', '64'))
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('OLLAMA_MAX_KEEPALIVE_CONNECTIONS', '16'))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.environ.get('OLLAMA_KEEPALIVE_EXPIRY', '30'))
+
+# Cache delle risposte di Ollama: memory | file | django | none
+OLLAMA_CACHE = {
+    'BACKEND': os.environ.get('OLLAMA_CACHE_BACKEND', 'memory'),
+    'LOCATION': os.environ.get('OLLAMA_CACHE_LOCATION', str(BASE_DIR / '.ollama_cache')),
+    'TTL': int(os.environ.get('OLLAMA_CACHE_TTL', '86400')),
+    'MAX_ENTRIES': int(os.environ.get('OLLAMA_CACHE_MAX_ENTRIES', '512')),
+}
+
+# Storico delle generazioni (api/history.py, GET /api/history/<kind>/)
+GENERATION_HISTORY = {
+    'ENABLED': os.environ.get('GENERATION_HISTORY_ENABLED', 'true').lower() == 'true',
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+}
+
+# Risultati precalcolati per le nicchie popolari (api/precompute.py): NICHES
+# separate da virgole piu' le POPULAR_LIMIT piu' richieste negli ultimi
+# POPULARITY_WINDOW_DAYS giorni; freschi per MAX_AGE secondi, serviti e
+# rigenerati in background fino a MAX_STALE (entro il TTL di OLLAMA_CACHE).
+# ENABLED avvia la scansione periodica nel server
+PRECOMPUTE = {
+    'ENABLED': os.environ.get('PRECOMPUTE_ENABLED', 'false').lower() == 'true',
+    'ENDPOINTS': ['generate_trending_reels', 'generate_strategy'],
+    'NICHES': [niche.strip() for niche in os.environ.get('PRECOMPUTE_NICHES', '').split(',') if niche.strip()],
+    'POPULAR_LIMIT': int(os.environ.get('PRECOMPUTE_POPULAR_LIMIT', '50')),
+    'POPULARITY_WINDOW_DAYS': int(os.environ.get('PRECOMPUTE_POPULARITY_WINDOW_DAYS', '7')),
+    'MAX_AGE': int(os.environ.get('PRECOMPUTE_MAX_AGE', '21600')),
+    'MAX_STALE': int(os.environ.get('PRECOMPUTE_MAX_STALE', '86400')),
+    'REFRESH_INTERVAL': float(os.environ.get('PRECOMPUTE_REFRESH_INTERVAL', '600')),
+    'IDLE_POLL': 5,
+    # Un solo Refresher tra tutti i processi che condividono questo file
+    'LOCK_FILE': os.environ.get('PRECOMPUTE_LOCK_FILE', str(BASE_DIR / '.ollama_locks' / 'precompute.lock')),
+    # Dopo tutte le classi di OLLAMA_SCHEDULER['PRIORITIES']
+    'PRIORITY': 9,
+}
+
+# Cache semantica (api/semantic_cache.py): richieste con campi simili sopra
+# THRESHOLD (similarita' coseno degli embeddings di MODEL, da scaricare in
+# Ollama, vettori da 768 dimensioni come nomic-embed-text) riusano l'output.
+# BACKEND: auto | numpy | pgvector; MAX_ENTRIES e' per endpoint e modello
+OLLAMA_SEMANTIC_CACHE = {
+    'ENABLED': os.environ.get('OLLAMA_SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true',
+    'MODEL': os.environ.get('OLLAMA_EMBED_MODEL', 'nomic-embed-text'),
+    'THRESHOLD': float(os.environ.get('OLLAMA_SEMANTIC_CACHE_THRESHOLD', '0.92')),
+    'BACKEND': os.environ.get('OLLAMA_SEMANTIC_CACHE_BACKEND', 'auto'),
+    'ENDPOINTS': ['generate_strategy', 'generate_content', 'generate_trending_reels', 'optimize_idea'],
+    'TTL': int(os.environ.get('OLLAMA_SEMANTIC_CACHE_TTL', '604800')),
+    'MAX_ENTRIES': int(os.environ.get('OLLAMA_SEMANTIC_CACHE_MAX_ENTRIES', '2000')),
+    # Backend numpy: ogni quanto ricaricare l'indice dal database
+    'RELOAD_INTERVAL': int(os.environ.get('OLLAMA_SEMANTIC_CACHE_RELOAD_INTERVAL', '60')),
+}
+
+# Coalescing delle generazioni identiche in corso. CROSS_PROCESS richiede
+# un backend di cache condiviso tra i processi ('file' o 'django').
+OLLAMA_SINGLEFLIGHT = {
+    'CROSS_PROCESS': os.environ.get('OLLAMA_SINGLEFLIGHT_CROSS_PROCESS', 'false').lower() == 'true',
+    'LOCK_DIR': os.environ.get('OLLAMA_SINGLEFLIGHT_LOCK_DIR', str(BASE_DIR / '.ollama_locks')),
+    'POLL_INTERVAL': 0.2,
+}
+
+# Job di generazione in background
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', '100'))
+# Servizio che esegue i job (web, admin, ...): all'avvio ognuno segna FAILED
+# solo i propri job rimasti da un avvio precedente
+JOB_OWNER = os.environ.get('JOB_OWNER') or socket.gethostname()
+
+# Scheduler davanti a Ollama: concorrenza massima, coda limitata e classi
+# di priorita' per endpoint (numero piu' basso = servito prima)
+OLLAMA_SCHEDULER = {
+    'MAX_CONCURRENCY': int(os.environ.get('OLLAMA_MAX_CONCURRENCY', '2')),
+    'MAX_QUEUE': int(os.environ.get('OLLAMA_MAX_QUEUE', '16')),
+    'INITIAL_TOKENS_PER_SECOND': float(os.environ.get('OLLAMA_INITIAL_TOKENS_PER_SECOND', '8')),
+    'DEFAULT_PRIORITY': 2,
+    'PRIORITIES': {
+        'test_ollama': 0,
+        'optimize_idea': 0,
+        'generate_content': 1,
+        'generate_content_batch': 2,
+        'generate_trending_reels': 2,
+        'generate_strategy': 3,
+        'regenerate_strategy': 3,
+    },
+}
+
+# Strategia: 'single' (un'unica chiamata) o 'pipelined' (outline + calendario
+# generato a blocchi in parallelo); il body puo' sovrascriverlo con "mode"
+STRATEGY_DEFAULT_MODE = os.environ.get('STRATEGY_DEFAULT_MODE', 'single')
+STRATEGY_CALENDAR_CHUNK_DAYS = int(os.environ.get('STRATEGY_CALENDAR_CHUNK_DAYS', '10'))
+
+# Rigenerazione: 'full' (tutta la strategia) o 'incremental' (solo le
+# sezioni citate nel feedback); il body puo' sovrascriverlo con "mode"
+REGENERATE_DEFAULT_MODE = os.environ.get('REGENERATE_DEFAULT_MODE', 'full')
+
+# Output strutturato: 'schema' passa a Ollama lo schema JSON dell'endpoint
+# come "format" (Ollama >= 0.5), 'json' solo il JSON mode, 'off' niente
+OLLAMA_STRUCTURED_OUTPUT = os.environ.get('OLLAMA_STRUCTURED_OUTPUT', 'schema')
+
+# Budget di token (api/budget.py). num_ctx fisso per modello ('default', o per
+# modello con OLLAMA_NUM_CTX_MODELS="llama3.2=8192;llama3.2:1b=4096"): Ollama
+# ricarica il modello a ogni num_ctx diverso. num_predict per richiesta: il
+# max_tokens della view, alzato se l'output previsto dallo schema (stringhe da
+# STRING_TOKENS, array senza maxItems da ARRAY_ITEMS elementi) per
+# OUTPUT_MARGIN e' piu' grande. MAX_INPUT_TOKENS limita gli input liberi nel prompt
+OLLAMA_TOKEN_BUDGET = {
+    'ENABLED': os.environ.get('OLLAMA_TOKEN_BUDGET_ENABLED', 'true').lower() == 'true',
+    'CHARS_PER_TOKEN': float(os.environ.get('OLLAMA_CHARS_PER_TOKEN', '3.5')),
+    'STRING_TOKENS': 8,
+    'ARRAY_ITEMS': 5,
+    'OUTPUT_MARGIN': float(os.environ.get('OLLAMA_OUTPUT_MARGIN', '1.25')),
+    'MIN_PREDICT': 512,
+    'NUM_CTX': {
+        'default': int(os.environ.get('OLLAMA_NUM_CTX', '8192')),
+        **{
+            model.strip(): int(value)
+            for model, _, value in (
+                entry.partition('=') for entry in os.environ.get('OLLAMA_NUM_CTX_MODELS', '').split(';')
+                if entry.strip()
+            )
+        },
+    },
+    'MAX_INPUT_TOKENS': {'previous_strategy': 3000, 'idea_content': 800},
+}
+
+# Richieste hedged (api/hedging.py) per gli endpoint brevi, solo con piu'
+# nodi in OLLAMA_BASE_URLS: se il primo token non arriva entro il PERCENTILE
+# dei tempi osservati (INITIAL_DELAY finche' ci sono meno di MIN_SAMPLES
+# campioni) parte un duplicato su un altro nodo. I duplicati sono al massimo
+# MAX_RATE delle richieste, con BURST di margine
+OLLAMA_HEDGING = {
+    'ENABLED': os.environ.get('OLLAMA_HEDGING_ENABLED', 'false').lower() == 'true',
+    'ENDPOINTS': ['optimize_idea', 'generate_content', 'test_ollama'],
+    'PERCENTILE': float(os.environ.get('OLLAMA_HEDGING_PERCENTILE', '95')),
+    'WINDOW_SECONDS': 600,
+    'MIN_SAMPLES': 20,
+    'INITIAL_DELAY': float(os.environ.get('OLLAMA_HEDGING_INITIAL_DELAY', '2')),
+    'MAX_RATE': float(os.environ.get('OLLAMA_HEDGING_MAX_RATE', '0.1')),
+    'BURST': 5,
+}
+
+# Validazione delle risposte contro gli schemi (api/schemas.py) con retry
+# mirato delle sole parti mancanti; MAX_ROUNDS e' il numero di giri di retry
+OLLAMA_VALIDATION = {
+    'ENABLED': os.environ.get('OLLAMA_VALIDATION_ENABLED', 'true').lower() == 'true',
+    'MAX_ROUNDS': int(os.environ.get('OLLAMA_VALIDATION_MAX_ROUNDS', '2')),
+}
+
+# Batch di contenuti (/api/generate-content/batch/): elementi massimi per
+# richiesta, generazioni in volo per batch e, con "pack": true, quanti brief
+# brevi (topic fino a PACK_MAX_TOPIC_CHARS caratteri) finiscono in un prompt
+BATCH_CONTENT = {
+    'MAX_ITEMS': int(os.environ.get('BATCH_CONTENT_MAX_ITEMS', '60')),
+    'CONCURRENCY': int(os.environ.get('BATCH_CONTENT_CONCURRENCY', '4')),
+    'PACK_SIZE': int(os.environ.get('BATCH_CONTENT_PACK_SIZE', '3')),
+    'PACK_MAX_TOPIC_CHARS': int(os.environ.get('BATCH_CONTENT_PACK_MAX_TOPIC_CHARS', '120')),
+}
+
+# Pool di nodi Ollama: OLLAMA_BASE_URLS e' una lista separata da virgole
+# (default: il solo OLLAMA_BASE_URL). OLLAMA_BACKEND_MODELS fissa i modelli
+# disponibili per nodo, es. "http://a:11434=llama3.2,llama3.2:1b;http://b:11434=llama3.2:1b";
+# per i nodi non elencati i modelli vengono letti da /api/tags
+OLLAMA_BASE_URLS = [
+    url.strip().rstrip('/')
+    for url in os.environ.get('OLLAMA_BASE_URLS', OLLAMA_BASE_URL).split(',')
+    if url.strip()
+]
+OLLAMA_BACKEND_MODELS = {
+    url.strip().rstrip('/'): [model.strip() for model in models.split(',') if model.strip()]
+    for url, _, models in (
+        entry.partition('=') for entry in os.environ.get('OLLAMA_BACKEND_MODELS', '').split(';')
+        if entry.strip()
+    )
+}
+
+# Router del pool: STRATEGY 'least_outstanding' o 'latency'; un nodo viene
+# escluso dopo FAILURE_THRESHOLD errori consecutivi e riprovato dopo
+# RECOVERY_TIME secondi; HEALTH_CHECK_INTERVAL=0 disattiva i check attivi
+OLLAMA_ROUTING = {
+    'STRATEGY': os.environ.get('OLLAMA_ROUTING_STRATEGY', 'least_outstanding'),
+    'FAILURE_THRESHOLD': int(os.environ.get('OLLAMA_FAILURE_THRESHOLD', '3')),
+    'RECOVERY_TIME': float(os.environ.get('OLLAMA_RECOVERY_TIME', '30')),
+    'HEALTH_CHECK_INTERVAL': float(os.environ.get('OLLAMA_HEALTH_CHECK_INTERVAL', '15')),
+    'LATENCY_SMOOTHING': 0.2,
+}
+
+# Modelli per tier e politica di scelta (api/tiering.py): tier per endpoint,
+# e gli endpoint DEGRADABLE passano al modello veloce se la coda supera
+# MAX_QUEUE_DEPTH o il p95 della latenza del modello grande (negli ultimi
+# WINDOW_SECONDS) supera MAX_P95_SECONDS. Il body puo' scegliere con "model"
+OLLAMA_MODELS = {
+    'large': os.environ.get('OLLAMA_LARGE_MODEL', OLLAMA_MODEL),
+    'fast': os.environ.get('OLLAMA_FAST_MODEL', OLLAMA_MODEL),
+}
+OLLAMA_MODEL_POLICY = {
+    'DEFAULT_TIER': 'large',
+    'ENDPOINT_TIERS': {
+        'test_ollama': 'fast',
+        'optimize_idea': 'fast',
+    },
+    'DEGRADABLE': ['generate_strategy', 'regenerate_strategy'],
+    'MAX_QUEUE_DEPTH': int(os.environ.get('OLLAMA_DEGRADE_QUEUE_DEPTH', '4')),
+    'MAX_P95_SECONDS': float(os.environ.get('OLLAMA_DEGRADE_P95_SECONDS', '90')),
+    'WINDOW_SECONDS': float(os.environ.get('OLLAMA_LATENCY_WINDOW_SECONDS', '300')),
+}
+
+# Modelli tenuti in memoria da Ollama: keep_alive inviato con ogni richiesta
+# ('default', o per modello con OLLAMA_KEEP_ALIVE_MODELS="llama3.2=1h;llama3.2:1b=-1";
+# -1 = mai scaricato). Il warm-up carica i MODELS su ogni nodo all'avvio del
+# server (ON_STARTUP) e li rinfresca ogni KEEP_WARM_INTERVAL secondi (0 = mai)
+OLLAMA_KEEP_ALIVE = {
+    'default': os.environ.get('OLLAMA_KEEP_ALIVE', '30m'),
+    **{
+        model.strip(): value.strip()
+        for model, _, value in (
+            entry.partition('=') for entry in os.environ.get('OLLAMA_KEEP_ALIVE_MODELS', '').split(';')
+            if entry.strip()
+        )
+    },
+}
+OLLAMA_WARMUP = {
+    'ON_STARTUP': os.environ.get('OLLAMA_WARMUP_ON_STARTUP', 'true').lower() == 'true',
+    'MODELS': list(dict.fromkeys(OLLAMA_MODELS.values())),
+    'KEEP_WARM_INTERVAL': float(os.environ.get('OLLAMA_KEEP_WARM_INTERVAL', '240')),
+}
+
+# Sessioni (api/sessions.py): il context di Ollama delle generazioni di questi
+# endpoint resta in memoria per TTL secondi, e una richiesta con "session"
+# riparte da li' invece di rimandare tutto il testo precedente
+OLLAMA_SESSIONS = {
+    'ENDPOINTS': ['generate_strategy', 'regenerate_strategy'],
+    'TTL': int(os.environ.get('OLLAMA_SESSION_TTL', '1800')),
+    'MAX_ENTRIES': int(os.environ.get('OLLAMA_SESSION_MAX_ENTRIES', '256')),
+}
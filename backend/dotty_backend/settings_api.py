@@ -0,0 +1,31 @@
+"""
+Profilo solo API: DJANGO_SETTINGS_MODULE=dotty_backend.settings_api
+
+Le view di api/ sono JSON senza stato (csrf_exempt, niente login): sessioni,
+CSRF, autenticazione, messaggi, clickjacking, admin, rest_framework e
+staticfiles non servono a nessuna richiesta e costano a ogni richiesta e
+all'avvio. Qui restano solo le app e i middleware usati da /api/ e /metrics.
+
+L'admin resta disponibile col profilo completo (dotty_backend.settings),
+in un processo separato: vedi il servizio "admin" nel docker-compose.yml.
+"""
+from .settings import *  # noqa: F401,F403
+
+
+INSTALLED_APPS = [
+    'corsheaders',
+    'api',
+]
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+MIDDLEWARE = [name for name in MIDDLEWARE if name not in DISABLED_MIDDLEWARE]  # noqa: F405
+
+ROOT_URLCONF = 'dotty_backend.urls_api'
+
+# Nessuna pagina HTML da renderizzare
+TEMPLATES = []
+AUTH_PASSWORD_VALIDATORS = []
@@ -0,0 +1,11 @@
+"""
+URL del profilo solo API (dotty_backend.settings_api): niente admin
+"""
+from django.urls import path, include
+
+from api import views as api_views
+
+urlpatterns = [
+    path('api/', include('api.urls')),
+    path('metrics', api_views.metrics, name='metrics'),
+]
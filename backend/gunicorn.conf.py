@@ -0,0 +1,55 @@
+"""
+Configurazione di gunicorn per la produzione (al posto di runserver):
+
+    gunicorn dotty_backend.asgi:application -c gunicorn.conf.py
+
+Worker uvicorn (ASGI): le view async, lo streaming e il long-poll dei job
+restano sull'event loop senza occupare un thread per richiesta.
+
+Worker: GUNICORN_WORKERS (un numero o 'auto' = numero di core), default 1.
+Lo scheduler (api/scheduler.py), le metriche di /metrics (api/metrics.py),
+il single-flight e il router sono per processo: con N worker Ollama vede
+fino a N x OLLAMA_MAX_CONCURRENCY generazioni insieme e ogni scrape legge i
+contatori di un worker a caso, quindi on_starting lo segnala nel log. Un
+worker uvicorn regge comunque molte connessioni: il lavoro pesante lo fa
+Ollama e le richieste in attesa non occupano thread.
+"""
+import multiprocessing
+import os
+import uuid
+
+
+def _int(name, default):
+    return int(os.environ.get(name) or default)
+
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+_workers = os.environ.get('GUNICORN_WORKERS') or '1'
+workers = multiprocessing.cpu_count() if _workers == 'auto' else int(_workers)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+
+# Una generazione puo' durare fino a OLLAMA_TIMEOUT: il worker non va
+# ucciso prima, e allo shutdown/reload le richieste in corso devono finire
+generation_timeout = float(os.environ.get('OLLAMA_TIMEOUT') or 600)
+timeout = _int('GUNICORN_TIMEOUT', generation_timeout + 30)
+graceful_timeout = _int('GUNICORN_GRACEFUL_TIMEOUT', generation_timeout + 30)
+
+# Keep-alive verso proxy/ngrok: connessioni riusate tra richieste vicine
+keepalive = _int('GUNICORN_KEEPALIVE', 75)
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # Un avvio per master: i worker (anche quelli riavviati) condividono i job (api/jobs.py)
+    os.environ['JOB_BOOT_ID'] = uuid.uuid4().hex
+    # gunicorn legge anche -w e WEB_CONCURRENCY, che sovrascrivono workers qui sopra
+    if server.cfg.workers > 1:
+        server.log.warning(
+            '%d workers: scheduler, single-flight, router and /metrics are per process, so Ollama may see '
+            'up to %d x OLLAMA_MAX_CONCURRENCY generations and each /metrics scrape covers one worker',
+            server.cfg.workers, server.cfg.workers
+        )